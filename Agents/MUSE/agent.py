@@ -1,25 +1,26 @@
-import copy
-import os
 import re
-import sys
 import json
 import time
 import asyncio
-import tempfile
 import traceback
-import subprocess
 from pathlib import Path
 from abc import abstractmethod
 from dataclasses import dataclass
 from pydantic import BaseModel, Field
-from typing import AsyncGenerator, Union, Dict, Tuple, List, Callable
+from typing import AsyncGenerator, Union, Dict, Tuple, List, Callable, Optional
 
 from model import LLM
 from monitor import Monitor, SubTask
 from log import AgentLogger, LogLevel
-from memory_manager import MemoryManager
+from memory_manager import MemoryManager, MEMORY_INJECTION_RETRIEVAL
+from memory_store import MemoryStore
+from speculation import Speculation, messages_tokens
+from observation import get_observation_compressor
+from trajectory import Trajectory, TrajectorySnapshotWriter, track_copy_stats
+from interpreter_pool import get_interpreter_pool, STATUS_TIMEOUT as INTERPRETER_STATUS_TIMEOUT
 from tool import generate_tool_schema, ToolRegistry, generate_tool_des
-from utils import extract_json_codeblock, create_message, deep_update, pretty_print_trajectory, safe_json_parse
+from utils import extract_json_codeblock, create_message, deep_update, pretty_print_trajectory, safe_json_parse, RssHighWaterMark, \
+    HeadTailBuffer, sample_head_tail, estimate_tokens
 from prompt.system_prompt import MUSE_list_fact_prompt, MUSE_plan_subtasks_prompt, \
     MUSE_execute_subtask_prompt, MUSE_action_with_observation__instruction_prompt, task_final_plan_prompt, \
     task_replan_for_success_prompt, task_replan_for_failure_prompt, MUSE_execute_subtask_access_guide_prompt
@@ -29,6 +30,17 @@ from prompt.reflect_prompt import reflect_check_completion_prompt, reflect_updat
 from prompt.summarize_prompt import reflect_tool_enhance_prompt, reflect_methodology_enhance_prompt, \
     summarize_success_and_failure_prompt, merge_methodology_prompt, merge_application_prompt
 
+# Characters of a tool output kept for the LLM (head and tail); a streaming tool is stopped once its output grows
+# beyond `TOOL_OUTPUT_ABORT_FACTOR` times its budget
+TOOL_OUTPUT_BUDGETS = {
+    "python": 40000,
+    "access_the_application_guide": 40000,
+}
+DEFAULT_TOOL_OUTPUT_BUDGET = 60000
+TOOL_OUTPUT_ABORT_FACTOR = 4
+# Read-only tools: several calls of these in one LLM turn are executed concurrently
+PARALLEL_SAFE_TOOLS = {"access_the_application_guide", "extract_image_content_by_gpt4o"}
+
 
 @dataclass
 class ToolCallParseResult:
@@ -91,40 +103,34 @@ class BaseAgent:
             print(f"❌ Failed to save history: {e}")
             traceback.print_exc()
 
-    @staticmethod
-    def python_interpreter(code: str, work_dir: str = "workspace") -> str:
+    async def python_interpreter(self, code: str, work_dir: str = "workspace") -> str:
+        """
+        Execute the code in a pre-warmed interpreter of the shared pool.
+        The snippets of one task run in the same namespace, so their variables and imports are kept.
+        """
         STATUS_EXECUTED = "CODE_EXECUTED"
         STATUS_FAILURE_TIMEOUT = "TOOL_FAILURE_TIMEOUT"
         STATUS_FAILURE_EXCEPTION = "TOOL_FAILURE_UNKNOWN_EXCEPTION"
 
-        timeout = 270
-        result = {}
-        script_path = None
-
+        pool = get_interpreter_pool()
+        stream_budget = TOOL_OUTPUT_BUDGETS["python"] // 2
         try:
-            with tempfile.NamedTemporaryFile(mode='w+', suffix='.py', delete=False, dir=work_dir, encoding='utf-8') as f:
-                f.write(code)
-                script_path = f.name
-
-            proc = subprocess.run(
-                [sys.executable, script_path],
-                capture_output=True, text=True, timeout=timeout, cwd=work_dir, encoding='utf-8', errors='replace'
-            )
-
-            result = {
-                "execution_status": STATUS_EXECUTED,
-                "code_result": {
-                    "returncode": proc.returncode
-                },
-                "stdout": proc.stdout.strip(),
-                "stderr": proc.stderr.strip()
-            }
-
-        except subprocess.TimeoutExpired:
-            result = {
-                "execution_status": STATUS_FAILURE_TIMEOUT,
-                "stderr": f"Code execution timed out (terminated after {timeout} seconds)."
-            }
+            run = await pool.execute(code, task_id=str(self._get_output_dir()), work_dir=work_dir)
+            if run["status"] == INTERPRETER_STATUS_TIMEOUT:
+                result = {
+                    "execution_status": STATUS_FAILURE_TIMEOUT,
+                    "stderr": f"Code execution timed out (terminated after {pool.timeout} seconds). Variables of previous code snippets are lost."
+                }
+            else:
+                result = {
+                    "execution_status": STATUS_EXECUTED,
+                    "code_result": {
+                        "returncode": run["returncode"]
+                    },
+                    "stdout": sample_head_tail(run["stdout"].strip(), stream_budget),
+                    "stderr": sample_head_tail(run["stderr"].strip(), stream_budget)
+                }
+            print(f"[SYSTEM INFO][PYTHON] ℹ️ Snippet latency: {run['latency']}s (execution {run['exec_time']}s).")
 
         except Exception:
             result = {
@@ -132,13 +138,6 @@ class BaseAgent:
                 "exception": traceback.format_exc()
             }
 
-        finally:
-            if script_path and os.path.exists(script_path):
-                try:
-                    os.unlink(script_path)
-                except Exception:
-                    pass
-
         return json.dumps(result, ensure_ascii=False, indent=2)
 
     async def call_tool(
@@ -148,7 +147,7 @@ class BaseAgent:
     ) -> AsyncGenerator[Tuple[str, str], None]:
         tool_result = ""
         if tool_name == "python":
-            result = self.python_interpreter(arguments["code"])
+            result = await self.python_interpreter(arguments["code"])
             yield "[STREAMING]", result
             tool_result = result
         else:
@@ -208,6 +207,20 @@ class BaseAgent:
 
         return ToolCallParseResult(False, None, "No tool_call or python code found in the output.")
 
+    @staticmethod
+    def parse_parallel_tool_calls(ai_response: str) -> List[Dict[str, str]]:
+        """
+        All the tool calls of the response when there are several and every one of them is parallel-safe, else `[]`.
+        """
+        tool_jsons = []
+        for match in re.finditer(r'<tool_call>\s*({.*?})\s*</tool_call>', ai_response, re.DOTALL):
+            tool_call_json, _ = safe_json_parse(match.group(1).strip())
+            if not isinstance(tool_call_json, dict) or tool_call_json.get('name') not in PARALLEL_SAFE_TOOLS \
+                    or tool_call_json.get('arguments') is None:
+                return []
+            tool_jsons.append({"tool_name": tool_call_json['name'], "arguments": tool_call_json['arguments']})
+        return tool_jsons if len(tool_jsons) > 1 else []
+
     async def _in_context_step(self, prompt: str):
         """
         Have a single-step conversation with LLM. Both the input prompt and LLM's reply will be saved in the Agent's history.
@@ -269,10 +282,18 @@ class MUSE(BaseAgent):
             task_round: int=1,
             use_memory: bool = True,
             update_memory: bool = True,
+            memory_injection: str = MEMORY_INJECTION_RETRIEVAL,
+            memory_manager: MemoryManager = None,
             env_feedback_func: Callable[..., str]=None,
             env_feedback_args: dict=None,
-            lang="en"
+            lang="en",
+            speculative: bool = False
     ):
+        """
+        With `speculative`, the first ReAct step of the next subtask runs concurrently with the reflection on the
+        current one when the plan is confident, and the re-plan is prefetched once the reflection confirmed success.
+        Speculative results are discarded when the reflection or the re-plan invalidates them.
+        """
         super().__init__(init_model_name, sys_prompt_template, output_dir, agent_name, task_name)
         self.mode = mode_label
         self.task_round = task_round
@@ -281,7 +302,12 @@ class MUSE(BaseAgent):
         self.update_memory: bool = update_memory
 
         tool_schema_texts = self.render_tool_schema_texts()
-        self.memory_manager = MemoryManager(memory_dir, self.logger, self._get_output_dir(), sys_prompt_template, tool_schema_texts, use_memory)
+        if memory_manager is None:
+            self.memory_manager = MemoryManager(memory_dir, self.logger, self._get_output_dir(), sys_prompt_template, tool_schema_texts, use_memory, memory_injection)
+        else:
+            # Long-lived manager of a multi-task runner
+            self.memory_manager = memory_manager
+            self.memory_manager.start_task(self.logger, self._get_output_dir(), sys_prompt_template, tool_schema_texts)
         self.history = self.memory_manager.get_history()
 
         if (env_feedback_func is None) != (env_feedback_args is None):
@@ -292,12 +318,27 @@ class MUSE(BaseAgent):
         self.language_prompt = "\n请以中文输出" if lang=="zh" else ""
 
         self.to_do_subtasks: List[SubTask] = []
+        self.speculative = speculative
 
     async def _run(self, task: str) -> AsyncGenerator[str, None]:
+        # The memory statistics cover this episode only, also when other episodes run in the same process
+        self._rss = RssHighWaterMark()
+        self._rss.start()
+        self._copy_stats = track_copy_stats()
+        try:
+            async for chunk in self._run_task(task):
+                yield chunk
+        finally:
+            self._rss.stop()
+
+    async def _run_task(self, task: str) -> AsyncGenerator[str, None]:
         # All yield results are only used to display results to the user.
         # The context analysis is based on the data stored in the agent.history property.
 
         st_time = time.time()
+        snapshot_path = self._get_output_dir() / "trajectory.jsonl"
+        snapshot_path.unlink(missing_ok=True)
+        snapshot_writer = TrajectorySnapshotWriter(snapshot_path)
         # plan
         plan_trajectory = []
         async for chunk in self.initial_plan(task, plan_trajectory):
@@ -311,62 +352,100 @@ class MUSE(BaseAgent):
         # pretty_print_trajectory(plan_trajectory, show_full_content=True, print_to_terminal=True)
 
         # execute
-        while self.to_do_subtasks:
-            cur_subtask = self.to_do_subtasks.pop(0)
-            cur_subtask.set_index(self.monitor.subtasks_used + 1)
-            cur_subtask_prompt = f"SubTask{cur_subtask.index}: {cur_subtask.name}\nGoal: {cur_subtask.goal}"
-            self.logger.log_task(cur_subtask_prompt, subtitle=f"EXECUTING···", title=f"Execute Subtask")
-
-            subtask_retry_time_limit = 2
-            temperature = 0.5
-            need_guide = True
-            # react block
-            while cur_subtask.try_times < subtask_retry_time_limit:
-                cur_subtask.try_times += 1
-                async for chunk in self.exec_subtask(cur_subtask_prompt, self.subtask_action_limit, cur_subtask.trajectory, subtask_name=cur_subtask.name, temperature=temperature, need_guide=need_guide):
-                    yield chunk
-                # Used to block reflection =====================
-                # cur_subtask.finish = True
-                # break
-                # ===================================
-
-                async for chunk in self.reflect(task, cur_subtask):
-                    yield chunk
-
-                if cur_subtask.finish:
+        first_action: Optional[Speculation] = None
+        replan_prefetch: Optional[Speculation] = None
+        try:
+            while self.to_do_subtasks:
+                cur_subtask = self.to_do_subtasks.pop(0)
+                cur_subtask.set_index(self.monitor.subtasks_used + 1)
+                cur_subtask_prompt = f"SubTask{cur_subtask.index}: {cur_subtask.name}\nGoal: {cur_subtask.goal}"
+                self.logger.log_task(cur_subtask_prompt, subtitle=f"EXECUTING···", title=f"Execute Subtask")
+
+                subtask_retry_time_limit = 2
+                temperature = 0.5
+                need_guide = True
+                replan_prefetch = None
+                # react block
+                while cur_subtask.try_times < subtask_retry_time_limit:
+                    cur_subtask.try_times += 1
+                    limit_exceeded = self.monitor.exception.subtask_limit_exceeded
+                    async for chunk in self.exec_subtask(cur_subtask_prompt, self.subtask_action_limit, cur_subtask.trajectory, subtask_name=cur_subtask.name, temperature=temperature, need_guide=need_guide, first_action=first_action):
+                        yield chunk
+                    first_action = None
+                    # Used to block reflection =====================
+                    # cur_subtask.finish = True
+                    # break
+                    # ===================================
+
+                    # The plan is confident when the subtask ended by itself at the first try
+                    if self.speculative and cur_subtask.try_times == 1 and self.to_do_subtasks \
+                            and self.monitor.exception.subtask_limit_exceeded == limit_exceeded:
+                        first_action = self._speculate_first_action(self.to_do_subtasks[0], cur_subtask.trajectory)
+
+                    def _on_success():
+                        nonlocal replan_prefetch
+                        if self.speculative:
+                            replan_prefetch = self._prefetch_replan(task, cur_subtask)
+
+                    async for chunk in self.reflect(task, cur_subtask, on_success=_on_success):
+                        yield chunk
+                    if first_action is not None and not cur_subtask.finish:
+                        first_action.discard("the reflection found the subtask unfinished")
+                        first_action = None
+                    snapshot_writer.write(f"subtask_{cur_subtask.index}", cur_subtask.trajectory)
+
+                    if cur_subtask.finish:
+                        break
+                    if cur_subtask.try_times < subtask_retry_time_limit:
+                        cur_subtask_prompt += "\nThe goal of this subtask has not been achieved yet, please continue"
+                        temperature = 1.5
+                        need_guide = False
+                        self.logger.log_task(cur_subtask_prompt, subtitle="EXECUTING···", title=f"Re-execute Subtask {cur_subtask.index}: {cur_subtask.name}")
+                    else:
+                        self.logger.log_task(f"SubTask{cur_subtask.index}: {cur_subtask.name} Failed After {cur_subtask.try_times} Retries.", subtitle="EXECUTION DONE", title=f"Subtask Failed")
+
+                # record done sub-task
+                self.monitor.add_done_subtask(cur_subtask)
+                # add trajectory into main history, trimming replaces the trimmed records of the fork only
+                add_trajectory = cur_subtask.trajectory.fork()
+                self.memory_manager.trim_traj(add_trajectory)
+                self.memory_manager.add_traj(add_trajectory)
+
+                if self.is_limit_exceeded(action_used=self.monitor.num_actions, subtasks_used=self.monitor.subtasks_used, time_used=time.time() - st_time):
+                    if replan_prefetch is not None:
+                        replan_prefetch.discard("the task limit was exceeded")
                     break
-                if cur_subtask.try_times < subtask_retry_time_limit:
-                    cur_subtask_prompt += "\nThe goal of this subtask has not been achieved yet, please continue"
-                    temperature = 1.5
-                    need_guide = False
-                    self.logger.log_task(cur_subtask_prompt, subtitle="EXECUTING···", title=f"Re-execute Subtask {cur_subtask.index}: {cur_subtask.name}")
-                else:
-                    self.logger.log_task(f"SubTask{cur_subtask.index}: {cur_subtask.name} Failed After {cur_subtask.try_times} Retries.", subtitle="EXECUTION DONE", title=f"Subtask Failed")
-
-            # record done sub-task
-            self.monitor.add_done_subtask(cur_subtask)
-            # add trajectory into main history
-            add_trajectory = copy.deepcopy(cur_subtask.trajectory)
-            self.memory_manager.trim_traj(add_trajectory)
-            self.memory_manager.add_traj(add_trajectory)
 
-            if self.is_limit_exceeded(action_used=self.monitor.num_actions, subtasks_used=self.monitor.subtasks_used, time_used=time.time() - st_time):
-                break
+                if not cur_subtask.finish:
+                    async for chunk in self.replan(task_replan_for_failure_prompt.format(try_times=cur_subtask.try_times), task):
+                        yield chunk
+                elif len(self.to_do_subtasks) > 0:
+                    async for chunk in self.replan(task_replan_for_success_prompt, task, prefetched=replan_prefetch):
+                        yield chunk
+                else:
+                    async for chunk in self.replan(task_final_plan_prompt, task, prefetched=replan_prefetch):
+                        yield chunk
+                self.logger.log_task(self.history[-1]["content"][0]["text"], "RE-PLANNING···",
+                                     "Multi-Step Subtasks Re-Plan")
 
-            if not cur_subtask.finish:
-                async for chunk in self.replan(task_replan_for_failure_prompt.format(try_times=cur_subtask.try_times), task):
-                    yield chunk
-            elif len(self.to_do_subtasks) > 0:
-                async for chunk in self.replan(task_replan_for_success_prompt, task):
-                    yield chunk
-            else:
-                async for chunk in self.replan(task_final_plan_prompt, task):
-                    yield chunk
-            self.logger.log_task(self.history[-1]["content"][0]["text"], "RE-PLANNING···",
-                                 "Multi-Step Subtasks Re-Plan")
+                # self.memory_manager.rm_traj_by_length(len(add_trajectory) - 1, 5)
+                # self.history[-1]["content"][0]["text"] = "[SYSTEM INFO: History subtask tracks removed for brevity]\n" + self.history[-5]["content"][0]["text"]
 
-            # self.memory_manager.rm_traj_by_length(len(add_trajectory) - 1, 5)
-            # self.history[-1]["content"][0]["text"] = "[SYSTEM INFO: History subtask tracks removed for brevity]\n" + self.history[-5]["content"][0]["text"]
+            if first_action is not None:
+                first_action.discard("no subtask left to execute")
+        finally:
+            # The speculative calls must not outlive an exception of the subtask execution, reflection or re-plan
+            # (discarding a speculation that was already taken or discarded does nothing)
+            for speculation in (first_action, replan_prefetch):
+                if speculation is not None:
+                    speculation.discard("the task was interrupted")
+        if self.speculative:
+            stat = self.monitor.speculation
+            self.logger.log_task(
+                f"Speculations: {stat.launched} launched, {stat.accepted} accepted, {stat.discarded} discarded.\n"
+                f"Latency saved: {stat.time_saved}s, token overhead: ~{stat.wasted_tokens} of ~{stat.tokens} speculative tokens wasted.",
+                "END", "Speculative Execution"
+            )
 
         if not self.to_do_subtasks and self.monitor.done_subtasks[-1].finish:
             self.logger.log_task(f"Agent finish all the subtasks.\nTotal action steps: {self.monitor.num_actions}.", subtitle="DONE", title="Task Finished")
@@ -374,6 +453,8 @@ class MUSE(BaseAgent):
             self.logger.log_task(f"Agent don't finish all the subtasks.\nTotal action steps: {self.monitor.num_actions}.", subtitle="DONE", title="Task Failed")
 
         self.monitor.update_time(round(time.time() - st_time, 2))
+        self.monitor.update_memory_stats(self._rss.sample(), round(self._copy_stats["copy_time"], 4))
+        self.logger.log_task(f"Peak RSS during the episode: {self.monitor.peak_rss_mb} MB, trajectory copy time: {self.monitor.copy_time}s.", "END", "Memory Usage")
         self.logger.log_task(f"Time consumed to run the task: {self.monitor.time_used}s.", "END", "End Agent")
 
         # reflection
@@ -385,6 +466,9 @@ class MUSE(BaseAgent):
 
     async def initial_plan(self, task: str, plan_trajectory: List[dict]):
         user_prompt = f"<task>\n{task}\n</task>"
+        # Memory entries relevant to the whole task are injected while planning
+        self.memory_manager.set_retrieval_query(task)
+        self.memory_manager.update_system_prompt()
         async for chunk in self._multi_step_plan(user_prompt):
             yield chunk
         plan_trajectory.extend(self.history[:])
@@ -396,41 +480,60 @@ class MUSE(BaseAgent):
             subtask_trajectory: List[dict] = None,
             subtask_name: str = "",
             temperature: float = 1.0,
-            need_guide: bool = True
+            need_guide: bool = True,
+            first_action: Speculation = None
     ) -> AsyncGenerator[str, None]:
         """
         Determine if the LLM output contains tool execution requirements.
         If so, execute the tool. This process repeats until the LLM output no longer contains tool execution requirements.
+        `first_action` is a speculative first LLM step, taken only if it was made for the same prompt and system prompt.
         """
-        working_trajectory = copy.deepcopy(subtask_trajectory)
+        if isinstance(subtask_trajectory, Trajectory):
+            working_trajectory = subtask_trajectory.fork()
+        else:
+            working_trajectory = Trajectory(subtask_trajectory)
         def _append_turn(user_text: str, ai_text: str):
-            subtask_trajectory.extend([
-                create_message("user", user_text),
-                create_message("assistant", ai_text)
-            ])
-            working_trajectory.extend([
-                create_message("user", user_text),
-                create_message("assistant", ai_text)
-            ])
+            # Both trajectories share the same immutable records
+            turn = [create_message("user", user_text), create_message("assistant", ai_text)]
+            subtask_trajectory.extend(turn)
+            working_trajectory.extend(turn)
 
         start_index = len(subtask_trajectory)
+        get_observation_compressor().new_context()
+        self.memory_manager.set_retrieval_query(prompt)
         if need_guide:
             cur_prompt = MUSE_execute_subtask_prompt.format(subtask=prompt) + MUSE_execute_subtask_access_guide_prompt + self.language_prompt
         else:
             cur_prompt = MUSE_execute_subtask_prompt.format(subtask=prompt) + self.language_prompt
         exist_tool_call = True
         actions = 0
+        observation_ready = time.perf_counter()
         while exist_tool_call and (action_limit is None or actions < action_limit):
             self.memory_manager.update_system_prompt()
             self.memory_manager.trim_traj(working_trajectory, preserve_last=3)
+            get_observation_compressor().start_turn()
 
             ai_response = ""
-            async for chunk in self.llm.async_stream_generate(
-                    cur_prompt if actions == 0 else MUSE_action_with_observation__instruction_prompt.format(observation=cur_prompt) + self.language_prompt,
-                    history=self.history + working_trajectory, temperature=temperature
-            ):
-                yield chunk
-                ai_response += chunk
+            if first_action is not None:
+                if actions == 0 and first_action.key == (cur_prompt, self.history[0]["content"][0]["text"]):
+                    ai_response = await first_action.take() or ""
+                    observation_ready = None
+                    yield ai_response
+                else:
+                    first_action.discard("the subtask or its system prompt changed")
+                first_action = None
+            if not ai_response:
+                async for chunk in self.llm.async_stream_generate(
+                        cur_prompt if actions == 0 else MUSE_action_with_observation__instruction_prompt.format(observation=cur_prompt) + self.language_prompt,
+                        history=self.history + working_trajectory, temperature=temperature
+                ):
+                    if not ai_response and observation_ready is not None:
+                        ttft = time.perf_counter() - observation_ready
+                        observation_ready = None
+                        self.monitor.add_ttft(ttft)
+                        print(f"[SYSTEM INFO][LLM] ℹ️ Time to first token: {ttft:.2f}s.")
+                    yield chunk
+                    ai_response += chunk
 
             if not ai_response.strip():
                 yield "[SYSTEM WARNING: LLM response is empty, the ReAct workflow will end.]"
@@ -439,10 +542,12 @@ class MUSE(BaseAgent):
 
             parse_result = self.parse_tool_call(ai_response)
             if parse_result.tool_json:
-                self.logger.log_task(str(parse_result.tool_json), subtitle="SUB-TASK REACTING······", title=f"ReAct: Action {actions + 1} | For: {subtask_name}")
+                parallel_calls = self.parse_parallel_tool_calls(ai_response)
+                self.logger.log_task(str(parallel_calls or parse_result.tool_json), subtitle="SUB-TASK REACTING······", title=f"ReAct: Action {actions + 1} | For: {subtask_name}")
 
                 tool_call_result = None
-                async for status, chunk in self.call_tool(**parse_result.tool_json):
+                tool_calls = self.call_tools(parallel_calls) if parallel_calls else self.call_tool(**parse_result.tool_json)
+                async for status, chunk in tool_calls:
                     if status == "[DONE]":
                         yield "\n* * * * * * * * * * * *\n"
                         tool_call_result = chunk
@@ -467,6 +572,7 @@ class MUSE(BaseAgent):
 
             exist_tool_call = parse_result.exist_tool_call
             actions += 1
+            observation_ready = time.perf_counter()
 
         if actions == action_limit:
             self.monitor.inc_subtask_limit_exceeded()
@@ -480,8 +586,14 @@ class MUSE(BaseAgent):
         self.logger.log_task(f"The total number of actions currently executed is: {self.monitor.num_actions}.", "COUNTING···", "Num Actions")
         return
 
-    async def reflect(self, task, cur_subtask: SubTask):
+    async def reflect(self, task, cur_subtask: SubTask, on_success: Callable[[], None] = None):
+        """
+        `on_success` is called as soon as the subtask is confirmed finished and its trajectory is final, before the
+        remaining memory update of the reflection.
+        """
         env_feedback = self.get_env_feedback(cur_subtask.trajectory)
+        # The reflection observes the browser in its own history
+        get_observation_compressor().new_context()
 
         st_time = time.time()
         reflect_history = [create_message("system", reflect_sys_prompt.format(tools=self.memory_manager.tool_schema_texts))]
@@ -541,6 +653,12 @@ class MUSE(BaseAgent):
                 create_message("assistant", analysis)
             ])
         else:
+            cur_subtask.trajectory.extend([
+                create_message("user", reflect_analyse_success__display_prompt.format(check_report=check_report)),
+                create_message("assistant", "Got it! I'll continue with the task.")
+            ])
+            if on_success is not None:
+                on_success()
             if self.update_memory:
                 async for chunk in self.llm.async_stream_generate(
                         env_feedback + reflect_update_application_memory_prompt.format(guidance=self.memory_manager.application_enhance_dict) + self.language_prompt,
@@ -553,19 +671,56 @@ class MUSE(BaseAgent):
                     self.memory_manager.update_and_save_app_memory(app_memo_dict)
                 else:
                     self.monitor.add_memory_update_exception("update_procedural_memory", analysis)
-            cur_subtask.trajectory.extend([
-                create_message("user", reflect_analyse_success__display_prompt.format(check_report=check_report)),
-                create_message("assistant", "Got it! I'll continue with the task.")
-            ])
         cur_subtask.reflection.analysis = analysis
         cur_subtask.reflection.time_used = round(time.time()  - st_time, 2)
         cur_subtask.reflect_trajectory = reflect_history
 
-    async def replan(self, prompt, task: str):
-        user_prompt = prompt + f"\nAlways remember that your ultimate goal is to complete task:\n<task>\n{task}\n</task>"
-        async for chunk in self._multi_step_plan(user_prompt):
+    @staticmethod
+    def _replan_user_prompt(prompt: str, task: str) -> str:
+        return prompt + f"\nAlways remember that your ultimate goal is to complete task:\n<task>\n{task}\n</task>"
+
+    async def replan(self, prompt, task: str, prefetched: Speculation = None):
+        async for chunk in self._multi_step_plan(self._replan_user_prompt(prompt, task), prefetched):
             yield chunk
 
+    async def _collect(self, prompt: str, history: List[dict], temperature: float = 1.0) -> str:
+        response = ""
+        async for chunk in self.llm.async_stream_generate(prompt, history=history, temperature=temperature):
+            response += chunk
+        return response
+
+    def _speculate_first_action(self, subtask: SubTask, trajectory: Trajectory) -> Speculation:
+        """
+        Start the first ReAct step of the next subtask. Its history lacks the reflection and re-plan turns of the
+        current subtask, so it is only taken if the re-plan keeps the next subtask and its system prompt unchanged.
+        """
+        subtask_prompt = f"SubTask{self.monitor.subtasks_used + 2}: {subtask.name}\nGoal: {subtask.goal}"
+        cur_prompt = MUSE_execute_subtask_prompt.format(subtask=subtask_prompt) + MUSE_execute_subtask_access_guide_prompt + self.language_prompt
+        system_prompt = self.memory_manager.render_system_prompt(subtask_prompt, record_stats=False)
+        add_trajectory = trajectory.fork()
+        self.memory_manager.trim_traj(add_trajectory)
+        history = [create_message("system", system_prompt)] + self.history[1:] + list(add_trajectory)
+        return Speculation(
+            "first action", self._collect(cur_prompt, history, temperature=0.5),
+            messages_tokens(history) + estimate_tokens(cur_prompt), self.monitor.speculation,
+            key=(cur_prompt, system_prompt)
+        )
+
+    def _prefetch_replan(self, task: str, cur_subtask: SubTask) -> Speculation:
+        """
+        Start the first re-plan step after a successful subtask, with exactly the history the re-plan will see.
+        """
+        prompt = task_replan_for_success_prompt if self.to_do_subtasks else task_final_plan_prompt
+        cur_prompt = self._replan_user_prompt(prompt, task) + "\n\n" + MUSE_list_fact_prompt + self.language_prompt
+        add_trajectory = cur_subtask.trajectory.fork()
+        self.memory_manager.trim_traj(add_trajectory)
+        history = self.history + list(add_trajectory)
+        return Speculation(
+            "re-plan", self._collect(cur_prompt, history),
+            messages_tokens(history) + estimate_tokens(cur_prompt), self.monitor.speculation,
+            key=(cur_prompt, history)
+        )
+
     async def summarize_and_enhance(self):
         if self.update_memory:
             summarize_prompt = "Please summarize what you have done for this task." + self.language_prompt
@@ -628,10 +783,11 @@ class MUSE(BaseAgent):
         else:
             self.logger.log_task("Pass the summarize_and_enhance step", subtitle="WARNING···", title="update_memory set to False")
 
-    async def _multi_step_plan(self, user_prompt: str):
+    async def _multi_step_plan(self, user_prompt: str, prefetched: Speculation = None):
         """
         Multistep task planning, but the instructions during planning are not saved to working memory.
         Ultimately, only two messages are added to working memory: user_message->user_prompt, assistant_message->task_plan
+        `prefetched` is a speculative first planning step, taken only if it was made for the same prompt and history.
         """
         # self.llm = LLM("gemini-2.5-flash-thinking")deepseek-chat
 
@@ -639,9 +795,16 @@ class MUSE(BaseAgent):
 
         cur_prompt = user_prompt + "\n\n" + MUSE_list_fact_prompt + self.language_prompt
         known_facts = ""
-        async for chunk in self.llm.async_stream_generate(cur_prompt, history=self.history):
-            yield chunk
-            known_facts += chunk
+        if prefetched is not None:
+            if prefetched.key == (cur_prompt, self.history):
+                known_facts = await prefetched.take() or ""
+                yield known_facts
+            else:
+                prefetched.discard("the re-plan history changed")
+        if not known_facts:
+            async for chunk in self.llm.async_stream_generate(cur_prompt, history=self.history):
+                yield chunk
+                known_facts += chunk
         self.memory_manager.add_turn(create_message("user", user_prompt), create_message("assistant", known_facts))
         yield "\n\n"
 
@@ -759,26 +922,42 @@ class MUSE(BaseAgent):
             return ""
 
     async def call_tool(self, tool_name: str, arguments: dict) -> AsyncGenerator[tuple, None]:
+        """
+        The output kept for the LLM is sampled (head and tail) within the budget of the tool.
+        A streaming tool whose output grows far beyond its budget is closed early, which cancels its pending work.
+        """
         tool_result = {
             "data": "",
             "instruction": ""
         }
+        budget = TOOL_OUTPUT_BUDGETS.get(tool_name, DEFAULT_TOOL_OUTPUT_BUDGET)
         if tool_name == "python":
-            result = self.python_interpreter(arguments["code"])
+            result = await self.python_interpreter(arguments["code"])
             yield "[STREAMING]", result
-            tool_result["data"] = result
+            tool_result["data"] = sample_head_tail(result, budget)
         else:
             tool_function = self.tool_registrar.get_tool(tool_name)
             if tool_function:
+                output = HeadTailBuffer(budget)
+                aborted = False
                 try:
-                    async for tool_chunk in tool_function(**arguments):
-                        ToolResultFormatValidator.model_validate(tool_chunk)
-
-                        chunk = tool_chunk["data"]
-                        yield "[STREAMING]", chunk
-
-                        tool_result["data"] += chunk
-                        tool_result["instruction"] = tool_chunk.get("instruction", "")
+                    tool_stream = tool_function(**arguments)
+                    try:
+                        async for tool_chunk in tool_stream:
+                            ToolResultFormatValidator.model_validate(tool_chunk)
+
+                            chunk = tool_chunk["data"]
+                            yield "[STREAMING]", chunk
+
+                            output.feed(chunk)
+                            tool_result["instruction"] = tool_chunk.get("instruction", "")
+                            if output.total > budget * TOOL_OUTPUT_ABORT_FACTOR:
+                                aborted = True
+                                print(f"[SYSTEM WARNING][TOOL] ⚠️ The output of `{tool_name}` exceeded {budget * TOOL_OUTPUT_ABORT_FACTOR} characters, the tool was stopped early.")
+                                break
+                    finally:
+                        await tool_stream.aclose()
+                    tool_result["data"] = output.render(aborted)
                     if self.use_memory and tool_name in self.memory_manager.tool_enhance_dict:
                         tool_result["instruction"] = self.memory_manager.tool_enhance_dict[tool_name]["tool_instruction"]
                     self.monitor.inc_tool_call(tool_name)
@@ -795,6 +974,45 @@ class MUSE(BaseAgent):
             f"<tool_instruction>\n{tool_result.get('instruction')}\n</tool_instruction>"
         )
 
+    async def call_tools(self, tool_jsons: List[Dict[str, str]]) -> AsyncGenerator[tuple, None]:
+        """
+        Execute independent tool calls of the same LLM turn concurrently. Chunks are streamed as they arrive,
+        the final responses are joined in the order of the calls.
+        """
+        queue = asyncio.Queue()
+        responses = [None] * len(tool_jsons)
+
+        async def _run(i: int, tool_json: Dict[str, str]):
+            try:
+                async for status, chunk in self.call_tool(**tool_json):
+                    if status == "[DONE]":
+                        responses[i] = chunk
+                    else:
+                        queue.put_nowait(chunk)
+            finally:
+                queue.put_nowait(None)
+
+        tasks = [asyncio.create_task(_run(i, tool_json)) for i, tool_json in enumerate(tool_jsons)]
+        try:
+            running = len(tasks)
+            while running:
+                chunk = await queue.get()
+                if chunk is None:
+                    running -= 1
+                else:
+                    yield "[STREAMING]", chunk
+        finally:
+            for task in tasks:
+                task.cancel()
+            outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+
+        yield "[DONE]", "\n".join(
+            f"[Tool call {i + 1}: {tool_json['tool_name']}]\n" + (
+                responses[i] if responses[i] is not None
+                else f"<tool_response>\nAn error occurred while executing the tool, {outcomes[i]}\n</tool_response>"
+            ) for i, tool_json in enumerate(tool_jsons)
+        )
+
     def is_limit_exceeded(self, action_used: int, subtasks_used: int, time_used: float) -> bool:
         log_args = {"content": f"Done at subtask {subtasks_used}, over the {{limit}}", "subtitle": "DONE", "title": "Limit Exceeded"}
         if self.num_actions_limit is not None and action_used >= self.num_actions_limit:
@@ -836,12 +1054,7 @@ class MUSE(BaseAgent):
     def _load_memory_for_render() -> dict:
         # A helper to load memory just for render_tool_schema_texts, used **before** memory_manager is initialized
         memory_dir = Path("memory") # Default path, adjust if necessary
-        tool_enhance_path = memory_dir / "tool_memory.json"
         try:
-            with open(tool_enhance_path, "r", encoding="utf-8") as f:
-                text = f.read()
-                if not text.strip():
-                    return {}
-                return json.loads(text)
-        except (FileNotFoundError, json.JSONDecodeError):
+            return MemoryStore(memory_dir).load_one("tool")
+        except Exception:
             return {}
@@ -2,6 +2,10 @@
 import os
 import re
 import json
+import time
+import asyncio
+import weakref
+import contextvars
 from pathlib import Path
 
 from browser_use.llm.openai.chat import ChatOpenAI
@@ -13,13 +17,169 @@ from browser_use.browser import BrowserProfile, BrowserSession
 from browser_use.config import get_default_profile, load_browser_use_config, get_default_llm, FlatEnvConfig
 
 
+# Installs (once per document) a MutationObserver that tracks a DOM version counter and the time of the
+# last DOM mutation. Mutations of the browser_use highlight overlay are not counted as page changes.
+# Scrolling, resizing and typing also bump the version: they change which elements are in view and
+# their values without a DOM mutation.
+_DOM_OBSERVER_JS = """
+    if (!window.__museDom) {
+        const dom = {id: Math.random().toString(36).slice(2), version: 0, lastMutation: performance.now()};
+        const isOverlay = (node) => node && node.nodeType === 1 && (
+            node.id === 'playwright-highlight-container' || !!node.closest('#playwright-highlight-container'));
+        new MutationObserver((records) => {
+            const pageChanged = records.some((r) => !isOverlay(r.target)
+                && ![...r.addedNodes, ...r.removedNodes].some(isOverlay));
+            if (pageChanged) {
+                dom.version += 1;
+                dom.lastMutation = performance.now();
+            }
+        }).observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+        for (const type of ['scroll', 'resize', 'input', 'change']) {
+            window.addEventListener(type, () => { dom.version += 1; }, {capture: true, passive: true});
+        }
+        window.__museDom = dom;
+    }
+"""
+
+# Returns the time since the last DOM mutation plus a cheap layout signature of the document.
+_SETTLE_PROBE_JS = """
+() => {
+""" + _DOM_OBSERVER_JS + """
+    const root = document.documentElement;
+    const body = document.body;
+    return {
+        sinceMutation: performance.now() - window.__museDom.lastMutation,
+        readyState: document.readyState,
+        layout: [
+            root ? root.scrollWidth : 0,
+            root ? root.scrollHeight : 0,
+            body ? body.childElementCount : 0,
+            document.getElementsByTagName('*').length,
+        ].join(','),
+    };
+}
+"""
+
+# Returns the DOM version key of the current document, used to cache the interactive elements.
+_DOM_VERSION_JS = """
+() => {
+""" + _DOM_OBSERVER_JS + """
+    return `${location.href}#${window.__museDom.id}:${window.__museDom.version}`;
+}
+"""
+
+# Resolves all the interactive elements of the selector map in a single pass, and returns them already
+# serialized as a JSON array of {index, tag, role, name, bbox, visible[, placeholder][, href]}.
+# Elements that can't be resolved from the top document (e.g. inside iframes) are returned in `missing`.
+_EXTRACT_ELEMENTS_JS = """
+(elements) => {
+""" + _DOM_OBSERVER_JS + """
+    const IMPLICIT_ROLES = {
+        a: 'link', button: 'button', select: 'combobox', textarea: 'textbox', option: 'option',
+        summary: 'button', details: 'group', img: 'img', li: 'listitem', nav: 'navigation', form: 'form',
+    };
+    const INPUT_ROLES = {
+        checkbox: 'checkbox', radio: 'radio', button: 'button', submit: 'button', reset: 'button',
+        range: 'slider', search: 'searchbox', number: 'spinbutton',
+    };
+    const clean = (text) => (text || '').replace(/\\s+/g, ' ').trim().slice(0, 100);
+    const roleOf = (el, tag) => {
+        const role = el.getAttribute('role');
+        if (role) return role;
+        if (tag === 'input') return INPUT_ROLES[(el.getAttribute('type') || 'text').toLowerCase()] || 'textbox';
+        return IMPLICIT_ROLES[tag] || tag;
+    };
+    const nameOf = (el) => {
+        const labelledBy = el.getAttribute('aria-labelledby');
+        if (labelledBy) {
+            const label = labelledBy.split(/\\s+/).map((id) => document.getElementById(id))
+                .filter(Boolean).map((n) => n.textContent).join(' ');
+            if (clean(label)) return clean(label);
+        }
+        if (el.labels && el.labels.length) {
+            const label = [...el.labels].map((n) => n.textContent).join(' ');
+            if (clean(label)) return clean(label);
+        }
+        return clean(el.getAttribute('aria-label') || el.innerText || el.getAttribute('alt')
+            || el.getAttribute('title') || el.getAttribute('placeholder') || el.value);
+    };
+
+    const out = [];
+    const missing = [];
+    for (const [index, xpath, tag] of elements) {
+        let el = null;
+        try {
+            el = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+        } catch (e) {}
+        if (!el || el.nodeType !== 1) {
+            missing.push(index);
+            continue;
+        }
+        const rect = el.getBoundingClientRect();
+        const style = getComputedStyle(el);
+        const rec = {
+            index: index,
+            tag: tag,
+            role: roleOf(el, tag),
+            name: nameOf(el),
+            bbox: [Math.round(rect.x + scrollX), Math.round(rect.y + scrollY), Math.round(rect.width), Math.round(rect.height)],
+            visible: rect.width > 0 && rect.height > 0 && style.visibility !== 'hidden' && style.display !== 'none',
+        };
+        const placeholder = el.getAttribute('placeholder');
+        if (placeholder) rec.placeholder = placeholder;
+        const href = el.getAttribute('href');
+        if (href) rec.href = href;
+        out.push(rec);
+    }
+    return {
+        key: `${location.href}#${window.__museDom.id}:${window.__museDom.version}`,
+        elements: JSON.stringify(out),
+        missing: missing,
+    };
+}
+"""
+
+_MAIN_TAG_RE = re.compile(r'\[\d+\]<(.*?)\/>')
+
+# Browser profile directory of the process, set by runners that launch several agent processes at once
+# (Chrome does not share a profile directory between running instances)
+BROWSER_USER_DATA_DIR_ENV = "MUSE_BROWSER_USER_DATA_DIR"
+
+_CURRENT_BROWSER: contextvars.ContextVar = contextvars.ContextVar("muse_browser", default=None)
+
+
+class _NetworkTracker:
+    """In-flight request counter of a single page, fed by the playwright request events."""
+    def __init__(self, page):
+        self.inflight = 0
+        self.last_activity = time.monotonic()
+        page.on("request", self._on_request)
+        page.on("requestfinished", self._on_request_done)
+        page.on("requestfailed", self._on_request_done)
+
+    def _on_request(self, _request):
+        self.inflight += 1
+        self.last_activity = time.monotonic()
+
+    def _on_request_done(self, _request):
+        self.inflight = max(0, self.inflight - 1)
+        self.last_activity = time.monotonic()
+
+
 class BrowserUse:
-    def __init__(self):
+    def __init__(self, **profile_overrides):
         self.config = load_browser_use_config()
+        self.profile_overrides = profile_overrides
+        if os.environ.get(BROWSER_USER_DATA_DIR_ENV):
+            self.profile_overrides.setdefault('user_data_dir', os.environ[BROWSER_USER_DATA_DIR_ENV])
         self.browser_session: BrowserSession | None = None
         self.controller: Controller | None = None
         # self.file_system: FileSystem | None = None
         self.llm: ChatOpenAI | None = None
+        self._network_trackers: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.settle_times: list[dict] = []
+        # (DOM version key, serialized interactive elements) of the last `get_browser_state` call
+        self._browser_state_cache: tuple[str, str] | None = None
 
     # TODO: Need to expose more path parameters to initialization
     async def _init_browser_session(self, **kwargs):
@@ -46,7 +206,7 @@ class BrowserUse:
         }
 
         # Merge any additional kwargs that are valid BrowserProfile fields
-        for key, value in kwargs.items():
+        for key, value in {**self.profile_overrides, **kwargs}.items():
             profile_data[key] = value
 
         # Create browser profile
@@ -56,6 +216,13 @@ class BrowserUse:
         self.browser_session = BrowserSession(browser_profile=profile)
         await self.browser_session.start()
 
+        # Count the requests of every page from its creation on, so that the requests started by an
+        # action are already in flight when `wait_for_settle` runs after it
+        browser_context = self.browser_session.browser_context
+        for page in browser_context.pages:
+            self._track_network(page)
+        browser_context.on("page", self._track_network)
+
         # Create controller for direct actions
         self.controller = Controller()
 
@@ -71,6 +238,86 @@ class BrowserUse:
         file_system_path = profile_data.get('file_system_path', 'workspace/browser-use')
         self.file_system = FileSystem(base_dir=Path(file_system_path).expanduser())
 
+    async def reset_for_task(self):
+        """
+        Prepare the browser for a new task, as a newly launched browser on the same profile would be:
+        all tabs but one are closed, the remaining one is blank and the per-page caches are dropped.
+        The profile (cookies, logins) is kept. A browser that cannot be reset is closed, and relaunched on next use.
+        """
+        self._browser_state_cache = None
+        self.settle_times = []
+        if not self.browser_session:
+            return
+        try:
+            pages = self.browser_session.browser_context.pages
+            for page in pages[1:]:
+                await page.close()
+            page = pages[0] if pages else await self.browser_session.browser_context.new_page()
+            await page.goto("about:blank")
+            await self.browser_session.switch_tab(0)
+        except Exception as e:
+            print(f"[SYSTEM WARNING][BROWSER] ⚠️ Failed to reset the browser ({e}), relaunching it.")
+            await self.close()
+
+    async def close(self):
+        if self.browser_session:
+            try:
+                await self.browser_session.kill()
+            except Exception:
+                pass
+        self.browser_session = None
+        self.controller = None
+        self._browser_state_cache = None
+
+    def _track_network(self, page) -> _NetworkTracker:
+        tracker = self._network_trackers.get(page)
+        if tracker is None:
+            tracker = self._network_trackers[page] = _NetworkTracker(page)
+        return tracker
+
+    async def wait_for_settle(self, max_wait: float = 2.0, quiet: float = 0.3, poll: float = 0.1) -> dict:
+        """
+        Wait until the current page is settled, instead of sleeping for a fixed time.
+        The page is settled once there are no in-flight requests, no DOM mutations and no layout change
+        for `quiet` seconds. Gives up after `max_wait` seconds.
+        The signals are required together, not the first one: the network is idle while a client-side
+        render still mutates the DOM, and the DOM is quiet while a fetch is pending.
+        Returns the settle report, which is also appended to `self.settle_times`.
+        """
+        st_time = time.monotonic()
+        report = {"settle_time": 0.0, "settled": False, "network_idle": False, "dom_quiet": False, "layout_stable": False}
+        if not self.browser_session:
+            return report
+
+        page = await self.browser_session.get_current_page()
+        tracker = self._track_network(page)
+
+        last_layout = None
+        while True:
+            now = time.monotonic()
+            try:
+                probe = await page.evaluate(_SETTLE_PROBE_JS)
+            except Exception:
+                # The execution context is destroyed while the page navigates, keep polling
+                probe = None
+
+            if probe is not None:
+                report["network_idle"] = tracker.inflight == 0 and now - max(tracker.last_activity, st_time) >= quiet
+                report["dom_quiet"] = probe["sinceMutation"] >= quiet * 1000 and probe["readyState"] != "loading"
+                report["layout_stable"] = probe["layout"] == last_layout
+                last_layout = probe["layout"]
+                if report["network_idle"] and report["dom_quiet"] and report["layout_stable"]:
+                    report["settled"] = True
+                    break
+
+            if now - st_time >= max_wait:
+                break
+            await asyncio.sleep(poll)
+
+        report["settle_time"] = round(time.monotonic() - st_time, 3)
+        self.settle_times.append(report)
+        return report
+
     async def get_axtree(self):
         page = await self.browser_session.get_current_page()
         cdp_session = await page.context.new_cdp_session(page)
@@ -81,41 +328,58 @@ class BrowserUse:
         ax_tree = await cdp_session.send('Accessibility.getFullAXTree')
         return flatten_axtree_to_str(ax_tree)
 
+    async def get_current_url(self) -> str:
+        page = await self.browser_session.get_current_page()
+        return page.url
+
     async def get_browser_state(self) -> str:
         """Get current browser state."""
         if not self.browser_session:
             return 'Error: No browser session active, please use go to a url'
 
-        state = await self.browser_session.get_state_summary(cache_clickable_elements_hashes=False)
-        result = {
-            'url': state.url,
-            'title': state.title,
-            'tabs': [{'url': tab.url, 'title': tab.title} for tab in state.tabs],
-            'interactive_elements': [],
-        }
+        # Consecutive calls without any DOM change return the cached elements
+        page = await self.browser_session.get_current_page()
+        if self._browser_state_cache is not None:
+            try:
+                dom_key = await page.evaluate(_DOM_VERSION_JS)
+            except Exception:
+                dom_key = None
+            if dom_key == self._browser_state_cache[0]:
+                return self._browser_state_cache[1]
 
-        # Add interactive elements with their indices
-        for index, element in state.selector_map.items():
-            raw_str = element.clickable_elements_to_string().replace('\t', '').replace('\n[', '[')
-            all_indices = [int(x) for x in re.findall(r'\[(\d+)\]', raw_str)]
-            # main_idx = all_indices[0] if all_indices else None
-            sub_element_indices = all_indices[1:] if len(all_indices) > 1 else []
-
-            main_tag_match = re.search(r'\[\d+\]<(.*?)\/>', raw_str)
-            main_tag_text = '<' + main_tag_match.group(1).strip() + '/>' if main_tag_match else ""
-
-            elem_info = {
-                'index': index,
-                'tag': element.tag_name,
-                'text': main_tag_text,
-                # 'sub_element_index': sub_element_indices,
-            }
-            if element.attributes.get('placeholder'):
-                elem_info['placeholder'] = element.attributes['placeholder']
-            if element.attributes.get('href'):
-                elem_info['href'] = element.attributes['href']
-            result['interactive_elements'].append(elem_info)
-        return json.dumps(result["interactive_elements"])
+        state = await self.browser_session.get_state_summary(cache_clickable_elements_hashes=False)
+        elements = [[index, element.xpath, element.tag_name] for index, element in state.selector_map.items()]
+        try:
+            extracted = await page.evaluate(_EXTRACT_ELEMENTS_JS, elements)
+        except Exception:
+            extracted = {"key": None, "elements": "[]", "missing": list(state.selector_map.keys())}
+
+        result = extracted["elements"]
+        if extracted["missing"]:
+            # Fall back to the browser_use element description for the elements outside the top document
+            interactive_elements = json.loads(result)
+            for index in extracted["missing"]:
+                element = state.selector_map[index]
+                raw_str = element.clickable_elements_to_string().replace('\t', '').replace('\n[', '[')
+                main_tag_match = _MAIN_TAG_RE.search(raw_str)
+                elem_info = {
+                    'index': index,
+                    'tag': element.tag_name,
+                    'role': element.attributes.get('role', element.tag_name),
+                    'name': '<' + main_tag_match.group(1).strip() + '/>' if main_tag_match else "",
+                    'bbox': None,
+                    'visible': element.is_visible,
+                }
+                if element.attributes.get('placeholder'):
+                    elem_info['placeholder'] = element.attributes['placeholder']
+                if element.attributes.get('href'):
+                    elem_info['href'] = element.attributes['href']
+                interactive_elements.append(elem_info)
+            interactive_elements.sort(key=lambda x: x['index'])
+            result = json.dumps(interactive_elements)
+
+        self._browser_state_cache = (extracted["key"], result) if extracted["key"] else None
+        return result
 
     async def extract_content_by_vision(self, query: str) -> str:
         state = await self.browser_session.get_state_summary(cache_clickable_elements_hashes=False)
@@ -351,6 +615,23 @@ class BrowserUse:
 # ========================================================================= #
 #  UTILS
 # ========================================================================= #
+class BrowserProxy:
+    """
+    Forwards to the browser bound to the current context (see `bind_browser`), or to the default browser,
+    so that concurrent tasks of one process drive their own browser through the same toolbox functions.
+    """
+    def __init__(self, default: BrowserUse):
+        self._default = default
+
+    def __getattr__(self, name):
+        return getattr(_CURRENT_BROWSER.get() or self._default, name)
+
+
+def bind_browser(browser: BrowserUse) -> contextvars.Token:
+    """Bind the browser used by the toolbox in the current context (an asyncio task and the tasks it creates)."""
+    return _CURRENT_BROWSER.set(browser)
+
+
 def flatten_axtree_to_str(axtree, ignored_roles=None, depth=0, node_idx=0):
     if ignored_roles is None:
         ignored_roles = {"none"}
@@ -0,0 +1,351 @@
+
+import os
+import sys
+import json
+import time
+import asyncio
+import builtins
+import importlib
+import linecache
+import tempfile
+import traceback
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# ========================================================================
+# Config
+# ========================================================================
+POOL_SIZE = 2
+PRELOAD_MODULES = ["json", "re", "math", "csv", "datetime", "collections", "requests", "numpy", "pandas", "openpyxl"]
+MAX_EXECUTIONS_PER_WORKER = 50   # A worker is recycled after this number of snippets, once its tasks are reset
+MEMORY_LIMIT_MB = 4096           # Address-space limit of a worker (Linux/macOS only), `0` means unlimited
+DEFAULT_TIMEOUT = 270
+STREAM_LIMIT = 256 * 1024 * 1024  # Max size of one protocol message (snippet outputs are not truncated)
+
+STATUS_EXECUTED = "executed"
+STATUS_TIMEOUT = "timeout"
+STATUS_CRASHED = "crashed"
+LOST_NAMESPACE_NOTICE = ("[SYSTEM INFO: The Python worker of this task was restarted, "
+                         "variables of previous code snippets are lost.]")
+
+
+# ========================================================================
+# Worker side
+# ========================================================================
+def _run_snippet(code: str, namespace: dict, cwd: str, snippet_id: int) -> dict:
+    """
+    Execute the code in the task namespace.
+    The stdout/stderr file descriptors are redirected, so the output of child processes is captured as well.
+    """
+    filename = f"<snippet-{snippet_id}>"
+    linecache.cache[filename] = (len(code), None, code.splitlines(True), filename)
+
+    returncode = 0
+    with tempfile.TemporaryFile() as out_f, tempfile.TemporaryFile() as err_f:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        saved_fds = os.dup(1), os.dup(2)
+        os.dup2(out_f.fileno(), 1)
+        os.dup2(err_f.fileno(), 2)
+        prev_cwd = os.getcwd()
+        st_time = time.perf_counter()
+        try:
+            os.chdir(cwd)
+            exec(compile(code, filename, "exec"), namespace)
+        except SystemExit as e:
+            if isinstance(e.code, int):
+                returncode = e.code
+            elif e.code is not None:
+                print(e.code, file=sys.stderr)
+                returncode = 1
+        except BaseException:
+            traceback.print_exc()
+            returncode = 1
+        finally:
+            duration = time.perf_counter() - st_time
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            os.close(saved_fds[0])
+            os.close(saved_fds[1])
+            os.chdir(prev_cwd)
+
+        out_f.seek(0)
+        err_f.seek(0)
+        return {
+            "returncode": returncode,
+            "stdout": out_f.read().decode("utf-8", errors="replace"),
+            "stderr": err_f.read().decode("utf-8", errors="replace"),
+            "exec_time": round(duration, 4),
+        }
+
+
+def _worker_main(preload: List[str], memory_limit_mb: int):
+    # The protocol runs on private copies of stdin/stdout, the real fds 0/1 never reach the parent
+    proto_in = os.fdopen(os.dup(0), "r", encoding="utf-8")
+    proto_out = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    devnull = os.open(os.devnull, os.O_RDWR)
+    os.dup2(devnull, 0)
+    os.dup2(devnull, 1)
+
+    def send(message: dict):
+        proto_out.write(json.dumps(message, ensure_ascii=False) + "\n")
+        proto_out.flush()
+
+    preloaded = []
+    for module_name in preload:
+        try:
+            importlib.import_module(module_name)
+            preloaded.append(module_name)
+        except Exception:
+            pass
+
+    if memory_limit_mb:
+        try:
+            import resource
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+
+    namespaces: Dict[str, dict] = {}
+    send({"ready": True, "preloaded": preloaded})
+    snippet_id = 0
+    for line in proto_in:
+        request = json.loads(line)
+        if request["op"] == "reset":
+            namespaces.pop(request["task"], None)
+            send({"ok": True})
+            continue
+        snippet_id += 1
+        namespace = namespaces.setdefault(request["task"], {"__name__": "__main__", "__builtins__": builtins})
+        send(_run_snippet(request["code"], namespace, request["cwd"], snippet_id))
+
+
+# ========================================================================
+# Parent side
+# ========================================================================
+class _Worker:
+    def __init__(self, proc: asyncio.subprocess.Process):
+        self.proc = proc
+        self.lock = asyncio.Lock()
+        self.executions = 0
+        self.tasks: set = set()
+        self.retired = False
+
+    async def request(self, message: dict, timeout: Optional[float] = None) -> dict:
+        self.proc.stdin.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+        await self.proc.stdin.drain()
+        line = await asyncio.wait_for(self.proc.stdout.readline(), timeout)
+        if not line:
+            raise EOFError("Python worker exited unexpectedly.")
+        return json.loads(line)
+
+    async def close(self):
+        self.retired = True
+        if self.proc.returncode is None:
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+        await self.proc.wait()
+
+
+class InterpreterPool:
+    """
+    Pool of pre-warmed Python interpreters that execute code snippets over a pipe protocol.
+    Each task keeps its own namespace inside the worker it is bound to, so variables and imports survive
+    between the snippets of a task. After `max_executions` snippets a worker is drained: it takes no new tasks
+    and is recycled once the tasks bound to it are reset. A timeout or a crash recycles it right away, which
+    resets the namespaces of the tasks bound to it (their next result says so).
+    """
+    def __init__(
+            self,
+            size: int = POOL_SIZE,
+            preload: List[str] = None,
+            max_executions: int = MAX_EXECUTIONS_PER_WORKER,
+            memory_limit_mb: int = MEMORY_LIMIT_MB,
+            timeout: float = DEFAULT_TIMEOUT
+    ):
+        self.size = size
+        self.preload = PRELOAD_MODULES if preload is None else preload
+        self.max_executions = max_executions
+        self.memory_limit_mb = memory_limit_mb
+        self.timeout = timeout
+
+        self.workers: List[_Worker] = []
+        self.latencies: List[dict] = []
+        self._affinity: Dict[str, _Worker] = {}
+        self._draining: set = set()
+        self._lost_namespaces: set = set()
+        self._spawning: set = set()
+        self._warmup: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+
+    async def _spawn(self) -> _Worker:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, str(Path(__file__).resolve()), "--worker",
+            json.dumps(self.preload), str(self.memory_limit_mb),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=STREAM_LIMIT
+        )
+        worker = _Worker(proc)
+        line = await proc.stdout.readline()
+        if not line:
+            await worker.close()
+            raise RuntimeError("Python worker failed to start.")
+        return worker
+
+    async def start(self):
+        async with self._start_lock:
+            missing = self.size - len(self.workers)
+            if missing > 0:
+                self.workers.extend(await asyncio.gather(*[self._spawn() for _ in range(missing)]))
+
+    def warm_up(self):
+        """
+        Start the workers in the background, so that the first snippet does not wait for the preloaded imports.
+        A snippet submitted during the warm-up waits for it, a failed warm-up is retried by the first snippet.
+        """
+        if self.workers or self._warmup is not None:
+            return
+        self._warmup = asyncio.create_task(self.start())
+        self._spawning.add(self._warmup)
+        self._warmup.add_done_callback(self._spawning.discard)
+        self._warmup.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    def _detach(self, worker: _Worker):
+        worker.retired = True
+        if worker in self.workers:
+            self.workers.remove(worker)
+        self._draining.discard(worker)
+        for task_id in worker.tasks:
+            if self._affinity.get(task_id) is worker:
+                del self._affinity[task_id]
+                self._lost_namespaces.add(task_id)
+
+    def _replace_in_background(self, worker: _Worker):
+        # The worker stops receiving snippets right away, it is closed and replaced in the background
+        self._detach(worker)
+
+        async def _replace():
+            await worker.close()
+            await self.start()
+        task = asyncio.create_task(_replace())
+        self._spawning.add(task)
+        task.add_done_callback(self._spawning.discard)
+
+    def _drain(self, worker: _Worker):
+        # The worker keeps serving the tasks bound to it (their namespaces live there), a replacement takes new tasks
+        self.workers.remove(worker)
+        self._draining.add(worker)
+        self._close_if_drained(worker)
+        task = asyncio.create_task(self.start())
+        self._spawning.add(task)
+        task.add_done_callback(self._spawning.discard)
+
+    def _close_if_drained(self, worker: _Worker):
+        if worker in self._draining and not worker.tasks:
+            self._detach(worker)
+            task = asyncio.create_task(worker.close())
+            self._spawning.add(task)
+            task.add_done_callback(self._spawning.discard)
+
+    async def _pick_worker(self, task_id: str) -> _Worker:
+        worker = self._affinity.get(task_id)
+        if worker is not None and not worker.retired:
+            return worker
+        if not self.workers:
+            await self.start()
+        worker = min(self.workers, key=lambda w: (w.lock.locked(), len(w.tasks)))
+        worker.tasks.add(task_id)
+        self._affinity[task_id] = worker
+        return worker
+
+    async def execute(self, code: str, task_id: str, work_dir: str = "workspace", timeout: Optional[float] = None) -> dict:
+        """
+        Execute the snippet in the namespace of `task_id`.
+        Returns a dict with `status`, `returncode`, `stdout`, `stderr`, the execution time inside the worker
+        and the total latency seen by the caller.
+        """
+        timeout = timeout or self.timeout
+        st_time = time.perf_counter()
+        namespace_lost = task_id in self._lost_namespaces
+        self._lost_namespaces.discard(task_id)
+        worker = await self._pick_worker(task_id)
+        async with worker.lock:
+            try:
+                result = await worker.request(
+                    {"op": "exec", "task": task_id, "code": code, "cwd": str(Path(work_dir).resolve())},
+                    timeout=timeout
+                )
+                result["status"] = STATUS_EXECUTED
+                worker.executions += 1
+                if worker.executions >= self.max_executions and worker in self.workers:
+                    self._drain(worker)
+            except asyncio.TimeoutError:
+                result = {"status": STATUS_TIMEOUT, "returncode": None, "stdout": "", "stderr": "", "exec_time": timeout}
+                self._replace_in_background(worker)
+            except (EOFError, ConnectionError, json.JSONDecodeError) as e:
+                await worker.proc.wait()
+                result = {
+                    "status": STATUS_CRASHED,
+                    "returncode": worker.proc.returncode,
+                    "stdout": "",
+                    "stderr": f"The Python worker crashed ({e}), possibly because the memory limit "
+                              f"({self.memory_limit_mb} MB) was exceeded. Variables of previous code snippets are lost.",
+                    "exec_time": round(time.perf_counter() - st_time, 4)
+                }
+                self._replace_in_background(worker)
+
+        if result["status"] != STATUS_EXECUTED:
+            # The result already says that the variables are lost
+            self._lost_namespaces.discard(task_id)
+        elif namespace_lost:
+            result["stderr"] = LOST_NAMESPACE_NOTICE + "\n" + result["stderr"]
+        result["latency"] = round(time.perf_counter() - st_time, 4)
+        self.latencies.append({"task": task_id, "latency": result["latency"], "exec_time": result["exec_time"]})
+        return result
+
+    async def reset(self, task_id: str):
+        """Drop the namespace of the task."""
+        self._lost_namespaces.discard(task_id)
+        worker = self._affinity.pop(task_id, None)
+        if worker is None or worker.retired:
+            return
+        worker.tasks.discard(task_id)
+        if worker in self._draining and not worker.tasks:
+            # Closing the worker drops the namespace as well
+            self._close_if_drained(worker)
+            return
+        async with worker.lock:
+            await worker.request({"op": "reset", "task": task_id}, timeout=self.timeout)
+
+    async def close(self):
+        for task in list(self._spawning):
+            task.cancel()
+        for worker in list(self.workers) + list(self._draining):
+            self._detach(worker)
+            await worker.close()
+
+
+_POOLS: Dict[asyncio.AbstractEventLoop, InterpreterPool] = {}
+
+def get_interpreter_pool() -> InterpreterPool:
+    """
+    The interpreter pool of the running event loop (its worker pipes are bound to the loop).
+    The pool starts warming up as soon as it is created.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _POOLS:
+        for stale_loop in [l for l in _POOLS if l.is_closed()]:
+            del _POOLS[stale_loop]
+        _POOLS[loop] = InterpreterPool()
+        _POOLS[loop].warm_up()
+    return _POOLS[loop]
+
+
+if __name__ == "__main__" and len(sys.argv) == 4 and sys.argv[1] == "--worker":
+    _worker_main(json.loads(sys.argv[2]), int(sys.argv[3]))
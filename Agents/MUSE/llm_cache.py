@@ -0,0 +1,106 @@
+
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Any, Union
+
+CACHE_MODE_OFF = "off"
+CACHE_MODE_READ_THROUGH = "read_through"     # Return hits, call the API on a miss and store the response
+CACHE_MODE_WRITE_THROUGH = "write_through"   # Always call the API and store (refresh) the response
+CACHE_MODE_REPLAY = "replay"                 # Return hits, raise `LLMCacheMiss` on a miss, never call the API
+CACHE_MODES = {CACHE_MODE_OFF, CACHE_MODE_READ_THROUGH, CACHE_MODE_WRITE_THROUGH, CACHE_MODE_REPLAY}
+
+
+class LLMCacheMiss(RuntimeError):
+    pass
+
+
+class LLMCache:
+    """
+    Content-addressed on-disk cache of LLM responses, stored in SQLite.
+    A record is keyed by the hash of (model, messages, tools, sampling params) and holds the response
+    chunks (a single chunk for non-streamed calls) together with the token usage of the original call.
+    """
+    def __init__(self, path: Union[str, Path], mode: str = CACHE_MODE_READ_THROUGH, ttl: float = 0):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"LLM cache mode must be one of {CACHE_MODES}, but received '{mode}'")
+        self.path = Path(path)
+        self.mode = mode
+        self.ttl = ttl  # seconds, `0` means that records never expire
+        self.hits = 0
+        self.misses = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, chunks TEXT, usage TEXT, created_at REAL)"
+            )
+
+    @classmethod
+    def from_config(cls, cfg: Union[dict, None]) -> Union["LLMCache", None]:
+        cfg = cfg or {}
+        mode = cfg.get("mode", CACHE_MODE_OFF)
+        if mode == CACHE_MODE_OFF:
+            return None
+        return cls(cfg.get("path", "cache/llm_cache.sqlite"), mode=mode, ttl=float(cfg.get("ttl", 0) or 0))
+
+    @property
+    def readable(self) -> bool:
+        return self.mode in (CACHE_MODE_READ_THROUGH, CACHE_MODE_REPLAY)
+
+    @property
+    def writable(self) -> bool:
+        return self.mode in (CACHE_MODE_READ_THROUGH, CACHE_MODE_WRITE_THROUGH)
+
+    @staticmethod
+    def make_key(model: str, messages: list[dict], tools: Union[list, None] = None, **sampling_params: Any) -> str:
+        payload = json.dumps(
+            {"model": model, "messages": messages, "tools": tools, "params": sampling_params},
+            ensure_ascii=False, sort_keys=True, default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Union[tuple[list[str], dict], None]:
+        """
+        Returns `(chunks, usage)` of the cached response, or `None` on a miss.
+        In replay mode a miss raises `LLMCacheMiss`.
+        """
+        if not self.readable:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT chunks, usage, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl > 0 and time.time() - row[2] > self.ttl:
+                with self._conn:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if row is None:
+            if self.mode == CACHE_MODE_REPLAY:
+                raise LLMCacheMiss(f"No cached LLM response for key {key} (replay mode)")
+            return None
+        return json.loads(row[0]), json.loads(row[1] or "{}")
+
+    def set(self, key: str, model: str, chunks: list[str], usage: Union[dict, None] = None):
+        if not self.writable:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, chunks, usage, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, json.dumps(chunks, ensure_ascii=False), json.dumps(usage or {}), time.time())
+            )
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return round(self.hits / total, 4) if total else 0.0
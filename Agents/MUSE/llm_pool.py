@@ -0,0 +1,248 @@
+
+import os
+import time
+import random
+import asyncio
+import threading
+import contextvars
+from dataclasses import dataclass, asdict
+from typing import Dict, Tuple, Union
+
+import httpx
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+
+DEFAULT_POOL_CONFIG = {
+    "max_connections": 32,           # httpx connection pool size per (base_url, api_key)
+    "max_keepalive_connections": 16,
+    "keepalive_expiry": 60,
+    "max_concurrency": 8,            # In-flight requests per model
+    "requests_per_minute": 0,        # Token-bucket rate limit per model, `0` means unlimited
+    "max_retries": 5,
+    "min_backoff": 1.0,
+    "max_backoff": 60.0,
+}
+# Fraction of the per-model limits granted to this process, set by schedulers running several agent processes
+# against the same provider, so that together they stay within the quota
+POOL_SHARE_ENV = "MUSE_LLM_POOL_SHARE"
+
+
+@dataclass
+class ModelMetrics:
+    num_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    max_tokens: int = 0
+    cache_hits: int = 0
+    cached_tokens: int = 0
+    rate_limited: int = 0
+    retries: int = 0
+
+
+class MetricsRegistry:
+    """
+    Per-model LLM call metrics, safe to update from several threads.
+    With `propagate`, every update is also applied to the metrics of the current task, see `track_task_metrics`.
+    """
+    def __init__(self, propagate: bool = False):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, ModelMetrics] = {}
+        self.propagate = propagate
+
+    def _get(self, model: str) -> ModelMetrics:
+        if model not in self._metrics:
+            self._metrics[model] = ModelMetrics()
+        return self._metrics[model]
+
+    def inc(self, model: str, **deltas: int):
+        with self._lock:
+            metrics = self._get(model)
+            for name, delta in deltas.items():
+                setattr(metrics, name, getattr(metrics, name) + delta)
+        task_metrics = _TASK_METRICS.get() if self.propagate else None
+        if task_metrics is not None:
+            task_metrics.inc(model, **deltas)
+
+    def add_usage(self, model: str, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            metrics = self._get(model)
+            metrics.prompt_tokens += prompt_tokens
+            metrics.completion_tokens += completion_tokens
+            metrics.max_tokens = max(metrics.max_tokens, prompt_tokens + completion_tokens)
+        task_metrics = _TASK_METRICS.get() if self.propagate else None
+        if task_metrics is not None:
+            task_metrics.add_usage(model, prompt_tokens, completion_tokens)
+
+    def per_model(self) -> Dict[str, dict]:
+        with self._lock:
+            return {model: asdict(metrics) for model, metrics in self._metrics.items()}
+
+    def total(self) -> dict:
+        total = ModelMetrics()
+        for metrics in self.per_model().values():
+            for name, value in metrics.items():
+                if name == "max_tokens":
+                    total.max_tokens = max(total.max_tokens, value)
+                else:
+                    setattr(total, name, getattr(total, name) + value)
+        return asdict(total)
+
+
+# Call metrics of the task of the current context: tasks running concurrently in one process (in-process slots)
+# each count their own calls, on top of the process-wide metrics of `ClientRegistry`
+_TASK_METRICS: contextvars.ContextVar = contextvars.ContextVar("muse_task_llm_metrics", default=None)
+
+
+def track_task_metrics() -> MetricsRegistry:
+    """Start fresh call metrics for the task of the current context."""
+    metrics = MetricsRegistry()
+    _TASK_METRICS.set(metrics)
+    return metrics
+
+
+def current_task_metrics() -> Union[MetricsRegistry, None]:
+    return _TASK_METRICS.get()
+
+
+class TokenBucket:
+    def __init__(self, requests_per_minute: float):
+        self.rate = requests_per_minute / 60
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ModelLimiter:
+    """
+    Concurrency and rate limiter of a single model.
+    A 429 response puts the whole model into a cooldown, whose length doubles with every consecutive 429
+    (or follows the `Retry-After` header) and shrinks back after successful calls.
+    """
+    def __init__(self, max_concurrency: int, requests_per_minute: float, min_backoff: float, max_backoff: float):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.cooldown_until = 0.0
+
+    async def admit(self):
+        """Wait for the rate-limit cooldown and for a token-bucket slot. Concurrency is bounded by `semaphore`."""
+        delay = self.cooldown_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.bucket is not None:
+            await self.bucket.acquire()
+
+    def on_success(self):
+        self.backoff = max(self.min_backoff, self.backoff / 2)
+
+    def on_rate_limited(self, retry_after: Union[float, None] = None) -> float:
+        delay = retry_after if retry_after else self.backoff * (1 + random.random() * 0.25)
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + delay)
+        self.backoff = min(self.max_backoff, self.backoff * 2)
+        return delay
+
+
+class ClientRegistry:
+    """
+    Process-wide registry of the LLM clients.
+    One `AsyncOpenAI` client (and its keep-alive connection pool) is shared per (base_url, api_key),
+    and one limiter per model. Both are bound to the running event loop, and are re-created for a new loop.
+    """
+    def __init__(self, pool_config: Union[dict, None] = None):
+        self.config = {**DEFAULT_POOL_CONFIG, **(pool_config or {})}
+        self.metrics = MetricsRegistry(propagate=True)
+        self.share = float(os.environ.get(POOL_SHARE_ENV) or 1)
+        self._lock = threading.Lock()
+        self._clients: Dict[Tuple[str, str], Tuple[asyncio.AbstractEventLoop, AsyncOpenAI]] = {}
+        self._limiters: Dict[str, Tuple[asyncio.AbstractEventLoop, ModelLimiter]] = {}
+
+    @staticmethod
+    def _current_loop() -> Union[asyncio.AbstractEventLoop, None]:
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+    def get_client(self, base_url: str, api_key: str) -> AsyncOpenAI:
+        loop = self._current_loop()
+        with self._lock:
+            entry = self._clients.get((base_url, api_key))
+            if entry is not None and (entry[0] is None or entry[0] is loop):
+                if entry[0] is None and loop is not None:
+                    self._clients[(base_url, api_key)] = (loop, entry[1])
+                return entry[1]
+
+            limits = httpx.Limits(
+                max_connections=self.config["max_connections"],
+                max_keepalive_connections=self.config["max_keepalive_connections"],
+                keepalive_expiry=self.config["keepalive_expiry"],
+            )
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=httpx.AsyncClient(verify=False, limits=limits),
+                timeout=180,
+                max_retries=0  # Retries are handled by `call_with_retry`
+            )
+            self._clients[(base_url, api_key)] = (loop, client)
+            return client
+
+    def get_limiter(self, model: str, model_config: Union[dict, None] = None) -> ModelLimiter:
+        loop = self._current_loop()
+        cfg = {**self.config, **(model_config or {})}
+        with self._lock:
+            entry = self._limiters.get(model)
+            if entry is not None and entry[0] is loop:
+                return entry[1]
+            limiter = ModelLimiter(
+                max_concurrency=max(1, int(cfg["max_concurrency"] * self.share)),
+                requests_per_minute=cfg["requests_per_minute"] * self.share,
+                min_backoff=cfg["min_backoff"],
+                max_backoff=cfg["max_backoff"],
+            )
+            self._limiters[model] = (loop, limiter)
+            return limiter
+
+    async def call_with_retry(self, model: str, limiter: ModelLimiter, create, **kwargs):
+        """
+        Run `create(**kwargs)` once admitted by the model limiter. The caller holds `limiter.semaphore`.
+        429s trigger the adaptive cooldown of the model, transient connection/server errors an exponential backoff.
+        """
+        max_retries = self.config["max_retries"]
+        for attempt in range(max_retries + 1):
+            await limiter.admit()
+            try:
+                result = await create(**kwargs)
+                limiter.on_success()
+                return result
+            except RateLimitError as e:
+                if attempt == max_retries:
+                    raise
+                delay = limiter.on_rate_limited(_parse_retry_after(e))
+                self.metrics.inc(model, rate_limited=1, retries=1)
+                print(f"[SYSTEM WARNING][LLM] ⚠️ Rate limited on {model}, retry in {round(delay, 2)}s.")
+            except (APIConnectionError, APITimeoutError, InternalServerError):
+                if attempt == max_retries:
+                    raise
+                self.metrics.inc(model, retries=1)
+                await asyncio.sleep(min(self.config["max_backoff"], self.config["min_backoff"] * 2 ** attempt))
+
+
+def _parse_retry_after(e: RateLimitError) -> Union[float, None]:
+    response = getattr(e, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
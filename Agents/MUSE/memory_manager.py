@@ -3,17 +3,34 @@ import json
 import traceback
 from pathlib import Path
 from dataclasses import asdict
-from typing import Dict, Any, Tuple, List
+from typing import Dict, Any, Tuple, List, Union
 
 from model import LLM
 from log import AgentLogger
 from monitor import Monitor
+from memory_store import MemoryStore
+from memory_retrieval import BM25Index
+from trajectory import Trajectory, json_default
 from prompt.system_prompt import sys_memory_prompt_template
-from utils import remove_accessibility_tree_in_the_history, remove_browser_state_in_the_history, \
-    create_message, deep_update, dict_to_outline_str, pretty_print_trajectory, remove_python_code_in_the_history
+from utils import create_message, deep_update, dict_to_outline_str, pretty_print_trajectory, replace_message_text, \
+    estimate_tokens, get_history_trimmer
+
+MEMORY_INJECTION_FULL = "full"            # The whole strategic memory and guide directory go into the system prompt
+MEMORY_INJECTION_RETRIEVAL = "retrieval"  # Only the entries relevant to the current (sub)task, under a token budget
 
 class MemoryManager:
-    def __init__(self, memory_dir: str, logger: AgentLogger, output_dir: Path, sys_prompt_template: str, tool_schema_texts: str, use_memory: bool = True):
+    def __init__(
+            self,
+            memory_dir: str,
+            logger: AgentLogger,
+            output_dir: Path,
+            sys_prompt_template: str,
+            tool_schema_texts: str,
+            use_memory: bool = True,
+            memory_injection: str = MEMORY_INJECTION_RETRIEVAL,
+            retrieval_top_k: int = 12,
+            memory_token_budget: int = 1500
+    ):
         self.memory_dir = Path(memory_dir)
         self.logger = logger
         self.output_dir: Path = output_dir
@@ -21,14 +38,16 @@ class MemoryManager:
         self.tool_schema_texts = tool_schema_texts
         self.use_memory = use_memory
 
-        self.history: List[dict] = []
+        self.memory_injection = memory_injection
+        self.retrieval_top_k = retrieval_top_k
+        self.memory_token_budget = memory_token_budget
+        self.memory_index = BM25Index()
+        self._memory_entries: Dict[str, Tuple[str, str, str]] = {}  # doc_id -> (kind, key, item)
+        self._full_memory_tokens = 0
 
-        self.tool_enhance_dict: Dict[str, Any] = self._load_memory(self.memory_dir / "tool_memory.json")
-        self.application_enhance_dict: Dict[str, Any] = self._load_memory(self.memory_dir / "procedural_memory.json")
-        self.methodology_enhance_dict: Dict[str, Any] = self._load_memory(self.memory_dir / "strategic_memory.json")
-
-        self.app_guide_str = dict_to_outline_str(self.application_enhance_dict)
-        self.metho_guide_str = dict_to_outline_str(self.methodology_enhance_dict)
+        self.store = MemoryStore(self.memory_dir)
+        self._reset_task_state()
+        self._load_from_store()
 
         def _memory_loading_log(items: List[tuple]):
             for content, title in items:
@@ -42,42 +61,121 @@ class MemoryManager:
 
         self.update_system_prompt()
 
-    @staticmethod
-    def _load_memory(memory_path: Path) -> dict:
-        try:
-            with open(memory_path, "r", encoding="utf-8") as f:
-                text = f.read()
-                if not text.strip():
-                    print(f"Warning: {memory_path} is empty.")
-                    return {}
-                try:
-                    return json.loads(text)
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON in {memory_path}: {e}")
-                    traceback.print_exc()
-                    return {}
-        except FileNotFoundError:
-            print(f"File not found: {memory_path}")
-            return {}
-        except Exception as e:
-            print(f"Unexpected error reading {memory_path}: {e}")
-            traceback.print_exc()
-            return {}
+    def _reset_task_state(self):
+        self.retrieval_query: str = ""
+        self.memory_token_stats = {"prompt_updates": 0, "full_tokens": 0, "injected_tokens": 0}
+        self.history: List[dict] = []
 
-    @staticmethod
-    def _save_memory(memory_path: Path, data: dict):
+    def _load_from_store(self):
+        memory = self.store.load()
+        self.tool_enhance_dict: Dict[str, Any] = memory["tool"]
+        self.application_enhance_dict: Dict[str, Any] = memory["procedural"]
+        self.methodology_enhance_dict: Dict[str, Any] = memory["strategic"]
+        self._refresh_guide_strs()
+
+    def start_task(self, logger: AgentLogger, output_dir: Path, sys_prompt_template: str, tool_schema_texts: str):
+        """
+        Reuse the manager for the next task of a long-lived runner. The per-task state is reset and the memory is
+        reloaded from the store, so that the updates saved by other tasks are visible (only the changed entries
+        are re-indexed).
+        """
+        self.logger = logger
+        self.output_dir = output_dir
+        self.sys_prompt_template = sys_prompt_template
+        self.tool_schema_texts = tool_schema_texts
+        self._reset_task_state()
+        self._load_from_store()
+        self.update_system_prompt()
+
+    def _save_memory(self, name: str, data: dict):
         try:
-            with open(memory_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            self.store.commit(name, data)
         except Exception as e:
-            print(f"Failed to save memory to {memory_path}: {e}")
+            print(f"Failed to save {name} memory to {self.memory_dir}: {e}")
             traceback.print_exc()
 
-    def update_system_prompt(self):
+    def _refresh_guide_strs(self):
+        """Re-render the full memory dump and update the retrieval index with the changed entries only."""
+        self.app_guide_str = dict_to_outline_str(self.application_enhance_dict)
+        self.metho_guide_str = dict_to_outline_str(self.methodology_enhance_dict)
+        self._full_memory_tokens = estimate_tokens(self.metho_guide_str) + estimate_tokens(self.app_guide_str)
+
+        entries, docs = {}, {}
+        for key, value in self.methodology_enhance_dict.items():
+            doc_id = f"methodology\0{key}"
+            entries[doc_id] = ("methodology", key, "")
+            docs[doc_id] = f"{key}: {value}"
+        for app, items in self.application_enhance_dict.items():
+            if isinstance(items, dict):
+                for item, detail in items.items():
+                    doc_id = f"guidance\0{app}\0{item}"
+                    entries[doc_id] = ("guidance", app, item)
+                    docs[doc_id] = f"{app} {item} {detail}"
+            else:
+                doc_id = f"guidance\0{app}"
+                entries[doc_id] = ("guidance", app, "")
+                docs[doc_id] = f"{app} {items}"
+
+        for doc_id in self.memory_index.doc_ids():
+            if doc_id not in docs:
+                self.memory_index.remove(doc_id)
+        for doc_id, text in docs.items():
+            self.memory_index.upsert(doc_id, text)
+        self._memory_entries = entries
+
+    def set_retrieval_query(self, query: str):
+        self.retrieval_query = query
+
+    def _render_retrieved_memory(self, query: str) -> Tuple[str, str]:
+        """
+        Render the top-k memory entries relevant to the query, best first, as long as they fit in the token budget.
+        """
+        methodology: Dict[str, Any] = {}
+        guidance: Dict[str, list] = {}
+        used_tokens = 0
+        for doc_id, _ in self.memory_index.search(query, k=self.retrieval_top_k):
+            kind, key, item = self._memory_entries[doc_id]
+            if kind == "methodology":
+                text = dict_to_outline_str({key: self.methodology_enhance_dict[key]})
+            else:
+                text = f"{key}\n  - {item}" if item else key
+            cost = estimate_tokens(text)
+            if used_tokens + cost > self.memory_token_budget:
+                continue
+            used_tokens += cost
+            if kind == "methodology":
+                methodology[key] = self.methodology_enhance_dict[key]
+            elif item:
+                guidance.setdefault(key, []).append(item)
+            else:
+                guidance[key] = self.application_enhance_dict[key]
+
+        guidance_str = dict_to_outline_str(guidance)
+        num_guide_entries = sum(1 for kind, _, _ in self._memory_entries.values() if kind == "guidance")
+        num_shown = sum(len(v) if isinstance(v, list) else 1 for v in guidance.values())
+        if num_shown < num_guide_entries:
+            guidance_str += (f"\n(Only the entries relevant to the current task are listed, {num_guide_entries - num_shown} more are omitted. "
+                             f"All applications with guides: {', '.join(self.application_enhance_dict.keys())}. "
+                             "Use `access_the_application_guide` with empty `item_names` to list all the entries of an application.)")
+        return dict_to_outline_str(methodology), guidance_str
+
+    def render_system_prompt(self, retrieval_query: str = None, record_stats: bool = True) -> str:
+        """
+        The system prompt for the given retrieval query, without installing it into the history.
+        `record_stats=False` leaves `memory_token_stats` untouched, for prompts that may never be sent (speculation).
+        """
         if self.use_memory:
+            if self.memory_injection == MEMORY_INJECTION_RETRIEVAL and retrieval_query and len(self.memory_index):
+                methodology, guidance = self._render_retrieved_memory(retrieval_query)
+            else:
+                methodology, guidance = self.metho_guide_str, self.app_guide_str
+            if record_stats:
+                self.memory_token_stats["prompt_updates"] += 1
+                self.memory_token_stats["full_tokens"] += self._full_memory_tokens
+                self.memory_token_stats["injected_tokens"] += estimate_tokens(methodology) + estimate_tokens(guidance)
             memory = sys_memory_prompt_template.format(
-                methodology=self.metho_guide_str,
-                guidance=self.app_guide_str
+                methodology=methodology,
+                guidance=guidance
             )
         else:
             memory = sys_memory_prompt_template.format(
@@ -86,10 +184,13 @@ class MemoryManager:
             )
             self.logger.log_task("Pass the memory load step", subtitle="WARNING···", title="use_memory set to False")
 
-        system_prompt = self.sys_prompt_template.format(
+        return self.sys_prompt_template.format(
             memory=memory,
             tools=self.tool_schema_texts
         )
+
+    def update_system_prompt(self):
+        system_prompt = self.render_system_prompt(self.retrieval_query)
         if not self.history or self.history[0]["role"] != "system":
             self.history.insert(0, create_message("system", system_prompt))
         else:
@@ -116,7 +217,7 @@ class MemoryManager:
 
     @staticmethod
     def trim_traj(
-            traj: list,
+            traj: Union[list, Trajectory],
             preserve_last: int = 0,
             axtree: bool = True,
             state: bool = True,
@@ -124,8 +225,10 @@ class MemoryManager:
     ):
         """
         Clear all conversation turns (user+assistant) from the end of the trace in reverse order, keeping the last preserve_last turn.
+        Trimmed messages are replaced by new message dicts, the original ones (possibly shared with forks of the trajectory) are left untouched.
+        Each message is scanned once for all the sections, and already trimmed messages are cache hits.
         """
-        if not isinstance(traj, list) or len(traj) < 2:
+        if not isinstance(traj, (list, Trajectory)) or len(traj) < 2:
             return
 
         skip = preserve_last * 2
@@ -133,6 +236,9 @@ class MemoryManager:
         if start < 1:
             return
 
+        user_trimmer = get_history_trimmer(*[name for name, on in (("axtree", axtree), ("state", state)) if on])
+        assistant_trimmer = get_history_trimmer(*(["python"] if python else []))
+
         i = start
         while i >= 1:
             msg_a = traj[i]
@@ -141,30 +247,36 @@ class MemoryManager:
             assert msg_u.get("role") == "user", f"role mismatch at index {i - 1}: expected user"
             assert msg_a.get("role") == "assistant", f"role mismatch at index {i}: expected assistant"
 
-            text_u = msg_u["content"][0]["text"]
-            if axtree:
-                text_u = remove_accessibility_tree_in_the_history(text_u)
-            if state:
-                text_u = remove_browser_state_in_the_history(text_u)
-            msg_u["content"][0]["text"] = text_u
+            text_u = user_trimmer.trim(msg_u["content"][0]["text"])
+            if text_u != msg_u["content"][0]["text"]:
+                traj[i - 1] = replace_message_text(msg_u, text_u)
 
-            text_a = msg_a["content"][0]["text"]
-            if python:
-                text_a = remove_python_code_in_the_history(text_a)
-            msg_a["content"][0]["text"] = text_a
+            text_a = assistant_trimmer.trim(msg_a["content"][0]["text"])
+            if text_a != msg_a["content"][0]["text"]:
+                traj[i] = replace_message_text(msg_a, text_a)
 
             i -= 2
 
     def update_and_save_app_memory(self, new_conclusion: dict):
         self.logger.log_task(str(new_conclusion), subtitle="UPDATING······", title="Update App Memory")
         deep_update(self.application_enhance_dict, new_conclusion)
-        self.app_guide_str = dict_to_outline_str(self.application_enhance_dict)
-        self._save_memory(self.memory_dir / "procedural_memory.json", self.application_enhance_dict)
+        self._refresh_guide_strs()
+        self._save_memory("procedural", self.application_enhance_dict)
+
+    def get_memory_token_savings(self) -> dict:
+        stats = self.memory_token_stats
+        updates = stats["prompt_updates"] or 1
+        return {
+            **stats,
+            "mode": self.memory_injection,
+            "saved_tokens_per_call": round((stats["full_tokens"] - stats["injected_tokens"]) / updates, 1)
+        }
 
     def save_all_memory_to_disk(self):
-        self._save_memory(self.memory_dir / "tool_memory.json", self.tool_enhance_dict)
-        self._save_memory(self.memory_dir / "procedural_memory.json", self.application_enhance_dict)
-        self._save_memory(self.memory_dir / "strategic_memory.json", self.methodology_enhance_dict)
+        self._refresh_guide_strs()
+        self._save_memory("tool", self.tool_enhance_dict)
+        self._save_memory("procedural", self.application_enhance_dict)
+        self._save_memory("strategic", self.methodology_enhance_dict)
 
     def save_run_artifacts(self, monitor: Monitor):
         output_dir = self.output_dir
@@ -178,6 +290,7 @@ class MemoryManager:
         overall_state_output_path = output_dir / "overall_state.json"
         overall_state = {
             "monitor_state": asdict(monitor),
+            "memory_injection": self.get_memory_token_savings(),
             "enhance_dicts": {
                 "tool_enhance_dict": self.tool_enhance_dict,
                 "application_enhance_dict": self.application_enhance_dict,
@@ -185,13 +298,11 @@ class MemoryManager:
             }
         }
         with overall_state_output_path.open("w", encoding="utf-8") as f:
-            json.dump(overall_state, f, indent=4, ensure_ascii=False)
+            json.dump(overall_state, f, indent=4, ensure_ascii=False, default=json_default)
 
         with open(output_dir / "num_calls.txt", "w", encoding="utf-8") as f:
             f.write(str({
-                "num_calls": LLM.NUM_CALLS,
-                "prompt_tokens": LLM.PROMPT_TOKENS,
-                "completion_tokens": LLM.COMPLETION_TOKENS,
-                "max_tokens": LLM.MAX_TOKENS
+                **LLM.total_metrics(task_only=True),
+                "per_model": LLM.metrics(task_only=True)
             }))
 
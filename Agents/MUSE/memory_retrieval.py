@@ -0,0 +1,80 @@
+
+import re
+import math
+import hashlib
+from collections import Counter
+from typing import Dict, List, Tuple
+
+_TOKEN_RE = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+|[一-鿿]")
+_STOPWORDS = {
+    "a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "with", "by", "is", "are", "be", "as", "at",
+    "it", "this", "that", "from", "if", "then", "into", "its", "was", "were", "can", "should", "please",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens, also splitting snake_case and CamelCase identifiers."""
+    return [t for t in (m.lower() for m in _TOKEN_RE.findall(text)) if t not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    Small in-memory BM25 index, updated incrementally: re-adding a document with unchanged text is a no-op.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._docs: Dict[str, Tuple[str, Counter, int]] = {}  # doc_id -> (text hash, term counts, length)
+        self._df: Counter = Counter()
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._docs
+
+    def upsert(self, doc_id: str, text: str) -> bool:
+        """Returns whether the index changed."""
+        text_hash = hashlib.md5(text.encode("utf-8")).hexdigest()
+        if doc_id in self._docs:
+            if self._docs[doc_id][0] == text_hash:
+                return False
+            self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        self._docs[doc_id] = (text_hash, terms, length)
+        self._df.update(terms.keys())
+        self._total_len += length
+        return True
+
+    def remove(self, doc_id: str):
+        _, terms, length = self._docs.pop(doc_id)
+        self._df.subtract(terms.keys())
+        self._total_len -= length
+
+    def doc_ids(self) -> List[str]:
+        return list(self._docs)
+
+    def search(self, query: str, k: int = None) -> List[Tuple[str, float]]:
+        """Documents with a positive score, best first."""
+        query_terms = set(tokenize(query))
+        if not query_terms or not self._docs:
+            return []
+        n_docs = len(self._docs)
+        avg_len = self._total_len / n_docs or 1
+        idf = {
+            t: math.log(1 + (n_docs - self._df[t] + 0.5) / (self._df[t] + 0.5))
+            for t in query_terms if self._df[t] > 0
+        }
+        scores = []
+        for doc_id, (_, terms, length) in self._docs.items():
+            score = 0.0
+            for t, w in idf.items():
+                tf = terms.get(t, 0)
+                if tf:
+                    score += w * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / avg_len))
+            if score > 0:
+                scores.append((doc_id, score))
+        scores.sort(key=lambda x: -x[1])
+        return scores[:k] if k is not None else scores
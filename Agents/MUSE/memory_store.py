@@ -0,0 +1,197 @@
+
+import os
+import json
+import time
+import tempfile
+import threading
+import traceback
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, List, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock is used
+    fcntl = None
+
+MEMORY_FILES = {
+    "tool": "tool_memory.json",
+    "procedural": "procedural_memory.json",
+    "strategic": "strategic_memory.json",
+}
+JOURNAL_FILE = "memory_journal.jsonl"
+LOCK_FILE = ".memory.lock"
+COMPACT_JOURNAL_BYTES = 256 * 1024  # The journal is folded into the snapshots once it grows beyond this size
+
+_THREAD_LOCK = threading.Lock()
+
+
+def diff_memory(old: dict, new: dict, path: tuple = ()) -> List[dict]:
+    """
+    Delta between two memory dicts, as `set`/`del` operations on key paths.
+    Nested dicts are diffed recursively, so concurrent updates of different entries do not overwrite each other.
+    """
+    ops = []
+    for key in old:
+        if key not in new:
+            ops.append({"op": "del", "path": [*path, key]})
+    for key, value in new.items():
+        if key in old and isinstance(old[key], dict) and isinstance(value, dict):
+            ops.extend(diff_memory(old[key], value, (*path, key)))
+        elif key not in old or old[key] != value:
+            ops.append({"op": "set", "path": [*path, key], "value": value})
+    return ops
+
+
+def apply_ops(data: dict, ops: List[dict]):
+    """Apply the operations in place. They only set absolute values, so replaying them twice is harmless."""
+    for op in ops:
+        *parents, key = op["path"]
+        node = data
+        for parent in parents:
+            if not isinstance(node.get(parent), dict):
+                if op["op"] == "del":
+                    break
+                node[parent] = {}
+            node = node[parent]
+        else:
+            if op["op"] == "set":
+                node[key] = op["value"]
+            else:
+                node.pop(key, None)
+
+
+def _copy(data: dict) -> dict:
+    return json.loads(json.dumps(data, ensure_ascii=False))
+
+
+class MemoryStore:
+    """
+    Crash-safe persistence of the MUSE memory files, shareable by several concurrent workers.
+    Every update appends its delta to `memory_journal.jsonl`; the JSON files are snapshots, rewritten atomically
+    (temp file + rename) only when the journal is compacted. Loading reads the snapshots and replays the journal tail.
+    All file accesses hold an exclusive `flock` on the memory directory.
+    """
+    def __init__(self, memory_dir: Union[str, Path], compact_journal_bytes: int = COMPACT_JOURNAL_BYTES):
+        self.memory_dir = Path(memory_dir)
+        self.journal_path = self.memory_dir / JOURNAL_FILE
+        self.compact_journal_bytes = compact_journal_bytes
+        self._baseline: Dict[str, dict] = {}  # The last loaded/committed state of each store, the deltas are computed against it
+
+    @contextmanager
+    def _locked(self):
+        with _THREAD_LOCK:
+            self.memory_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.memory_dir / LOCK_FILE, "a") as lock_f:
+                if fcntl is not None:
+                    fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def _read_snapshot(path: Path) -> dict:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except FileNotFoundError:
+            print(f"File not found: {path}")
+            return {}
+        if not text.strip():
+            print(f"Warning: {path} is empty.")
+            return {}
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            print(f"Error decoding JSON in {path}: {e}")
+            traceback.print_exc()
+            return {}
+
+    def _read_journal(self) -> List[dict]:
+        records = []
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return records
+        for i, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Only the last line can be torn by a crash during an append
+                print(f"[SYSTEM WARNING][Memory] ⚠️ Skip a corrupted record at line {i + 1} of {self.journal_path}.")
+        return records
+
+    def _read_state(self) -> Dict[str, dict]:
+        state = {name: self._read_snapshot(self.memory_dir / file) for name, file in MEMORY_FILES.items()}
+        for record in self._read_journal():
+            if record.get("store") in state:
+                apply_ops(state[record["store"]], record["ops"])
+        return state
+
+    @staticmethod
+    def _atomic_write(path: Path, text: str):
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+        try:
+            os.chmod(tmp_path, path.stat().st_mode & 0o777 if path.exists() else 0o644)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load(self) -> Dict[str, dict]:
+        """Snapshot + journal replay of every memory file, keyed by store name (`tool`, `procedural`, `strategic`)."""
+        with self._locked():
+            state = self._read_state()
+        self._baseline = {name: _copy(data) for name, data in state.items()}
+        return state
+
+    def load_one(self, name: str) -> dict:
+        """Read-only access to the current content of a single store."""
+        with self._locked():
+            return self._read_state()[name]
+
+    def commit(self, name: str, data: dict) -> int:
+        """
+        Journal the changes of `data` since the last load/commit, and compact the journal when it grew too large.
+        Returns the number of journaled operations.
+        """
+        ops = diff_memory(self._baseline.get(name, {}), data)
+        if not ops:
+            return 0
+        record = {"ts": time.time(), "pid": os.getpid(), "store": name, "ops": ops}
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._locked():
+            with open(self.journal_path, "a+b") as f:
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b"\n":
+                        line = b"\n" + line  # Do not glue the record to a line torn by a crash
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._baseline[name] = _copy(data)
+            if self.journal_path.stat().st_size > self.compact_journal_bytes:
+                self._compact()
+        return len(ops)
+
+    def compact(self):
+        with self._locked():
+            self._compact()
+
+    def _compact(self):
+        # Snapshots are replaced first and the journal emptied last: a crash in between only replays idempotent ops
+        state = self._read_state()
+        for name, file in MEMORY_FILES.items():
+            self._atomic_write(self.memory_dir / file, json.dumps(state[name], ensure_ascii=False, indent=2))
+        self._atomic_write(self.journal_path, "")
+        print("[SYSTEM INFO][Memory] ℹ️ Memory journal compacted into the snapshots.")
@@ -1,13 +1,15 @@
 import os
 import yaml
-import httpx
 import base64
 import aiofiles
 import traceback
 from pathlib import Path
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
-from typing import AsyncGenerator, Union
+from typing import AsyncGenerator, Union, Dict
+
+from llm_cache import LLMCache, LLMCacheMiss
+from llm_pool import ClientRegistry, current_task_metrics
 
 load_dotenv()
 
@@ -15,39 +17,65 @@ with open("config.yaml", "r") as f:
     raw_config = os.path.expandvars(f.read())
     config = yaml.safe_load(raw_config)
 LLM_CONFIG = config["llm"]
+LLM_CACHE = LLMCache.from_config(config.get("llm_cache"))
+# Shared clients, per-model limiters and per-model call metrics of the whole process
+LLM_POOL = ClientRegistry(config.get("llm_pool"))
 
 class LLM:
-    NUM_CALLS = 0
-    PROMPT_TOKENS = 0
-    COMPLETION_TOKENS = 0
-    MAX_TOKENS = 0
-
     def __init__(self, model: str="Qwen2.5-VL-7B-Instruct"):
         cfg = LLM_CONFIG.get(model)
         if cfg is None:
             raise ValueError(f"Model '{model}' not found in config.yaml")
-        self.async_client = AsyncOpenAI(
-            api_key=cfg["api_key"],
-            base_url=cfg["base_url"],
-            http_client=httpx.AsyncClient(verify=False),
-            timeout=180
-        )
+        self.cfg = cfg
         self.model = cfg["model"]
 
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        return LLM_POOL.get_client(self.cfg["base_url"], self.cfg["api_key"])
+
+    @property
+    def limiter(self):
+        return LLM_POOL.get_limiter(self.model, self.cfg.get("pool"))
+
     @staticmethod
-    def _accumulate_usage(usage):
+    def _metrics_registry(task_only: bool):
+        task_metrics = current_task_metrics() if task_only else None
+        return task_metrics if task_metrics is not None else LLM_POOL.metrics
+
+    @staticmethod
+    def metrics(task_only: bool = False) -> Dict[str, dict]:
+        """
+        Per-model call metrics of the process, or of the current task (`task_only`, see `llm_pool.track_task_metrics`).
+        Calls served by `LLM_CACHE` are counted in `num_calls` and `cache_hits`,
+        their tokens are counted in `cached_tokens` instead of the consumed prompt/completion tokens.
+        """
+        return LLM._metrics_registry(task_only).per_model()
+
+    @staticmethod
+    def total_metrics(task_only: bool = False) -> dict:
+        return LLM._metrics_registry(task_only).total()
+
+    @staticmethod
+    def _usage_to_dict(usage) -> dict:
         get = (lambda k, default=0:
                usage.get(k, default) if isinstance(usage, dict)
                else getattr(usage, k, default))
-        prompt_tokens = get("prompt_tokens", 0)
-        completion_tokens = get("completion_tokens", 0)
-        LLM.PROMPT_TOKENS += int(prompt_tokens or 0)
-        LLM.COMPLETION_TOKENS += int(completion_tokens or 0)
-        LLM.MAX_TOKENS = max(
-            LLM.MAX_TOKENS,
-            int(prompt_tokens or 0) + int(completion_tokens or 0)
+        return {
+            "prompt_tokens": int(get("prompt_tokens", 0) or 0),
+            "completion_tokens": int(get("completion_tokens", 0) or 0)
+        }
+
+    def _accumulate_cache_hit(self, usage: dict):
+        LLM_POOL.metrics.inc(
+            self.model,
+            cache_hits=1,
+            cached_tokens=usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
         )
 
+    def _accumulate_usage(self, usage):
+        usage = self._usage_to_dict(usage)
+        LLM_POOL.metrics.add_usage(self.model, usage["prompt_tokens"], usage["completion_tokens"])
+
     async def async_generate(
             self,
             prompt: str,
@@ -55,7 +83,7 @@ class LLM:
             history: list[dict] = None,
             max_tokens: Union[int, None] = 32768
     ) -> str:
-        LLM.NUM_CALLS += 1
+        LLM_POOL.metrics.inc(self.model, num_calls=1)
         try:
             messages = await self.prepare_messages(prompt, image_path, history)
 
@@ -66,11 +94,23 @@ class LLM:
                     max_tokens = 8192
             # --- 新增修复代码 END ---
 
-            resp = await self.async_client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=max_tokens
-            )
+            cache_key = None
+            if LLM_CACHE is not None:
+                cache_key = LLM_CACHE.make_key(self.model, messages, max_tokens=max_tokens)
+                cached = LLM_CACHE.get(cache_key)
+                if cached is not None:
+                    chunks, usage = cached
+                    self._accumulate_cache_hit(usage)
+                    return "".join(chunks)
+
+            limiter = self.limiter
+            async with limiter.semaphore:
+                resp = await LLM_POOL.call_with_retry(
+                    self.model, limiter, self.async_client.chat.completions.create,
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_tokens
+                )
 
             usage = getattr(resp, "usage", None)
             if usage:
@@ -93,8 +133,12 @@ class LLM:
                 print("[SYSTEM WARNING][SYNC] ⚠️ Response has no content (may contain only tool/function signals).")
                 return self._handle_error(RuntimeError("Empty content in first choice."))
 
+            if cache_key is not None:
+                LLM_CACHE.set(cache_key, self.model, [content], self._usage_to_dict(usage) if usage else None)
             return content
 
+        except LLMCacheMiss:
+            raise
         except Exception as e:
             return self._handle_error(e)
 
@@ -106,7 +150,7 @@ class LLM:
             max_tokens: Union[int, None] = 32768,
             temperature: float = 1.0
     ) -> AsyncGenerator[str, None]:
-        LLM.NUM_CALLS += 1
+        LLM_POOL.metrics.inc(self.model, num_calls=1)
         try:
             messages = await self.prepare_messages(prompt, image_path, history)
 
@@ -116,51 +160,77 @@ class LLM:
                 if max_tokens is None or max_tokens > 8192:
                     max_tokens = 8192
             # --- 新增修复代码 END ---
-            
-            stream = await self.async_client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                stream=True,
-                max_tokens=max_tokens,
-                temperature=temperature,
-                stream_options={"include_usage": True}
-            )
-
-            saw_explicit_finish = False
-            usage_accumulated = False
-
-            async for chunk in stream:
-                usage = getattr(chunk, "usage", None)
-                if usage and not usage_accumulated:
-                    self._accumulate_usage(usage)
-                    usage_accumulated = True
-
-                choices = getattr(chunk, "choices", None) or []
-                if not choices:
-                    continue
-
-                c0 = choices[0]
-
-                finish_reason = getattr(c0, "finish_reason", None)
-                if finish_reason is not None:
-                    saw_explicit_finish = True
-                    self._log_finish_reason("STREAM", finish_reason)
-
-                delta = getattr(c0, "delta", None)
-
-                if not usage_accumulated and delta is not None:
-                    maybe_usage = getattr(delta, "usage", None)
-                    if maybe_usage:
-                        self._accumulate_usage(maybe_usage)
+
+            cache_key = None
+            if LLM_CACHE is not None:
+                cache_key = LLM_CACHE.make_key(self.model, messages, max_tokens=max_tokens, temperature=temperature)
+                cached = LLM_CACHE.get(cache_key)
+                if cached is not None:
+                    chunks, usage = cached
+                    self._accumulate_cache_hit(usage)
+                    for content in chunks:
+                        yield content
+                    return
+
+            # The concurrency slot of the model is held until the stream is fully consumed
+            limiter = self.limiter
+            async with limiter.semaphore:
+                stream = await LLM_POOL.call_with_retry(
+                    self.model, limiter, self.async_client.chat.completions.create,
+                    model=self.model,
+                    messages=messages,
+                    stream=True,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    stream_options={"include_usage": True}
+                )
+
+                saw_explicit_finish = False
+                usage_accumulated = False
+                # Reconstructed chunks and usage of the stream, stored into the cache once the stream is complete
+                stream_chunks = []
+                stream_usage = None
+
+                async for chunk in stream:
+                    usage = getattr(chunk, "usage", None)
+                    if usage and not usage_accumulated:
+                        self._accumulate_usage(usage)
                         usage_accumulated = True
+                        stream_usage = self._usage_to_dict(usage)
+
+                    choices = getattr(chunk, "choices", None) or []
+                    if not choices:
+                        continue
+
+                    c0 = choices[0]
+
+                    finish_reason = getattr(c0, "finish_reason", None)
+                    if finish_reason is not None:
+                        saw_explicit_finish = True
+                        self._log_finish_reason("STREAM", finish_reason)
+
+                    delta = getattr(c0, "delta", None)
+
+                    if not usage_accumulated and delta is not None:
+                        maybe_usage = getattr(delta, "usage", None)
+                        if maybe_usage:
+                            self._accumulate_usage(maybe_usage)
+                            usage_accumulated = True
+                            stream_usage = self._usage_to_dict(maybe_usage)
+
+                    content = getattr(delta, "content", None) if delta else None
+                    if content is not None:
+                        stream_chunks.append(content)
+                        yield content
 
-                content = getattr(delta, "content", None) if delta else None
-                if content is not None:
-                    yield content
+                if not saw_explicit_finish:
+                    print("[SYSTEM INFO][STREAM] ℹ️ Stream ended without explicit finish_reason (likely normal).")
 
-            if not saw_explicit_finish:
-                print("[SYSTEM INFO][STREAM] ℹ️ Stream ended without explicit finish_reason (likely normal).")
+            if cache_key is not None and stream_chunks:
+                LLM_CACHE.set(cache_key, self.model, stream_chunks, stream_usage)
 
+        except LLMCacheMiss:
+            raise
         except Exception as e:
             yield self._handle_error(e)
 
@@ -233,6 +303,6 @@ if __name__ == "__main__":
         async for chunk in llm.async_stream_generate("Hello, please introduce yourself.", history=history):
             print(chunk, end="")
 
-        print("\n[USAGE] prompt =", LLM.PROMPT_TOKENS, "completion =", LLM.COMPLETION_TOKENS)
+        print("\n[USAGE]", LLM.metrics())
 
     asyncio.run(test())
@@ -1,6 +1,8 @@
 from dataclasses import dataclass, field, asdict
 from typing import Dict, List, Optional
 
+from trajectory import Trajectory
+
 @dataclass
 class Reflection:
     analysis: str = ""
@@ -17,7 +19,7 @@ class SubTask:
     goal: str
     index: int = -1   # `-1` indicates not executed
     finish: bool = False
-    trajectory: List[dict] = field(default_factory=list)
+    trajectory: Trajectory = field(default_factory=Trajectory)
     reflect_trajectory: List[dict] = field(default_factory=list)
     reflection: Reflection = field(default_factory=Reflection)
     try_times: int = 0
@@ -33,7 +35,7 @@ class SubTask:
             goal=data.get("goal", ""),
             index=data.get("index", -1),
             finish=data.get("finish", False),
-            trajectory=data.get("trajectory", []),
+            trajectory=Trajectory(data.get("trajectory", [])),
             reflect_trajectory=data.get("reflect_trajectory", []),
             reflection=reflection,
             try_times=data.get("try_times", 0),
@@ -68,11 +70,35 @@ class ToolStat:
             errors=data.get("errors", 0),
         )
 
+@dataclass
+class SpeculationStat:
+    launched: int = 0
+    accepted: int = 0
+    discarded: int = 0
+    time_saved: float = 0.0  # Seconds of LLM round-trips overlapped with other work, for the accepted speculations
+    tokens: int = 0          # Estimated prompt + completion tokens of all speculative calls
+    wasted_tokens: int = 0   # Part of `tokens` spent on discarded speculations
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(
+            launched=data.get("launched", 0),
+            accepted=data.get("accepted", 0),
+            discarded=data.get("discarded", 0),
+            time_saved=data.get("time_saved", 0.0),
+            tokens=data.get("tokens", 0),
+            wasted_tokens=data.get("wasted_tokens", 0),
+        )
+
 @dataclass
 class Monitor:
     num_actions: int = 0
     time_used: float = 0.0
+    peak_rss_mb: float = 0.0  # RSS high-water mark of the process sampled during the episode
+    copy_time: float = 0.0    # Trajectory copy time of this task only
+    ttft: List[float] = field(default_factory=list)  # Seconds from a ready observation to the first token of the next LLM step
     tool_call: Dict[str, ToolStat] = field(default_factory=dict)
+    speculation: SpeculationStat = field(default_factory=SpeculationStat)
     done_subtasks: List[SubTask] = field(default_factory=list)
     exception: AgentException = field(default_factory=AgentException)
 
@@ -82,6 +108,13 @@ class Monitor:
     def update_time(self, time: float):
         self.time_used = time
 
+    def update_memory_stats(self, peak_rss_mb: float, copy_time: float):
+        self.peak_rss_mb = peak_rss_mb
+        self.copy_time = copy_time
+
+    def add_ttft(self, seconds: float):
+        self.ttft.append(round(seconds, 3))
+
     def inc_subtask_limit_exceeded(self):
         self.exception.subtask_limit_exceeded += 1
 
@@ -144,7 +177,11 @@ class Monitor:
         return cls(
             num_actions=data.get("num_actions", 0),
             time_used=data.get("time_used", 0.0),
+            peak_rss_mb=data.get("peak_rss_mb", 0.0),
+            copy_time=data.get("copy_time", 0.0),
+            ttft=data.get("ttft", []),
             tool_call=tool_call,
+            speculation=SpeculationStat.from_dict(data.get("speculation", {})),
             done_subtasks=done_subtasks,
             exception=exception,
         )
\ No newline at end of file
@@ -0,0 +1,261 @@
+
+import os
+import re
+import sys
+import json
+import difflib
+import argparse
+import contextvars
+from pathlib import Path
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import List, Optional, Tuple
+
+from utils import estimate_tokens
+
+COMPRESSION_ENV = "MUSE_OBSERVATION_COMPRESSION"  # "0" sends the raw accessibility trees, e.g. for A/B runs
+OBSERVATION_TOKEN_BUDGET = 6000  # Estimated tokens of a single accessibility tree observation
+LIST_ITEM_ROLES = {"listitem", "row", "option", "treeitem", "menuitem", "article"}
+LIST_COLLAPSE_MIN = 6            # Runs of at least this many similar sibling items are collapsed...
+LIST_KEEP = 3                    # ...keeping the first items
+DIFF_CONTEXT = 1                 # Unchanged lines kept around each changed region
+DIFF_MAX_RATIO = 0.6             # A diff is only sent when it is clearly smaller than the full tree
+# A diff refers to the last full tree of the page, which must still be in the (untrimmed) context of the LLM:
+# exec_subtask keeps the observations of the last 3 turns (`MemoryManager.trim_traj(..., preserve_last=3)`),
+# whatever tools were called in between. The age of a keyframe is counted in turns, see `start_turn`
+KEYFRAME_MAX_AGE = 3
+MAX_KEYFRAMES = 16
+
+_AXTREE_SECTION_RE = re.compile(r"<webpage accessibility tree>\n(.*?)\n</webpage accessibility tree>", re.DOTALL)
+
+
+@dataclass
+class CompressionStats:
+    observations: int = 0
+    raw_tokens: int = 0
+    tokens: int = 0
+    diffs: int = 0
+    collapsed_items: int = 0
+    truncated: int = 0
+
+    @property
+    def ratio(self) -> float:
+        return round(self.tokens / self.raw_tokens, 3) if self.raw_tokens else 1.0
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "ratio": self.ratio}
+
+
+class _Node:
+    __slots__ = ("line", "role", "children", "_signature")
+
+    def __init__(self, line: str):
+        self.line = line
+        self.role = line.lstrip(" ").split(" ", 1)[0]
+        self.children: List["_Node"] = []
+        self._signature = None
+
+    @property
+    def signature(self) -> tuple:
+        # The roles of the item and of its children: list items differing only in their texts are similar
+        if self._signature is None:
+            self._signature = (self.role, tuple(child.role for child in self.children))
+        return self._signature
+
+
+def _parse(axtree: str) -> List[_Node]:
+    """The flattened accessibility tree (see `browser.flatten_axtree_to_str`) back into a forest, by indentation."""
+    roots: List[_Node] = []
+    stack: List[Tuple[int, _Node]] = []
+    for line in axtree.splitlines():
+        if not line.strip():
+            continue
+        depth = len(line) - len(line.lstrip(" "))
+        node = _Node(line)
+        while stack and stack[-1][0] >= depth:
+            stack.pop()
+        (stack[-1][1].children if stack else roots).append(node)
+        stack.append((depth, node))
+    return roots
+
+
+class ObservationCompressor:
+    """
+    Compresses the accessibility tree observations of the browse tools:
+    runs of similar list items are collapsed with a count, an observation of a page whose full tree was sent
+    recently is sent as the changed regions only, and every observation is kept within a token budget.
+    The interactive elements are sent in full along with the tree, so collapsed items can still be acted on.
+    """
+    def __init__(self, token_budget: int = OBSERVATION_TOKEN_BUDGET, enabled: bool = None, verbose: bool = True):
+        if enabled is None:
+            enabled = os.environ.get(COMPRESSION_ENV, "1") != "0"
+        self.enabled = enabled
+        self.verbose = verbose
+        self.token_budget = token_budget
+        self.stats = CompressionStats()
+        self._keyframes: "OrderedDict[str, Tuple[List[str], int]]" = OrderedDict()  # key -> (lines, turn)
+        self._turn = 0
+
+    def new_context(self):
+        """The LLM context changed (new subtask, reflection): earlier trees can no longer be referred to."""
+        self._keyframes.clear()
+        self._turn = 0
+
+    def start_turn(self):
+        """A new ReAct turn starts: the observations made from now on are sent in the next user message."""
+        self._turn += 1
+
+    def _collapse(self, nodes: List[_Node], out: List[str]):
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            j = i + 1
+            if node.role in LIST_ITEM_ROLES:
+                while j < len(nodes) and nodes[j].signature == node.signature:
+                    j += 1
+            if j - i >= LIST_COLLAPSE_MIN:
+                for item in nodes[i:i + LIST_KEEP]:
+                    self._render(item, out)
+                omitted = j - i - LIST_KEEP
+                indent = node.line[:len(node.line) - len(node.line.lstrip(" "))]
+                out.append(f"{indent}[... {omitted} more similar {node.role} items omitted, see the interactive elements ...]")
+                self.stats.collapsed_items += omitted
+            else:
+                for item in nodes[i:j]:
+                    self._render(item, out)
+            i = j
+
+    def _render(self, node: _Node, out: List[str]):
+        out.append(node.line)
+        self._collapse(node.children, out)
+
+    @staticmethod
+    def _diff(base: List[str], lines: List[str]) -> List[str]:
+        out = ["[SYSTEM INFO: Only the changes since the previous accessibility tree of this page are shown, "
+               "unchanged lines are omitted]"]
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, base, lines).get_opcodes():
+            if tag == "equal":
+                head = lines[j1:j1 + DIFF_CONTEXT] if j1 > 0 else []
+                tail = lines[j2 - DIFF_CONTEXT:j2] if j2 < len(lines) else []
+                omitted = j2 - j1 - len(head) - len(tail)
+                if omitted <= 1:
+                    out.extend(lines[j1:j2])
+                else:
+                    out.extend(head)
+                    out.append(f"[... {omitted} unchanged lines ...]")
+                    out.extend(tail)
+            else:
+                if i2 > i1:
+                    out.append(f"[... {i2 - i1} lines removed ...]")
+                out.extend(lines[j1:j2])
+        return out
+
+    def _fit(self, lines: List[str]) -> List[str]:
+        """Head and tail lines within the token budget."""
+        tokens = [estimate_tokens(line) for line in lines]
+        if sum(tokens) <= self.token_budget:
+            return lines
+        self.stats.truncated += 1
+        head_budget, tail_budget = int(self.token_budget * 0.8), self.token_budget - int(self.token_budget * 0.8)
+        head, used = 0, 0
+        while head < len(lines) and used + tokens[head] <= head_budget:
+            used += tokens[head]
+            head += 1
+        tail, used = len(lines), 0
+        while tail > head and used + tokens[tail - 1] <= tail_budget:
+            used += tokens[tail - 1]
+            tail -= 1
+        return lines[:head] + [f"[SYSTEM INFO: ... {tail - head} lines omitted to fit the observation budget ...]"] + lines[tail:]
+
+    def compress(self, axtree: str, key: Optional[str] = None) -> str:
+        """
+        Compress the tree of the page identified by `key` (its URL). Without a key, no diff is made.
+        """
+        raw_tokens = estimate_tokens(axtree)
+        self.stats.observations += 1
+        self.stats.raw_tokens += raw_tokens
+        if not self.enabled:
+            self.stats.tokens += raw_tokens
+            return axtree
+
+        lines: List[str] = []
+        self._collapse(_parse(axtree), lines)
+        output = None
+        keyframe = self._keyframes.get(key) if key is not None else None
+        if keyframe is not None and self._turn - keyframe[1] <= KEYFRAME_MAX_AGE:
+            diff = self._diff(keyframe[0], lines)
+            if sum(map(estimate_tokens, diff)) < DIFF_MAX_RATIO * sum(map(estimate_tokens, lines)):
+                output = self._fit(diff)
+                self.stats.diffs += 1
+        is_diff = output is not None
+        if not is_diff:
+            output = self._fit(lines)
+            if key is not None:
+                # The diffs refer to what the LLM was shown, i.e. the tree after fitting it into the budget
+                self._keyframes[key] = (output, self._turn)
+                self._keyframes.move_to_end(key)
+                while len(self._keyframes) > MAX_KEYFRAMES:
+                    self._keyframes.popitem(last=False)
+
+        text = "\n".join(output)
+        tokens = estimate_tokens(text)
+        self.stats.tokens += tokens
+        if self.verbose:
+            print(f"[SYSTEM INFO][BROWSER] ℹ️ Accessibility tree: {raw_tokens} -> {tokens} tokens"
+                  f"{' (diff)' if is_diff else ''}.")
+        return text
+
+
+_DEFAULT_COMPRESSOR = ObservationCompressor()
+_CURRENT_COMPRESSOR: contextvars.ContextVar = contextvars.ContextVar("muse_observation_compressor", default=None)
+
+
+def get_observation_compressor() -> ObservationCompressor:
+    return _CURRENT_COMPRESSOR.get() or _DEFAULT_COMPRESSOR
+
+
+def bind_observation_compressor(compressor: ObservationCompressor) -> contextvars.Token:
+    """Bind the compressor of the current task, in the same way as `browser.bind_browser`."""
+    return _CURRENT_COMPRESSOR.set(compressor)
+
+
+def replay(paths: List[Path], token_budget: int = OBSERVATION_TOKEN_BUDGET) -> dict:
+    """
+    Compress the raw accessibility trees recorded in `trajectory.jsonl` snapshots, subtask by subtask.
+    The URL is not recorded, the root line of the tree (page role and title) stands for it.
+    """
+    compressor = ObservationCompressor(token_budget, enabled=True, verbose=False)
+    for path in paths:
+        subtasks = OrderedDict()
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get("reset"):
+                    subtasks[record["key"]] = []
+                elif record.get("message", {}).get("role") == "user":
+                    subtasks.setdefault(record["key"], []).append(record["message"]["content"][0]["text"])
+        for texts in subtasks.values():
+            compressor.new_context()
+            for text in texts:
+                compressor.start_turn()
+                for axtree in _AXTREE_SECTION_RE.findall(text):
+                    if axtree.startswith("[SYSTEM INFO"):
+                        continue  # Already compressed
+                    root = axtree.split("\n", 1)[0].strip()
+                    compressor.compress(axtree, key=root)
+    return compressor.stats.to_dict()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded trajectories through the observation compressor")
+    parser.add_argument("paths", nargs="+", help="trajectory.jsonl files, or directories searched for them")
+    parser.add_argument("--budget", type=int, default=OBSERVATION_TOKEN_BUDGET)
+    args = parser.parse_args()
+
+    files = []
+    for p in map(Path, args.paths):
+        files.extend(sorted(p.rglob("trajectory.jsonl")) if p.is_dir() else [p])
+    if not files:
+        print("No trajectory.jsonl found.")
+        sys.exit(1)
+    print(json.dumps({"files": len(files), **replay(files, args.budget)}, indent=2))
@@ -91,7 +91,7 @@ When calling a tool, please output:
 </tool_call>
 - `<function-name>`: Tool function name
 - `<args-json-object>`: Call arguments (JSON format)
-- If multiple `<tool_call>` are output at once, only the first one will be executed; the rest will be ignored.
+- If multiple `<tool_call>` are output at once, they are executed concurrently only when all of them are read-only (`access_the_application_guide`, `extract_image_content_by_gpt4o`); otherwise only the first one will be executed and the rest will be ignored.
 
 Available tool signatures are provided within the `<tools>` tag:
 <tools>
@@ -1,31 +1,13 @@
 
 import os
 import json
+import time
+import sqlite3
+import argparse
 import pandas as pd
 from typing import Dict, List, Optional
 from monitor import Monitor
 
-def iter_round_dirs(base_dir: str):
-    for agent in os.listdir(base_dir):
-        agent_path = os.path.join(base_dir, agent)
-        if not os.path.isdir(agent_path):
-            continue
-        for data_split in os.listdir(agent_path):
-            split_path = os.path.join(agent_path, data_split)
-            if not os.path.isdir(split_path):
-                continue
-            for task in os.listdir(split_path):
-                task_path = os.path.join(split_path, task)
-                if not os.path.isdir(task_path):
-                    continue
-                for name in os.listdir(task_path):
-                    round_path = os.path.join(task_path, name)
-                    if os.path.isdir(round_path) and name.startswith("round_"):
-                        try:
-                            yield agent, data_split, task, int(name[6:]), round_path
-                        except ValueError:
-                            continue
-
 def compute_score(total: Optional[int], result: Optional[int]) -> float:
     if total and total != 0 and result is not None:
         ratio = result / total
@@ -40,95 +22,252 @@ def get_split(task: str, task_split_dict: Optional[Dict[str, List[str]]]) -> str
                 return split_name
     return "unspecified"
 
+ROUND_FILES = ("agent_eval_output.json", "overall_state.json")
+REPORT_INDEX_FILE = ".report_index.sqlite"
+DETAIL_COLUMNS = ["Agent", "Task", "RoundIndex", "DataSplit", "Split", "Checkpoints", "FinalScore",
+                  "NumActions", "TimeUsed", "SubtasksUsed", "ExceptionCount"]
+EXCEPTION_COLUMNS = ["Agent", "Task", "RoundIndex", "DataSplit", "Split", "ExceptionType", "Message"]
+SORT_COLUMNS = ["Agent", "DataSplit", "Split", "Task", "RoundIndex"]
+MTIME_SETTLE_NS = 2 * 10**9  # A directory modified more recently than this is listed again on the next scan
+
+def round_fingerprint(dir_path: str) -> str:
+    """(mtime, size) of the files a round record is read from, a round is re-read only when it changes."""
+    parts = []
+    for name in ROUND_FILES:
+        try:
+            st = os.stat(os.path.join(dir_path, name))
+            parts.append(f"{st.st_mtime_ns}:{st.st_size}")
+        except FileNotFoundError:
+            parts.append("-")
+    return "|".join(parts)
+
+def read_round_record(dir_path: str) -> dict:
+    """Read the evaluation and the monitor state of one round, independently of any task split."""
+    total = result = None
+    eval_fp = os.path.join(dir_path, "agent_eval_output.json")
+    if os.path.isfile(eval_fp):
+        try:
+            with open(eval_fp, "r", encoding="utf-8") as f:
+                score = json.load(f).get("final_score", {})
+            total, result = score.get("total", 0), score.get("result", 0)
+        except Exception:
+            total, result = None, None
+
+    monitor = None
+    exceptions = []
+    overall_fp = os.path.join(dir_path, "overall_state.json")
+    if os.path.isfile(overall_fp):
+        try:
+            with open(overall_fp, "r", encoding="utf-8") as f:
+                overall_state = json.load(f)
+            monitor = Monitor.from_dict(overall_state.get("monitor_state", {}))
+
+            if monitor and monitor.exception.is_exception():
+                if monitor.exception.subtask_limit_exceeded > 0:
+                    exceptions.append(("subtask_limit_exceeded", str(monitor.exception.subtask_limit_exceeded)))
+                for mem_ex in monitor.exception.memory_exception:
+                    exceptions.append(("memory_exception", str(mem_ex)))
+        except Exception as e:
+            print(f"[WARN] Failed to read monitor from {overall_fp}: {e}")
+
+    return {
+        "total": total,
+        "result": result,
+        "final_score": compute_score(total, result),
+        "num_actions": monitor.num_actions if monitor else 0,
+        "time_used": monitor.time_used if monitor else 0,
+        "subtasks_used": monitor.subtasks_used if monitor else 0,
+        "exceptions": exceptions,
+        "tool_calls": {tname: tstat.calls for tname, tstat in monitor.tool_call.items()} if monitor else {},
+    }
+
+
+class ReportIndex:
+    """
+    Incrementally updated SQLite index of the round records under `base_dir`.
+    A scan only lists the directories whose mtime changed since the last scan, and only re-reads the rounds whose
+    result files changed (see `round_fingerprint`), so finished rounds are never parsed twice.
+    """
+    def __init__(self, base_dir: str, path: Optional[str] = None):
+        self.base_dir = base_dir
+        self.path = path or os.path.join(base_dir, REPORT_INDEX_FILE)
+        self.conn = sqlite3.connect(self.path)
+        with self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS rounds ("
+                "round_path TEXT PRIMARY KEY, agent TEXT, data_split TEXT, task TEXT, round_idx INTEGER, "
+                "fingerprint TEXT, total INTEGER, result INTEGER, final_score REAL, num_actions INTEGER, "
+                "time_used REAL, subtasks_used INTEGER, exception_count INTEGER, exceptions TEXT, tool_calls TEXT)"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER, children TEXT)")
+        self._dirs: Dict[str, tuple] = {}
+
+    def _list_dirs(self, path: str) -> List[str]:
+        """Child directories of `path`, listed again only if its mtime changed."""
+        mtime_ns = os.stat(path).st_mtime_ns
+        cached = self._dirs.get(path)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        children = sorted(name for name in os.listdir(path) if os.path.isdir(os.path.join(path, name)))
+        if time.time_ns() - mtime_ns < MTIME_SETTLE_NS:
+            mtime_ns = -1  # Entries added within the same mtime tick would be missed, so list it again next time
+        self._dirs[path] = (mtime_ns, children)
+        self.conn.execute("INSERT OR REPLACE INTO dirs (path, mtime_ns, children) VALUES (?, ?, ?)",
+                          (path, mtime_ns, json.dumps(children)))
+        return children
+
+    def _iter_round_dirs(self):
+        for agent in self._list_dirs(self.base_dir):
+            agent_path = os.path.join(self.base_dir, agent)
+            for data_split in self._list_dirs(agent_path):
+                split_path = os.path.join(agent_path, data_split)
+                for task in self._list_dirs(split_path):
+                    task_path = os.path.join(split_path, task)
+                    for name in self._list_dirs(task_path):
+                        if name.startswith("round_"):
+                            try:
+                                yield agent, data_split, task, int(name[6:]), os.path.join(task_path, name)
+                            except ValueError:
+                                continue
+
+    def update(self) -> int:
+        """Scan `base_dir` and (re)index the new or changed rounds. Returns the number of changed rounds."""
+        self._dirs = {
+            path: (mtime_ns, json.loads(children))
+            for path, mtime_ns, children in self.conn.execute("SELECT path, mtime_ns, children FROM dirs")
+        }
+        known = dict(self.conn.execute("SELECT round_path, fingerprint FROM rounds"))
+        seen, changed = set(), 0
+        with self.conn:
+            for agent, data_split, task, round_idx, dir_path in self._iter_round_dirs():
+                seen.add(dir_path)
+                fingerprint = round_fingerprint(dir_path)
+                if known.get(dir_path) == fingerprint:
+                    continue
+                record = read_round_record(dir_path)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO rounds VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (dir_path, agent, data_split, task, round_idx, fingerprint, record["total"], record["result"],
+                     record["final_score"], record["num_actions"], record["time_used"], record["subtasks_used"],
+                     len(record["exceptions"]), json.dumps(record["exceptions"], ensure_ascii=False),
+                     json.dumps(record["tool_calls"]))
+                )
+                changed += 1
+            removed = [(path,) for path in known if path not in seen]
+            self.conn.executemany("DELETE FROM rounds WHERE round_path = ?", removed)
+            self.conn.executemany("DELETE FROM dirs WHERE path = ?",
+                                  [(path,) for path in self._dirs if not os.path.isdir(path)])
+        return changed + len(removed)
+
+    def records(
+        self,
+        task_split_dict: Optional[Dict[str, List[str]]] = None,
+        tools_of_interest: Optional[List[str]] = None,
+    ):
+        """Detailed and exception frames of the indexed rounds."""
+        detail_rows, exception_rows = [], []
+        for (agent, data_split, task, round_idx, total, result, final_score, num_actions, time_used,
+             subtasks_used, exception_count, exceptions, tool_calls) in self.conn.execute(
+                "SELECT agent, data_split, task, round_idx, total, result, final_score, num_actions, time_used, "
+                "subtasks_used, exception_count, exceptions, tool_calls FROM rounds"):
+            split = get_split(task, task_split_dict)
+            row = {
+                "Agent": agent,
+                "Task": task,
+                "RoundIndex": round_idx,
+                "DataSplit": data_split,
+                "Split": split,
+                "Checkpoints": f"{result}/{total}" if total not in (None, 0) else "N/A",
+                "FinalScore": final_score,
+                "NumActions": num_actions,
+                "TimeUsed": time_used,
+                "SubtasksUsed": subtasks_used,
+                "ExceptionCount": exception_count
+            }
+            for tname, calls in json.loads(tool_calls).items():
+                if tools_of_interest is None or tname in tools_of_interest:
+                    row[tname] = calls
+            detail_rows.append(row)
+
+            for exception_type, message in json.loads(exceptions):
+                exception_rows.append({
+                    "Agent": agent,
+                    "Task": task,
+                    "RoundIndex": round_idx,
+                    "DataSplit": data_split,
+                    "Split": split,
+                    "ExceptionType": exception_type,
+                    "Message": message,
+                })
+
+        df_detail = pd.DataFrame(detail_rows, columns=None if detail_rows else DETAIL_COLUMNS).sort_values(
+            SORT_COLUMNS
+        ).reset_index(drop=True)
+
+        df_exceptions = pd.DataFrame(exception_rows, columns=EXCEPTION_COLUMNS).sort_values(
+            SORT_COLUMNS
+        ).reset_index(drop=True)
+
+        return df_detail, df_exceptions
+
+    def summarize(self, task_split_dict: Optional[Dict[str, List[str]]] = None) -> pd.DataFrame:
+        """Same table as `summarize_scores`, aggregated in SQL over the index."""
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS task_splits (task TEXT PRIMARY KEY, split TEXT)")
+            self.conn.execute("DELETE FROM task_splits")
+            for split_name, task_list in (task_split_dict or {}).items():
+                # The first split listing a task wins, as in `get_split`
+                self.conn.executemany("INSERT OR IGNORE INTO task_splits VALUES (?, ?)",
+                                      [(task, split_name) for task in task_list])
+        rows = []
+        for (agent, data_split, split, result_sum, total_sum, avg_score, full_rate, *metrics) in self.conn.execute(
+                "SELECT r.agent, r.data_split, COALESCE(s.split, 'unspecified') AS split, "
+                "SUM(CASE WHEN r.total > 0 THEN r.result ELSE 0 END), SUM(CASE WHEN r.total > 0 THEN r.total ELSE 0 END), "
+                "AVG(r.final_score), AVG(r.final_score = 1.0), "
+                "AVG(r.num_actions), AVG(r.time_used), AVG(r.subtasks_used), AVG(r.exception_count) "
+                "FROM rounds r LEFT JOIN task_splits s ON s.task = r.task "
+                "GROUP BY r.agent, r.data_split, split ORDER BY r.agent, r.data_split, split"):
+            rows.append({
+                "Agent": agent,
+                "DataSplit": data_split,
+                "Split": split,
+                "Checkpoints": f"{result_sum}/{total_sum}" if total_sum > 0 else "N/A",
+                "Avg_FinalScore": round(avg_score, 4) if avg_score is not None else "N/A",
+                "FullCompletionRate": round(full_rate, 4),
+                **{k: round(v, 4) for k, v in zip(
+                    ["Avg_NumActions", "Avg_TimeUsed", "Avg_SubtasksUsed", "Avg_ExceptionCount"], metrics)}
+            })
+        return pd.DataFrame(rows)
+
+    def close(self):
+        self.conn.close()
+
+
 def collect_task_records(
     base_dir: str,
     task_split_dict: Optional[Dict[str, List[str]]] = None,
     tools_of_interest: Optional[List[str]] = None,
+    index: Optional[ReportIndex] = None,
 ):
-    detail_rows, exception_rows = [], []
-
-    for agent, data_split, task, round_idx, dir_path in iter_round_dirs(base_dir):
-        total = result = None
-        eval_fp = os.path.join(dir_path, "agent_eval_output.json")
-        if os.path.isfile(eval_fp):
-            try:
-                with open(eval_fp, "r", encoding="utf-8") as f:
-                    score = json.load(f).get("final_score", {})
-                total, result = score.get("total", 0), score.get("result", 0)
-            except Exception:
-                total, result = None, None
-        final_score = compute_score(total, result)
-        checkpoints = f"{result}/{total}" if total not in (None, 0) else "N/A"
-
-        monitor = None
-        exception_count = 0
-        overall_fp = os.path.join(dir_path, "overall_state.json")
-        if os.path.isfile(overall_fp):
-            try:
-                with open(overall_fp, "r", encoding="utf-8") as f:
-                    overall_state = json.load(f)
-                monitor = Monitor.from_dict(overall_state.get("monitor_state", {}))
-
-                if monitor and monitor.exception.is_exception():
-                    if monitor.exception.subtask_limit_exceeded > 0:
-                        exception_rows.append({
-                            "Agent": agent,
-                            "Task": task,
-                            "RoundIndex": round_idx,
-                            "DataSplit": data_split,
-                            "Split": get_split(task, task_split_dict),
-                            "ExceptionType": "subtask_limit_exceeded",
-                            "Message": str(monitor.exception.subtask_limit_exceeded),
-                        })
-                        exception_count += 1
-                    for mem_ex in monitor.exception.memory_exception:
-                        exception_rows.append({
-                            "Agent": agent,
-                            "Task": task,
-                            "RoundIndex": round_idx,
-                            "DataSplit": data_split,
-                            "Split": get_split(task, task_split_dict),
-                            "ExceptionType": "memory_exception",
-                            "Message": str(mem_ex),
-                        })
-                        exception_count += 1
-            except Exception as e:
-                print(f"[WARN] Failed to read monitor from {overall_fp}: {e}")
-
-        difficulty_split = get_split(task, task_split_dict)
-
-        row = {
-            "Agent": agent,
-            "Task": task,
-            "RoundIndex": round_idx,
-            "DataSplit": data_split,
-            "Split": difficulty_split,
-            "Checkpoints": checkpoints,
-            "FinalScore": final_score,
-            "NumActions": (monitor.num_actions if monitor else 0),
-            "TimeUsed": (monitor.time_used if monitor else 0),
-            "SubtasksUsed": (monitor.subtasks_used if monitor else 0),
-            "ExceptionCount": exception_count
-        }
-
-        if monitor:
-            items = monitor.tool_call.items()
-            if tools_of_interest is not None:
-                items = [(k, v) for k, v in items if k in tools_of_interest]
-            for tname, tstat in items:
-                row[tname] = tstat.calls
-
-        detail_rows.append(row)
-
-    df_detail = pd.DataFrame(detail_rows).sort_values(
-        ["Agent","DataSplit","Split","Task","RoundIndex"]
-    ).reset_index(drop=True)
-
-    df_exceptions = pd.DataFrame(exception_rows).sort_values(
-        ["Agent","DataSplit","Split","Task","RoundIndex"]
-    ).reset_index(drop=True)
-
-    return df_detail, df_exceptions
+    index = index or ReportIndex(base_dir)
+    index.update()
+    return index.records(task_split_dict, tools_of_interest)
+
+def watch(base_dir: str, task_split_dict: Optional[Dict[str, List[str]]] = None, interval: float = 10.0):
+    """Refresh the summary live during a sweep, only the rounds written since the last refresh are read."""
+    index = ReportIndex(base_dir)
+    try:
+        while True:
+            changed = index.update()
+            if changed:
+                print(f"\n[{time.strftime('%H:%M:%S')}] {changed} round(s) updated")
+                print(index.summarize(task_split_dict).to_string(index=False))
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        index.close()
 
 def print_grouped_report(df: pd.DataFrame):
     pd.set_option("display.max_columns", None)
@@ -238,11 +377,22 @@ if __name__ == "__main__":
     # task_splits = {}
     tools_focus = ["access_the_application_guide"]  # Tools that need to report usage information
 
-    df_report, df_exceptions = collect_task_records("outputs", task_splits, tools_of_interest=tools_focus)
+    parser = argparse.ArgumentParser(description="MUSE report")
+    parser.add_argument("--base_dir", type=str, default="outputs")
+    parser.add_argument("--watch", action="store_true", help="Refresh the summary live instead of writing REPORT.xlsx")
+    parser.add_argument("--interval", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.watch:
+        watch(args.base_dir, task_splits, args.interval)
+        raise SystemExit(0)
+
+    report_index = ReportIndex(args.base_dir)
+    df_report, df_exceptions = collect_task_records(args.base_dir, task_splits, tools_of_interest=tools_focus, index=report_index)
 
     print_grouped_report(df_report)
 
-    summary_df = summarize_scores(df_report)
+    summary_df = report_index.summarize(task_splits)
 
     print(summary_df)
     print(df_exceptions)
@@ -1,16 +1,32 @@
-import json
-import subprocess
+import os
 import sys
+import json
 import time
-import random
-import shutil
+import asyncio
+import argparse
+import traceback
+import contextvars
 from pathlib import Path
 
+from llm_pool import POOL_SHARE_ENV
+from browser import BROWSER_USER_DATA_DIR_ENV
+
 # --- 配置 ---
 TASK_JSON_PATH = "gitlab_tasks_final.json"
 AGENT_SCRIPT = "run_single_task.py"
+AGENT_NAME = "muse_bot"
 MEMORY_DIR = "memory"
+OUTPUT_DIR = "outputs"
 LLM_MODEL = "deepseek-chat"
+NUM_SLOTS = 4        # 并发任务槽位数，每个槽位拥有独立的浏览器
+TASK_ROUND = 1
+# 推测执行：计划可信时，反思与下一子任务的首个动作并行，反思确认成功后预取重规划 (节省的时间与浪费的 token 记录在 monitor_state.speculation)
+SPECULATIVE = False
+# inprocess:  槽位是同一进程中的协程，长驻的事件循环、LLM 客户端、浏览器与记忆管理器在任务之间复用
+# subprocess: 每个任务一个 run_single_task.py 进程 (崩溃隔离，但每个任务都要重新导入、启动浏览器、加载记忆)
+RUNNER = "inprocess"
+# 第 1 个槽位使用默认浏览器配置目录，其余槽位各用一个 (Chrome 不允许多个实例共用一个配置目录)
+SLOT_PROFILE_DIR = "~/.config/browseruse/profiles/muse_slot_{slot}"
 
 # URL 映射 (根据你的 WebArena 部署修改)
 URL_MAPPING = {
@@ -27,7 +43,7 @@ def clean_memory():
     if path.exists():
         print("🧹 Cleaning old memory...")
         # 注意：如果你想保留以前训练好的记忆，请注释掉这一行
-        # shutil.rmtree(path) 
+        # shutil.rmtree(path)
         pass
     path.mkdir(exist_ok=True)
 
@@ -37,50 +53,270 @@ def replace_urls(text):
         text = text.replace(key, value)
     return text
 
-def run_task_batch(tasks, mode):
-    """运行一批任务"""
-    results = []
-    total = len(tasks)
-    
-    print(f"\n{'='*20} STARTING {mode.upper()} PHASE ({total} tasks) {'='*20}")
-    
-    for i, task_conf in enumerate(tasks):
-        task_id = task_conf.get("task_id")
-        task_name = f"task_{task_id}"
-        raw_intent = task_conf.get("intent", "")
-        raw_url = task_conf.get("start_url", "")
-        
-        intent = replace_urls(raw_intent)
-        start_url = replace_urls(raw_url)
-        
-        print(f"\n▶️ [{mode.upper()}] {i+1}/{total} | ID: {task_id} | Intent: {intent[:50]}...")
-        
-        cmd = [
-            sys.executable, AGENT_SCRIPT,
-            "--task_name", task_name,
-            "--task", intent,
-            "--start_url", start_url,
-            "--mode", mode,
-            "--llm", LLM_MODEL
-        ]
-        
+def result_path(mode, task_name):
+    return Path(OUTPUT_DIR) / AGENT_NAME / mode / task_name / f"round_{TASK_ROUND}" / "result.json"
+
+def load_result(mode, task_name):
+    path = result_path(mode, task_name)
+    if not path.exists():
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return None
+
+
+class ProgressLedger:
+    """
+    进度账本 (JSONL, 追加写入)：记录每个任务的开始/结束，重启时已有 result.json 的任务会被跳过。
+    """
+    def __init__(self, mode):
+        self.path = Path(OUTPUT_DIR) / AGENT_NAME / mode / "progress.jsonl"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def record(self, task_name, status, **fields):
+        entry = {"task_id": task_name, "status": status, "ts": round(time.time(), 2), **fields}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def interrupted_tasks(self):
+        """上次运行中已开始但没有结束记录的任务"""
+        started, finished = set(), set()
+        if self.path.exists():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    (started if entry["status"] == "started" else finished).add(entry["task_id"])
+        return started - finished
+
+
+def slot_profile_dir(slot):
+    return SLOT_PROFILE_DIR.format(slot=slot) if slot > 1 else None
+
+def task_log_path(mode, task_name):
+    log_path = Path(OUTPUT_DIR) / AGENT_NAME / mode / "logs" / f"{task_name}.log"
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    return log_path
+
+
+_current_output = contextvars.ContextVar("muse_task_output", default=None)
+
+class _TaskOutput:
+    def __init__(self, prefix, log_f):
+        self.prefix = prefix
+        self.log_f = log_f
+        self.pending = ""
+
+class SlotOutput:
+    """
+    进程内模式下 sys.stdout/sys.stderr 的替身：按当前槽位 (contextvar) 给每一行加前缀输出到终端，
+    同时完整写入该任务的日志文件，与子进程模式的多路复用输出一致。
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        output = _current_output.get()
+        if output is None:
+            return self.stream.write(text)
+        output.log_f.write(text)
+        output.pending += text
+        while "\n" in output.pending:
+            line, output.pending = output.pending.split("\n", 1)
+            if line.strip():
+                self.stream.write(f"{output.prefix} {line}\n")
+        return len(text)
+
+    def flush(self):
+        output = _current_output.get()
+        if output is not None:
+            output.log_f.flush()
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+async def _pump_output(stream, slot, task_name, log_path):
+    """多路复用：子进程输出加上槽位前缀打印到终端，同时完整写入该任务的日志文件"""
+    prefix = f"[S{slot}|{task_name}]"
+    with open(log_path, "ab") as log_f:
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            log_f.write(line)
+            text = line.decode("utf-8", errors="replace").rstrip()
+            if text:
+                print(f"{prefix} {text}", flush=True)
+
+async def run_task_in_slot(slot, task_conf, mode, ledger, num_slots):
+    task_id = task_conf.get("task_id")
+    task_name = f"task_{task_id}"
+    intent = replace_urls(task_conf.get("intent", ""))
+    start_url = replace_urls(task_conf.get("start_url", ""))
+
+    print(f"\n▶️ [{mode.upper()}] Slot {slot} | ID: {task_id} | Intent: {intent[:50]}...")
+
+    cmd = [
+        sys.executable, AGENT_SCRIPT,
+        "--agent_name", AGENT_NAME,
+        "--task_name", task_name,
+        "--task", intent,
+        "--start_url", start_url,
+        "--mode", mode,
+        "--round", str(TASK_ROUND),
+        "--llm", LLM_MODEL
+    ]
+    if SPECULATIVE:
+        cmd.append("--speculative")
+    log_path = task_log_path(mode, task_name)
+    env = {**os.environ, POOL_SHARE_ENV: str(1 / num_slots), "PYTHONUNBUFFERED": "1"}
+    if slot_profile_dir(slot):
+        env[BROWSER_USER_DATA_DIR_ENV] = slot_profile_dir(slot)
+
+    ledger.record(task_name, "started", slot=slot)
+    st_time = time.time()
+    returncode = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=env
+        )
+        await _pump_output(proc.stdout, slot, task_name, log_path)
+        returncode = await proc.wait()
+    except Exception as e:
+        print(f"❌ Error running {task_name}: {e}")
+
+    # 读取该任务的结果
+    result = load_result(mode, task_name)
+    if result is None:
+        result = {"task_id": task_name, "success": False, "status": "CRASHED"}
+    duration = round(time.time() - st_time, 2)
+    ledger.record(task_name, "finished", slot=slot, success=result.get("success"), returncode=returncode, duration=duration)
+    print(f"⏹️ [{mode.upper()}] Slot {slot} | {task_name} finished in {duration}s | success={result.get('success')}")
+    return result
+
+async def run_task_in_process(slot, task_conf, mode, ledger, task_slot):
+    from run_single_task import run_task
+
+    task_id = task_conf.get("task_id")
+    task_name = f"task_{task_id}"
+    intent = replace_urls(task_conf.get("intent", ""))
+    start_url = replace_urls(task_conf.get("start_url", ""))
+
+    print(f"\n▶️ [{mode.upper()}] Slot {slot} | ID: {task_id} | Intent: {intent[:50]}...")
+
+    ledger.record(task_name, "started", slot=slot)
+    st_time = time.time()
+    result = None
+    with open(task_log_path(mode, task_name), "a", encoding="utf-8") as log_f:
+        token = _current_output.set(_TaskOutput(f"[S{slot}|{task_name}]", log_f))
         try:
-            subprocess.run(cmd, check=False)
+            result = await run_task(
+                task_name=task_name,
+                task=intent,
+                mode=mode,
+                start_url=start_url,
+                task_round=TASK_ROUND,
+                llm=LLM_MODEL,
+                agent_name=AGENT_NAME,
+                slot=task_slot,
+                speculative=SPECULATIVE
+            )
         except Exception as e:
+            # 单个任务的异常不影响其他任务，浏览器关闭后在下个任务中重新启动
             print(f"❌ Error running {task_name}: {e}")
+            traceback.print_exc()
+            await task_slot.browser.close()
+        finally:
+            _current_output.reset(token)
 
-        # 读取该任务的结果
-        res_path = Path("outputs") / "muse_bot" / mode / task_name / "round_1" / "result.json"
-        if res_path.exists():
-            with open(res_path, "r") as f:
-                results.append(json.load(f))
+    if result is None:
+        result = load_result(mode, task_name) or {"task_id": task_name, "success": False, "status": "CRASHED"}
+    duration = round(time.time() - st_time, 2)
+    ledger.record(task_name, "finished", slot=slot, success=result.get("success"), duration=duration)
+    print(f"⏹️ [{mode.upper()}] Slot {slot} | {task_name} finished in {duration}s | success={result.get('success')}")
+    return result
+
+async def run_task_batch(tasks, mode, num_slots=NUM_SLOTS, runner=RUNNER):
+    """以 num_slots 个并发槽位运行一批任务，已完成的任务 (存在 result.json) 直接复用结果"""
+    total = len(tasks)
+    ledger = ProgressLedger(mode)
+    interrupted = ledger.interrupted_tasks()
+    results = [None] * total
+
+    queue = asyncio.Queue()
+    for i, task_conf in enumerate(tasks):
+        task_name = f"task_{task_conf.get('task_id')}"
+        done = load_result(mode, task_name)
+        if done is not None:
+            results[i] = done
         else:
-            results.append({"task_id": task_name, "success": False, "status": "CRASHED"})
-            
+            if task_name in interrupted:
+                print(f"🔁 {task_name} was interrupted in a previous run, restarting it.")
+            queue.put_nowait(i)
+
+    print(f"\n{'='*20} STARTING {mode.upper()} PHASE ({total} tasks, {total - queue.qsize()} already done, {num_slots} {runner} slots) {'='*20}")
+
+    async def subprocess_slot_worker(slot):
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results[i] = await run_task_in_slot(slot, tasks[i], mode, ledger, num_slots)
+
+    async def inprocess_slot_worker(slot):
+        from browser import BrowserUse, bind_browser
+        from run_single_task import TaskSlot
+
+        profile_dir = slot_profile_dir(slot)
+        task_slot = TaskSlot(browser=BrowserUse(user_data_dir=profile_dir) if profile_dir else BrowserUse())
+        # 每个槽位协程是独立的 asyncio 任务，浏览器绑定只对本槽位生效
+        bind_browser(task_slot.browser)
+        try:
+            while True:
+                try:
+                    i = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                results[i] = await run_task_in_process(slot, tasks[i], mode, ledger, task_slot)
+        finally:
+            await task_slot.browser.close()
+
+    if runner == "subprocess":
+        await asyncio.gather(*[subprocess_slot_worker(slot) for slot in range(1, num_slots + 1)])
+        return results
+
+    from interpreter_pool import get_interpreter_pool
+
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = SlotOutput(stdout), SlotOutput(stderr)
+    try:
+        await asyncio.gather(*[inprocess_slot_worker(slot) for slot in range(1, num_slots + 1)])
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        await get_interpreter_pool().close()
     return results
 
 def main():
-    mode = 'test'
+    parser = argparse.ArgumentParser(description="MUSE Benchmark Runner")
+    parser.add_argument("--mode", type=str, default="test", choices=["train", "test"])
+    parser.add_argument("--slots", type=int, default=NUM_SLOTS, help="Number of tasks running concurrently")
+    parser.add_argument("--runner", type=str, default=RUNNER, choices=["inprocess", "subprocess"],
+                        help="Run the tasks in this process, or each task in its own process (crash isolation)")
+    args = parser.parse_args()
+    mode = args.mode
+    # 所有槽位共享同一个 LLM 提供方的限额 (见 config.yaml 的 llm_pool)：进程内模式下所有槽位共用本进程的限流器，
+    # 子进程模式下每个 Agent 进程只获得 1/slots 的并发与速率
+    num_slots = max(1, args.slots)
 
     # 1. 准备数据
     if not Path(TASK_JSON_PATH).exists():
@@ -89,17 +325,18 @@ def main():
 
     with open(TASK_JSON_PATH, "r", encoding="utf-8") as f:
         all_tasks = json.load(f)
-    
+
     print(f"📊 Dataset Split: Total={len(all_tasks)}")
 
+    train_results = []
     if mode == 'train':
         # 2. 初始化记忆环境
         clean_memory()
-        
+
         # 3. 训练阶段 (Training Phase)
-        # Agent 在此阶段会写入 memory/tool_memory.json 等文件
-        train_results = run_task_batch(all_tasks, "train")
-        
+        # Agent 在此阶段会写入 memory/ 下的记忆 (多个槽位通过 memory_store 的日志与文件锁安全地共享)
+        train_results = asyncio.run(run_task_batch(all_tasks, "train", num_slots, args.runner))
+
         train_success = sum(1 for r in train_results if r.get("success"))
         print(f"\n🧠 Training Phase Complete. Success: {train_success}/{len(all_tasks)}")
         print("💾 Memory updated based on training tasks.")
@@ -107,18 +344,18 @@ def main():
     else:
         # 4. 测试阶段 (Testing Phase)
         # Agent 读取 memory/ 文件夹中的经验，但不进行写入
-        test_results = run_task_batch(all_tasks, "test")
-        
+        test_results = asyncio.run(run_task_batch(all_tasks, "test", num_slots, args.runner))
+
         # 5. 最终报告
         test_success = sum(1 for r in test_results if r.get("success"))
         accuracy = test_success / len(all_tasks) * 100
-        
+
         print(f"\n{'='*50}")
         print(f"🏆 FINAL BENCHMARK REPORT")
         print(f"{'='*50}")
         print(f"Test Success:   {test_success}")
         print(f"Test Accuracy:  {accuracy:.2f}%")
-        
+
         # 保存汇总结果
         with open("final_report.json", "w") as f:
             json.dump({
@@ -128,4 +365,4 @@ def main():
             }, f, indent=4)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -3,67 +3,105 @@ import json
 import asyncio
 import argparse
 from pathlib import Path
+from dataclasses import dataclass
+from typing import Optional
 
 from agent import MUSE
+from browser import BrowserUse
+from memory_manager import MemoryManager
+from interpreter_pool import get_interpreter_pool
+from llm_pool import track_task_metrics
+from observation import ObservationCompressor, bind_observation_compressor
 from prompt.system_prompt import MUSE_sys_prompt
 
 # 确保 memory 目录存在
 MEMORY_DIR = Path("memory")
 MEMORY_DIR.mkdir(exist_ok=True)
 
-async def main():
-    parser = argparse.ArgumentParser(description="MUSE Pipeline Runner")
-    parser.add_argument("--agent_name", type=str, default="muse_bot")
-    parser.add_argument("--task_name", type=str, required=True)
-    parser.add_argument("--task", type=str, required=True)
-    parser.add_argument("--mode", type=str, required=True, choices=["train", "test"])
-    parser.add_argument("--round", type=int, default=1)
-    parser.add_argument("--llm", type=str, default="deepseek-chat")
-    parser.add_argument("--start_url", type=str, default="")
-    
-    args = parser.parse_args()
 
+@dataclass
+class TaskSlot:
+    """长驻运行器中一个槽位跨任务复用的资源：浏览器与记忆管理器"""
+    browser: BrowserUse
+    memory_manager: Optional[MemoryManager] = None
+
+
+async def run_task(
+        task_name: str,
+        task: str,
+        mode: str,
+        start_url: str = "",
+        task_round: int = 1,
+        llm: str = "deepseek-chat",
+        agent_name: str = "muse_bot",
+        slot: Optional[TaskSlot] = None,
+        speculative: bool = False
+) -> dict:
+    """
+    运行单个任务并写出 result.json。
+    传入 slot 时复用其浏览器 (任务开始前重置为空白页) 与记忆管理器 (重置任务状态并重新加载记忆)。
+    浏览器需已通过 `browser.bind_browser` 绑定到当前上下文。
+    """
     # 配置逻辑：
     # Train 模式: 使用记忆 + 更新记忆 (边做边学)
     # Test  模式: 使用记忆 + 不更新记忆 (只考不学)
-    
-    use_mem = True  
-    update_mem = True if args.mode == "train" else False
 
-    print(f"🔄 Mode: {args.mode.upper()} | Use Memory: {use_mem} | Update Memory: {update_mem}")
+    use_mem = True
+    update_mem = True if mode == "train" else False
+
+    print(f"🔄 Mode: {mode.upper()} | Use Memory: {use_mem} | Update Memory: {update_mem}")
+
+    # 解释器池在后台预热，任务的第一段代码不必等待 pandas/numpy 等模块的导入
+    get_interpreter_pool()
+    # num_calls.txt 只统计本任务的 LLM 调用 (进程内模式下多个槽位共享同一进程的全局计数)
+    track_task_metrics()
+    if slot is not None:
+        await slot.browser.reset_for_task()
+    compressor = ObservationCompressor()
+    bind_observation_compressor(compressor)
 
     agent = MUSE(
-        init_model_name=args.llm,
+        init_model_name=llm,
         sys_prompt_template=MUSE_sys_prompt,
         memory_dir=str(MEMORY_DIR), # 指向同一个记忆文件夹
-        agent_name=args.agent_name,
-        task_name=args.task_name,
+        agent_name=agent_name,
+        task_name=task_name,
         output_dir="outputs",
-        mode_label=args.mode,
-        task_round=args.round,
+        mode_label=mode,
+        task_round=task_round,
         use_memory=use_mem,
-        update_memory=update_mem
+        update_memory=update_mem,
+        memory_manager=slot.memory_manager if slot is not None else None,
+        speculative=speculative
     )
+    if slot is not None:
+        slot.memory_manager = agent.memory_manager
+
+    full_prompt = f"Task Goal: {task}\n\nTarget Website URL: {start_url}"
+
+    agent.logger.log_task(full_prompt, subtitle=f"{mode.upper()} PHASE", title=f"Task: {task_name}")
 
-    full_prompt = f"Task Goal: {args.task}\n\nTarget Website URL: {args.start_url}"
-    
-    agent.logger.log_task(full_prompt, subtitle=f"{args.mode.upper()} PHASE", title=f"Task: {args.task_name}")
-    
     action_limit = 20
-    
-    await agent.run(full_prompt, subtask_action_limit=action_limit, time_limit=2400, verbose=False)
+
+    try:
+        await agent.run(full_prompt, subtask_action_limit=action_limit, time_limit=2400, verbose=False)
+    finally:
+        # 释放该任务在解释器池中的命名空间
+        await get_interpreter_pool().reset(str(agent._get_output_dir()))
 
     # --- 结果判定 (基于 Agent 自我认知) ---
     is_success = False
     if not agent.to_do_subtasks and agent.monitor.done_subtasks:
         if agent.monitor.done_subtasks[-1].finish:
             is_success = True
-    
+
     result_data = {
-        "task_id": args.task_name,
+        "task_id": task_name,
         "success": is_success,
-        "mode": args.mode,
-        "actions": agent.monitor.num_actions
+        "mode": mode,
+        "actions": agent.monitor.num_actions,
+        # 压缩率 (ratio) 与 success 一起记录，可对比 MUSE_OBSERVATION_COMPRESSION=0/1 两次运行
+        "observation": {"compression": compressor.enabled, **compressor.stats.to_dict()}
     }
 
     # 输出结果
@@ -71,8 +109,33 @@ async def main():
     output_path.mkdir(parents=True, exist_ok=True)
     with open(output_path / "result.json", "w", encoding="utf-8") as f:
         json.dump(result_data, f, indent=4)
-    
-    print(f"[{args.mode.upper()}] Task {args.task_name}: {'✅ SUCCESS' if is_success else '❌ FAILURE'}")
+
+    print(f"[{mode.upper()}] Task {task_name}: {'✅ SUCCESS' if is_success else '❌ FAILURE'}")
+    return result_data
+
+async def main():
+    parser = argparse.ArgumentParser(description="MUSE Pipeline Runner")
+    parser.add_argument("--agent_name", type=str, default="muse_bot")
+    parser.add_argument("--task_name", type=str, required=True)
+    parser.add_argument("--task", type=str, required=True)
+    parser.add_argument("--mode", type=str, required=True, choices=["train", "test"])
+    parser.add_argument("--round", type=int, default=1)
+    parser.add_argument("--llm", type=str, default="deepseek-chat")
+    parser.add_argument("--start_url", type=str, default="")
+    parser.add_argument("--speculative", action="store_true", help="推测执行：反思与下一子任务的首个动作、重规划并行")
+
+    args = parser.parse_args()
+
+    await run_task(
+        task_name=args.task_name,
+        task=args.task,
+        mode=args.mode,
+        start_url=args.start_url,
+        task_round=args.round,
+        llm=args.llm,
+        agent_name=args.agent_name,
+        speculative=args.speculative
+    )
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+
+import time
+import asyncio
+from typing import Any, Awaitable, List, Optional
+
+from monitor import SpeculationStat
+from utils import estimate_tokens
+
+
+def messages_tokens(messages: List[dict]) -> int:
+    return sum(
+        estimate_tokens(part.get("text", ""))
+        for message in messages for part in message.get("content", []) if isinstance(part, dict)
+    )
+
+
+class Speculation:
+    """
+    An LLM call started ahead of the step that needs it, while the agent is still busy with the previous step.
+    The step either takes the result, which records the overlapped latency as saved, or discards it (cancelling the call
+    if it is still running), which records its tokens as wasted.
+    """
+    def __init__(self, kind: str, call: Awaitable[str], prompt_tokens: int, stat: SpeculationStat, key: Any = None):
+        self.kind = kind
+        self.key = key  # What the speculation was made for, checked by the step before taking the result
+        self.prompt_tokens = prompt_tokens
+        self.stat = stat
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.closed = False
+        self.task = asyncio.create_task(self._run(call))
+        stat.launched += 1
+
+    async def _run(self, call: Awaitable[str]) -> str:
+        try:
+            return await call
+        finally:
+            self.finished = time.perf_counter()
+
+    def _tokens(self) -> int:
+        if self.task.done() and not self.task.cancelled() and self.task.exception() is None:
+            return self.prompt_tokens + estimate_tokens(self.task.result())
+        return self.prompt_tokens
+
+    async def take(self) -> Optional[str]:
+        """The result of the call, or `None` when it failed (the step then makes the call itself)."""
+        wait_start = time.perf_counter()
+        try:
+            result = await self.task
+        except Exception as e:
+            self.discard(f"the call failed, {e}")
+            return None
+        waited = time.perf_counter() - wait_start
+        saved = max(0.0, self.finished - self.started - waited)
+        self.closed = True
+        self.stat.accepted += 1
+        self.stat.time_saved = round(self.stat.time_saved + saved, 2)
+        self.stat.tokens += self._tokens()
+        print(f"[SYSTEM INFO][SPECULATION] ℹ️ Speculative {self.kind} accepted, {saved:.2f}s saved.")
+        return result
+
+    def discard(self, reason: str):
+        if self.closed:
+            return
+        self.closed = True
+        if not self.task.done():
+            self.task.cancel()
+        tokens = self._tokens()
+        self.stat.discarded += 1
+        self.stat.tokens += tokens
+        self.stat.wasted_tokens += tokens
+        print(f"[SYSTEM INFO][SPECULATION] ℹ️ Speculative {self.kind} discarded ({reason}), ~{tokens} tokens wasted.")
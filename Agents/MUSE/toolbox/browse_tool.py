@@ -1,18 +1,27 @@
 
 import asyncio
 
-from browser import BrowserUse
+from browser import BrowserUse, BrowserProxy
+from observation import get_observation_compressor
 
-browser = BrowserUse()
+# The browser of the current task, see `browser.bind_browser`
+browser = BrowserProxy(BrowserUse())
 
 browser_axtree_wrapper = "<webpage accessibility tree>\n{axtree}\n</webpage accessibility tree>"
 browser_state_wrapper = "<webpage interactive elements>\n{state}\n</webpage interactive elements>"
 tool_result_prompt = "Performed browser action: {tool_result}\nThe updated browser page status is as follows:\n" + browser_axtree_wrapper + "\n" + browser_state_wrapper + "\n"
 
-async def _get_browser_observation(wait_seconds: int=1):
-    await asyncio.sleep(wait_seconds)
-    axtree = await browser.get_axtree()
-    state = await browser.get_browser_state()
+async def _compress_axtree(axtree: str) -> str:
+    # Diffs are made against the previous tree of the same URL
+    return get_observation_compressor().compress(axtree, key=await browser.get_current_url())
+
+async def _get_browser_observation(max_wait: float=1, compress: bool=True):
+    # Wait until the page is settled (at most `max_wait` seconds), then fetch both views of the page concurrently
+    settle = await browser.wait_for_settle(max_wait=max_wait)
+    print(f"[SYSTEM INFO][BROWSER] ℹ️ Page settle time: {settle['settle_time']}s (settled={settle['settled']})")
+    axtree, state = await asyncio.gather(browser.get_axtree(), browser.get_browser_state())
+    if compress:
+        axtree = await _compress_axtree(axtree)
     return axtree, state
 
 async def browser_extract_content_by_vision(query: str):
@@ -78,13 +87,13 @@ async def browser_wait_and_get_update(seconds: int = 3):
         seconds: The number of seconds to wait, the default is 3 seconds.
     """
     result = await browser.wait(seconds)
-    axtree, state = await _get_browser_observation()
-    browser_status_text = tool_result_prompt.format(axtree=axtree, state=state, tool_result=str(result))
+    axtree, state = await _get_browser_observation(compress=False)
+    # The local archive keeps the full accessibility tree
     with open("workspace/latest_browser_status.txt", "w") as f:
-        f.write(browser_status_text)
+        f.write(tool_result_prompt.format(axtree=axtree, state=state, tool_result=str(result)))
 
     yield {
-        "data": browser_status_text,
+        "data": tool_result_prompt.format(axtree=await _compress_axtree(axtree), state=state, tool_result=str(result)),
         "instruction": ""
     }
 
@@ -1,29 +1,19 @@
-import json
 import traceback
-from pathlib import Path
 from typing import List, Dict, Optional, Union
 
+from memory_store import MemoryStore
+
 memory_dir = "memory"
-path = Path(memory_dir) / "procedural_memory.json"
+store = MemoryStore(memory_dir)
 application_guide: Dict[str, Dict[str, str]] = {}
 
 def _update_application_guide() -> None:
+    # Snapshot + journal tail, so the entries saved by other workers since the last compaction are visible too
     global application_guide
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            text = f.read()
-            if not text.strip():
-                print(f"Warning: {path} is empty.")
-            else:
-                try:
-                    application_guide = json.loads(text)
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON in {path}: {e}")
-                    traceback.print_exc()
-    except FileNotFoundError:
-        print(f"File not found: {path}")
+        application_guide = store.load_one("procedural")
     except Exception as e:
-        print(f"Unexpected error reading {path}: {e}")
+        print(f"Unexpected error reading the application guide in {memory_dir}: {e}")
         traceback.print_exc()
 
 def _access_guides_core(batch_requests: Dict[str, List[str]]) -> str:
@@ -1,9 +1,14 @@
 
-import subprocess
+import os
 import json
+import codecs
+import signal
+import asyncio
 import traceback
 import shlex
 
+from utils import HeadTailBuffer
+
 # ========================================================================
 # Config
 # ========================================================================
@@ -29,15 +34,32 @@ COMMAND_CATEGORIES = {
     }
 }
 DEFAULT_TIMEOUT = 270
-MAX_OUTPUT_LENGTH = 65536
+MAX_OUTPUT_LENGTH = 65536                    # Per stream, oversized outputs keep their head and tail
+ABORT_OUTPUT_LENGTH = 4 * MAX_OUTPUT_LENGTH  # A command whose output grows beyond this is killed early
+READ_CHUNK_SIZE = 8192
 
 # ========================================================================
 # Helpers
 # ========================================================================
-def _truncate_with_status(text: str, max_len: int) -> tuple[str, bool]:
-    if len(text) > max_len:
-        return text[:max_len], True
-    return text, False
+def _kill(proc: asyncio.subprocess.Process):
+    # The command runs in its own session, so the whole process group (pipelines, children) is killed
+    if proc.returncode is None:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+async def _read_stream(stream: asyncio.StreamReader, buffer: HeadTailBuffer, on_overflow):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            buffer.feed(decoder.decode(b"", final=True))
+            return
+        buffer.feed(decoder.decode(chunk))
+        if buffer.total > ABORT_OUTPUT_LENGTH:
+            on_overflow()
+            return
 
 def _analyze_command(command: str) -> tuple[bool, str | None, int, str]:
     """
@@ -103,35 +125,51 @@ async def run_cmd(command: str):
             yield {"data": json.dumps(inner_result, ensure_ascii=False, indent=2), "instruction": ""}
             return
 
-        # Run command inside bash
-        proc = subprocess.run(
+        # Run command inside bash, streaming its output without blocking the event loop
+        proc = await asyncio.create_subprocess_shell(
             final_command,
-            shell=True,
             executable="/bin/bash",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
             cwd="workspace",
-            timeout=timeout_value
+            start_new_session=True
         )
-
-        stdout, stdout_truncated = _truncate_with_status(proc.stdout.strip(), MAX_OUTPUT_LENGTH)
-        stderr, stderr_truncated = _truncate_with_status(proc.stderr.strip(), MAX_OUTPUT_LENGTH)
+        stdout_buffer, stderr_buffer = HeadTailBuffer(MAX_OUTPUT_LENGTH), HeadTailBuffer(MAX_OUTPUT_LENGTH)
+        aborted = False
+
+        def _abort():
+            nonlocal aborted
+            aborted = True
+            _kill(proc)
+
+        try:
+            await asyncio.wait_for(asyncio.gather(
+                _read_stream(proc.stdout, stdout_buffer, _abort),
+                _read_stream(proc.stderr, stderr_buffer, _abort)
+            ), timeout_value)
+            await proc.wait()
+        finally:
+            # Timeout, or the caller stopped consuming the tool output
+            _kill(proc)
+
+        if aborted:
+            abort_msg = f"⚠️ The output exceeded {ABORT_OUTPUT_LENGTH} characters, the command was terminated early."
+            warning_msg = (warning_msg + "\n" + abort_msg) if warning_msg else abort_msg
 
         inner_result = {
             "execution_status": STATUS_EXECUTED,
             "command_result": {
                 "executed_command": final_command,
                 "returncode": proc.returncode,
-                "stdout_truncated": stdout_truncated,
-                "stderr_truncated": stderr_truncated,
+                "stdout_truncated": stdout_buffer.omitted > 0 or aborted,
+                "stderr_truncated": stderr_buffer.omitted > 0 or aborted,
                 "warning": warning_msg
             },
-            "stdout": stdout,
-            "stderr": stderr
+            "stdout": stdout_buffer.render(aborted and stdout_buffer.total > ABORT_OUTPUT_LENGTH).strip(),
+            "stderr": stderr_buffer.render(aborted and stderr_buffer.total > ABORT_OUTPUT_LENGTH).strip()
         }
 
-    except subprocess.TimeoutExpired:
+    except asyncio.TimeoutError:
         inner_result = {
             "execution_status": STATUS_FAILURE_TIMEOUT,
             "stderr": f"⏰ Command execution timed out (>{timeout_value} seconds). Process was terminated."
@@ -0,0 +1,158 @@
+
+import json
+import time
+import contextvars
+from pathlib import Path
+from typing import Iterable, Iterator, List, Union
+from collections.abc import Sequence
+
+# Time spent copying the message references of shared trajectories (copy-on-write), for the run statistics
+COPY_STATS = {"copies": 0, "copy_time": 0.0}
+# The same counters for the task of the current context only, see `track_copy_stats`
+_TASK_COPY_STATS: contextvars.ContextVar = contextvars.ContextVar("muse_trajectory_copy_stats", default=None)
+
+
+def track_copy_stats() -> dict:
+    """Start fresh copy counters for the task of the current context (concurrent slots each have their own)."""
+    stats = {"copies": 0, "copy_time": 0.0}
+    _TASK_COPY_STATS.set(stats)
+    return stats
+
+
+class _Store:
+    __slots__ = ("items", "shared")
+
+    def __init__(self, items: list):
+        self.items = items
+        self.shared = False
+
+
+class Trajectory(Sequence):
+    """
+    Append-only trajectory of immutable step records (the message dicts are never modified in place).
+    Forks and slices are O(1) views sharing the same records. Appending to the end of the shared store stays
+    O(1), while a view that has diverged (or replaces a record) first copies the references of its own range.
+    """
+    __slots__ = ("_store", "_start", "_stop")
+
+    def __init__(self, messages: Iterable[dict] = None):
+        self._store = _Store(list(messages) if messages is not None else [])
+        self._start = 0
+        self._stop = len(self._store.items)
+
+    @classmethod
+    def _view(cls, store: _Store, start: int, stop: int) -> "Trajectory":
+        view = cls.__new__(cls)
+        store.shared = True
+        view._store, view._start, view._stop = store, start, stop
+        return view
+
+    def fork(self) -> "Trajectory":
+        return self._view(self._store, self._start, self._stop)
+
+    def _own(self):
+        """Copy-on-write: give this view a private copy of the references of its range."""
+        st_time = time.perf_counter()
+        self._store = _Store(self._store.items[self._start:self._stop])
+        self._start, self._stop = 0, len(self._store.items)
+        duration = time.perf_counter() - st_time
+        for stats in (COPY_STATS, _TASK_COPY_STATS.get()):
+            if stats is not None:
+                stats["copies"] += 1
+                stats["copy_time"] += duration
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return Trajectory(self._store.items[self._start:self._stop][index])
+            return self._view(self._store, self._start + start, self._start + max(start, stop))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("trajectory index out of range")
+        return self._store.items[self._start + index]
+
+    def __iter__(self) -> Iterator[dict]:
+        items = self._store.items
+        for i in range(self._start, self._stop):
+            yield items[i]
+
+    def __setitem__(self, index: int, message: dict):
+        """Replace a record by a new one, the replaced record itself is left untouched."""
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("trajectory index out of range")
+        if self._store.shared:
+            self._own()
+        self._store.items[self._start + index] = message
+
+    def append(self, message: dict):
+        if self._stop != len(self._store.items):
+            self._own()
+        self._store.items.append(message)
+        self._stop += 1
+
+    def extend(self, messages: Iterable[dict]):
+        for message in messages:
+            self.append(message)
+
+    def __add__(self, other) -> list:
+        return list(self) + list(other)
+
+    def __radd__(self, other) -> list:
+        return list(other) + list(self)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (Trajectory, list)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __copy__(self) -> "Trajectory":
+        return self.fork()
+
+    def __deepcopy__(self, memo) -> "Trajectory":
+        # The records are immutable, so a deep copy can share them
+        return self.fork()
+
+    def __repr__(self) -> str:
+        return f"Trajectory({list(self)!r})"
+
+    def to_list(self) -> List[dict]:
+        return list(self)
+
+
+def json_default(obj):
+    """`default` hook of `json.dump` for objects holding trajectories."""
+    if isinstance(obj, Trajectory):
+        return obj.to_list()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+class TrajectorySnapshotWriter:
+    """
+    Incrementally snapshots trajectories into a JSONL file: each call only appends the records added since the
+    last call for the same trajectory key. A trajectory whose already written records were replaced is re-written.
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._written: dict = {}  # key -> (number of written records, last written record)
+
+    def write(self, key: str, trajectory: Sequence):
+        offset, last = self._written.get(key, (0, None))
+        if offset > len(trajectory) or (offset and trajectory[offset - 1] is not last):
+            offset = 0
+        if offset == len(trajectory):
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            if offset == 0 and key in self._written:
+                f.write(json.dumps({"key": key, "reset": True}, ensure_ascii=False) + "\n")
+            for i in range(offset, len(trajectory)):
+                f.write(json.dumps({"key": key, "step": i, "message": trajectory[i]}, ensure_ascii=False) + "\n")
+        self._written[key] = (len(trajectory), trajectory[len(trajectory) - 1])
@@ -1,7 +1,11 @@
 
+import os
 import re
+import sys
+import asyncio
 import logging
 import dirtyjson
+from collections import OrderedDict
 from typing import Dict, Any, List, Tuple, Optional
 
 
@@ -67,6 +71,61 @@ def dict_to_outline_str(d: dict, indent: int = 2) -> str:
             lines.append(f"{k}: {v}")
     return "\n".join(lines)
 
+def get_peak_rss_mb() -> float:
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 2)
+
+def get_rss_mb() -> float:
+    """Current resident set size of the process (from /proc on Linux, the peak so far elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 2)
+    except (OSError, ValueError, AttributeError, IndexError):
+        return get_peak_rss_mb()
+
+class RssHighWaterMark:
+    """
+    Highest RSS of the process sampled between `start` and `stop`, e.g. during one episode.
+    Unlike `get_peak_rss_mb`, it does not carry the peak of earlier episodes of a long-lived process.
+    """
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.peak = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self) -> float:
+        self.peak = max(self.peak, get_rss_mb())
+        return self.peak
+
+    async def _sample_loop(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.peak = get_rss_mb()
+        self._task = asyncio.create_task(self._sample_loop())
+
+    def stop(self) -> float:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        return self.sample()
+
+_TOKEN_ESTIMATE_RE = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap local token count estimate (words and punctuation marks), close enough to BPE counts for budgeting.
+    """
+    return len(_TOKEN_ESTIMATE_RE.findall(text))
+
 def deep_update(d: dict, u: dict):
     for k, v in u.items():
         if isinstance(v, dict) and k in d and isinstance(d[k], dict):
@@ -80,26 +139,123 @@ def create_message(role: str, text: str) -> dict:
         raise ValueError(f"role must be one of {allowed_roles}，but received '{role}'")
     return {"role": role, "content": [{"type": "text", "text": text}]}
 
+def replace_message_text(message: dict, text: str) -> dict:
+    """
+    Returns a new message with the text of the first content part replaced, the given message is not modified.
+    """
+    content = message["content"]
+    return {**message, "content": [{**content[0], "text": text}, *content[1:]]}
+
+# Section name -> (tag, placeholder) of the history sections that can be trimmed
+HISTORY_SECTIONS = {
+    "python": ("code", "[SYSTEM INFO: History python code removed for brevity]"),
+    "axtree": ("webpage accessibility tree", "[SYSTEM INFO: History accessibility tree removed for brevity]"),
+    "state": ("webpage interactive elements", "[SYSTEM INFO: History interactive elements removed for brevity]"),
+}
+TRIM_CACHE_SIZE = 4096
+
+
+class HistoryTrimmer:
+    """
+    Replaces the content of several history sections in a single scan, with one precompiled alternation pattern.
+    Results are memoized by text (an LRU keyed by the shared, hash-cached message strings), and a trimmed text maps
+    to itself, so re-trimming a trajectory only scans the messages added since the last call.
+    """
+    def __init__(self, sections: Tuple[str, ...], cache_size: int = TRIM_CACHE_SIZE):
+        self.sections = sections
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._pattern = re.compile(
+            "|".join(
+                f"(?P<{name}_o><{re.escape(HISTORY_SECTIONS[name][0])}>).*?(?P<{name}_c></{re.escape(HISTORY_SECTIONS[name][0])}>)"
+                for name in sections
+            ),
+            re.DOTALL | re.IGNORECASE
+        ) if sections else None
+
+    @staticmethod
+    def _replace(match: re.Match) -> str:
+        name = match.lastgroup[:-2]
+        return match.group(f"{name}_o") + HISTORY_SECTIONS[name][1] + match.group(match.lastgroup)
+
+    def trim(self, text: str) -> str:
+        if self._pattern is None:
+            return text
+        trimmed = self._cache.get(text)
+        if trimmed is not None:
+            self.hits += 1
+            self._cache.move_to_end(text)
+            return trimmed
+        self.misses += 1
+        trimmed = self._pattern.sub(self._replace, text)
+        self._cache[text] = trimmed
+        self._cache[trimmed] = trimmed
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return trimmed
+
+
+_TRIMMERS: Dict[Tuple[str, ...], HistoryTrimmer] = {}
+
+def get_history_trimmer(*sections: str) -> HistoryTrimmer:
+    """The shared trimmer of the given sections (in the order of `HISTORY_SECTIONS`)."""
+    key = tuple(name for name in HISTORY_SECTIONS if name in sections)
+    if key not in _TRIMMERS:
+        _TRIMMERS[key] = HistoryTrimmer(key)
+    return _TRIMMERS[key]
+
 def remove_python_code_in_the_history(text: str) -> str:
-    pattern = re.compile(
-        r"(<code>)(.*?)(</code>)",
-        re.DOTALL | re.IGNORECASE
-    )
-    return pattern.sub(r"\1[SYSTEM INFO: History python code removed for brevity]\3", text)
+    return get_history_trimmer("python").trim(text)
 
 def remove_accessibility_tree_in_the_history(text: str) -> str:
-    pattern = re.compile(
-        r"(<webpage accessibility tree>)(.*?)(</webpage accessibility tree>)",
-        re.DOTALL | re.IGNORECASE
-    )
-    return pattern.sub(r"\1[SYSTEM INFO: History accessibility tree removed for brevity]\3", text)
+    return get_history_trimmer("axtree").trim(text)
 
 def remove_browser_state_in_the_history(text: str) -> str:
-    pattern = re.compile(
-        r"(<webpage interactive elements>)(.*?)(</webpage interactive elements>)",
-        re.DOTALL | re.IGNORECASE
-    )
-    return pattern.sub(r"\1[SYSTEM INFO: History interactive elements removed for brevity]\3", text)
+    return get_history_trimmer("state").trim(text)
+
+class HeadTailBuffer:
+    """
+    Keeps the head and a rolling tail of a streamed output, so that memory and the sampled output stay within
+    `budget` characters however long the stream is.
+    """
+    def __init__(self, budget: int, head_ratio: float = 0.7):
+        self.head_size = int(budget * head_ratio)
+        self.tail_size = budget - self.head_size
+        self.head: List[str] = []
+        self.head_len = 0
+        self.tail = ""
+        self.total = 0
+
+    def feed(self, text: str):
+        self.total += len(text)
+        if self.head_len < self.head_size:
+            take = text[:self.head_size - self.head_len]
+            self.head.append(take)
+            self.head_len += len(take)
+            text = text[len(take):]
+        if text and self.tail_size > 0:
+            self.tail = (self.tail + text)[-self.tail_size:]
+
+    @property
+    def omitted(self) -> int:
+        return self.total - self.head_len - len(self.tail)
+
+    def render(self, aborted: bool = False) -> str:
+        head = "".join(self.head)
+        if not self.omitted and not aborted:
+            return head + self.tail
+        note = f"{self.omitted} characters omitted" + (", the output was cut off early" if aborted else "")
+        return f"{head}\n[SYSTEM INFO: ... {note} ...]\n{self.tail}"
+
+def sample_head_tail(text: str, budget: int) -> str:
+    """The head and tail of an oversized text within `budget` characters, or the text itself."""
+    if len(text) <= budget:
+        return text
+    buffer = HeadTailBuffer(budget)
+    buffer.feed(text)
+    return buffer.render()
 
 def extract_json_codeblock(md_text: str, debug: bool = False) -> Tuple[Dict[str, Any], Optional[str]]:
     match = re.search(r"```json[^\n]*\r?\n(.*?)\r?\n?```", md_text, re.DOTALL | re.IGNORECASE)
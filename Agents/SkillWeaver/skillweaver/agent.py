@@ -1,10 +1,10 @@
 import ast
+import asyncio
 import datetime
-import importlib
 import io
 import json
 import os
-import sys
+import re
 import traceback
 from typing import Any, TypedDict
 
@@ -286,6 +286,7 @@ async def codegen_generate(
                 python_code=J.string(),
                 terminate_with_result=J.string(),
             ),
+            key="codegen",
         )
         response["prompt"] = prompt[1]["content"][0]["text"]
 
@@ -329,10 +330,6 @@ class CodeExecutionOutcome(TypedDict):
     recovery_results: list[RecoveryResult] | None  # None if recovery is not enabled
 
 
-# This variable is so that we can communicate information between the codegen_do function and the code that it runs.
-vars = {}
-
-
 async def codegen_do(
     browser: Browser,
     knowledge_base: KnowledgeBase,
@@ -354,38 +351,29 @@ async def codegen_do(
     def print_wrapper(*args, **kwargs):
         print(*args, **kwargs, file=stdout_capture)
 
+    # The knowledge base is compiled once per version (see `FunctionIndex.compiled`); each step only
+    # compiles its `act` function, from the file written here so that tracebacks can show its lines.
     with open(filename, "w") as f:
-        key = os.path.abspath(filename)
-        vars[key] = [
-            print_wrapper,
-        ]
-        kb_code = knowledge_base.code if not as_reference_only else ""
-        module_code = f"""
-import asyncio, re
-from skillweaver.agent import vars
-
-(print,) = vars[{repr(key)}]
-
-{kb_code}
+        f.write(code)
 
-{code}""".strip()
-
-        f.write(module_code)
+    kb_filename, kb_code_object = (
+        knowledge_base.function_index.compiled()
+        if not as_reference_only
+        else (None, None)
+    )
 
     if allow_recovery:
         assert (
             recovery_lm is not None
         ), "recovery_lm must be non-None if allow_recovery is True"
 
-        # source line 6 -> kb line 1
-        source_map = {l + 5: l for l in range(kb_code.count("\n") + 1)}
         contextvar_token = EXECUTION_CONTEXT.set(filename)
         EXCEPTION_HANDLERS[filename] = create_locator_error_wrapper(
             knowledge_base,
-            source_map,
+            kb_filename,
             recovery_results,
             recovery_lm,
-            module_code,
+            filename,
             code,
             disabled_function_names,
             allow_act_function_recovery=True,
@@ -393,19 +381,21 @@ from skillweaver.agent import vars
     else:
         contextvar_token = None
 
-    # A module from this timestep may have been loaded in previous runs.
-    module_name = os.path.basename(filename)[:-3]
-    if module_name in sys.modules:
-        del sys.modules[module_name]
-
-    d = os.path.dirname(filename)
-    sys.path.append(d)
-
     warnings = []
     output = exception = traceback_ = None
     try:
-        module = importlib.__import__(module_name)
-        output = await module.act(page)
+        # A fresh namespace per step: the knowledge base functions resolve `print` to this step's capture.
+        namespace = {
+            "__name__": os.path.basename(filename)[:-3],
+            "__file__": filename,
+            "asyncio": asyncio,
+            "re": re,
+            "print": print_wrapper,
+        }
+        if kb_code_object is not None:
+            exec(kb_code_object, namespace)
+        exec(compile(code, filename, "exec"), namespace)
+        output = await namespace["act"](page)
 
         awaits = []
         output = await deep_await(output, awaits)
@@ -419,7 +409,6 @@ from skillweaver.agent import vars
         output = None
         traceback_ = traceback.format_exc()
     finally:
-        sys.path.remove(d)
         if contextvar_token:
             EXECUTION_CONTEXT.reset(contextvar_token)
             del EXCEPTION_HANDLERS[filename]
@@ -1,4 +1,9 @@
 from .browser import Browser, make_browser, make_browsers
 from .state import State
-from .a11y import capture_accessibility_tree, serialize_accessibility_tree
+from .a11y import (
+    capture_accessibility_tree,
+    capture_accessibility_tree_diff,
+    install_accessibility_script,
+    serialize_accessibility_tree,
+)
 from .patches import apply_patches
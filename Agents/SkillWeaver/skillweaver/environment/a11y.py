@@ -3,18 +3,56 @@ NOTE: Some of this code is loosely adapted from the WebArena processing code:
 - https://github.com/web-arena-x/webarena/blob/daee18de46d4b8e3c98c8cf5e5c4ef6de2f7a8eb/browser_env/processors.py.
 """
 import asyncio
+import hashlib
+import json
 import os
 import string
+import weakref
 from typing import Optional, OrderedDict, TypedDict
 from urllib.parse import parse_qsl, urlencode, urlparse
 import tiktoken
 from aioconsole import aprint
-from playwright.async_api import Frame, Locator, Page, async_playwright
+from playwright.async_api import BrowserContext, Frame, Locator, Page, async_playwright
 from typing_extensions import NotRequired
 
 with open(os.path.dirname(__file__) + "/ts/_compiled.js", "r") as f:
     content = f.read()
 
+SCRIPT_VERSION = hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+# Above this many DOM changes since the previous capture, a diff returns the whole tree.
+DIFF_MAX_DOM_CHANGES = 50
+
+# Parsed at most once per document: the script is registered as an init script of the context, and
+# only documents loaded before that are injected on their first capture. It also keeps a DOM version
+# counter, bumped by mutations and by the events that change the tree without one (scrolling moves
+# the bounding boxes, typing changes input values).
+_script = f"""(() => {{
+if (window.__webAgentDomInterfaceVersion === "{SCRIPT_VERSION}") return;
+{content}
+window.__webAgentDomVersion = 0;
+const bump = (n) => {{ window.__webAgentDomVersion += n; }};
+new MutationObserver((records) => bump(records.length)).observe(document, {{
+    subtree: true, childList: true, attributes: true, characterData: true,
+}});
+for (const type of ["scroll", "resize", "input", "change", "focusin", "focusout"]) {{
+    window.addEventListener(type, () => bump(1), {{ capture: true, passive: true }});
+}}
+window.__webAgentDomInterfaceVersion = "{SCRIPT_VERSION}";
+}})()"""
+
+# `since` is the document and DOM version of a previous capture: while neither changed, the tree is
+# not recomputed. Returns null when the script is not injected in the document yet.
+_capture_script = f"""(since) => {{
+if (window.__webAgentDomInterfaceVersion !== "{SCRIPT_VERSION}") return null;
+const state = {{ document: performance.timeOrigin, dom_version: window.__webAgentDomVersion }};
+if (since && since.document === state.document && since.dom_version === state.dom_version) {{
+    return state;
+}}
+return {{ ...state, tree: window.__webAgentDomInterface.getAccessibilityTree() }};
+}}"""
+
+_installed_contexts: "weakref.WeakSet[BrowserContext]" = weakref.WeakSet()
+
 class BoundingBox(TypedDict):
     x: float
     y: float
@@ -39,12 +77,39 @@ class LocatorTree(TypedDict):
     locator: Locator
     children: list["LocatorTree"]
 
-async def _is_injected(page: Page | Frame):
-    return await page.evaluate("window.__webAgentDomInterface !== undefined")
-
-async def _inject(page: Page | Frame):
-    # This exposes the __webAgentDomInterface object as a property of `window`.
-    await page.evaluate(f"(() => {{ {content} }})()")
+class AXTreeSnapshot(TypedDict):
+    tree: AXTree
+    document: float  # time origin of the document, which identifies it across navigations
+    dom_version: int
+
+class AXTreeDiff(TypedDict):
+    snapshot: AXTreeSnapshot
+    # Whether `changed` is the whole tree, because there was no comparable previous capture.
+    full: bool
+    # Added or modified nodes, without their children and with `locator_parts` relative to the page.
+    changed: list[AXTree]
+    # Page-relative `locator_parts` of the nodes that disappeared.
+    removed: list[list[LocatorPart]]
+
+async def install_accessibility_script(context: BrowserContext):
+    """Registers the accessibility script for every document the context loads (once per context)."""
+    if context in _installed_contexts:
+        return
+    _installed_contexts.add(context)
+    await context.add_init_script(script=_script)
+
+async def _capture_document(
+    frame: Page | Frame, since: AXTreeSnapshot | None = None
+) -> dict:
+    result = await frame.evaluate(_capture_script, since and _document_state(since))
+    if result is None:
+        # This exposes the __webAgentDomInterface object as a property of `window`.
+        await frame.evaluate(_script)
+        result = await frame.evaluate(_capture_script, None)
+    return result
+
+def _document_state(snapshot: AXTreeSnapshot) -> dict:
+    return {"document": snapshot["document"], "dom_version": snapshot["dom_version"]}
 
 def _attach_subtree(base: AXTree, subtree: AXTree, frame_name: str, frame_url: str):
     if (
@@ -344,26 +409,108 @@ def serialize_accessibility_tree(
     return text, options
 
 
-async def capture_accessibility_tree(page: Page | Frame) -> AXTree:
-    if not await _is_injected(page):
-        await _inject(page)
-
-    top_level_tree = await page.evaluate(
-        "window.__webAgentDomInterface.getAccessibilityTree()"
-    )
-    subframes = page.frames if isinstance(page, Page) else page.child_frames
-    for frame in subframes:
+async def _capture_frames(frame: Frame, tree: AXTree):
+    async def capture(child: Frame):
         try:
-            tree = await capture_accessibility_tree(frame)
+            return await _capture_frame_tree(child)
         except Exception as e:
             if "Frame was detached" not in str(e):
                 await aprint("Could not get tree for frame:", e)
-            continue
+            return None
+
+    children = frame.child_frames
+    subtrees = await asyncio.gather(*[capture(child) for child in children])
+    for child, subtree in zip(children, subtrees):
+        if subtree is not None:
+            _attach_subtree(tree, subtree, child.name, child.url)
+
+
+async def _capture_frame_tree(frame: Frame) -> AXTree:
+    tree = (await _capture_document(frame))["tree"]
+    await _capture_frames(frame, tree)
+    return tree
+
 
-        if not _attach_subtree(top_level_tree, tree, frame.name, frame.url):
-            pass
+async def capture_accessibility_tree(page: Page | Frame) -> AXTree:
+    frame = page.main_frame if isinstance(page, Page) else page
+    await install_accessibility_script(frame.page.context)
+    # Nested frames are attached to the tree of their parent frame, all frames of a level at once.
+    return await _capture_frame_tree(frame)
+
+
+def _flatten_nodes(
+    node: AXTree, locator_parts: list[LocatorPart], nodes: dict[str, AXTree]
+):
+    locator_parts = locator_parts + node["locator_parts"]
+    key = json.dumps(locator_parts, sort_keys=True)
+    # Locators are unique among siblings, except for nodes without a role or a name.
+    duplicate = 0
+    while key + (f"#{duplicate}" if duplicate else "") in nodes:
+        duplicate += 1
+    if duplicate:
+        key += f"#{duplicate}"
+    nodes[key] = {**node, "children": [], "locator_parts": locator_parts}
+    for child in node["children"]:
+        _flatten_nodes(child, locator_parts, nodes)
+    return nodes
+
+
+def _node_changed(before: AXTree, after: AXTree) -> bool:
+    return any(
+        before[field] != after[field]  # type: ignore
+        for field in ("tag_name", "role", "name", "properties", "bounding_box")
+    )
 
-    return top_level_tree
+
+async def capture_accessibility_tree_diff(
+    page: Page,
+    previous: AXTreeSnapshot | None,
+    max_dom_changes: int = DIFF_MAX_DOM_CHANGES,
+) -> AXTreeDiff:
+    """
+    The nodes that changed since the `previous` capture of the page. While the DOM version counter
+    has not moved, the previous tree is reused without being recomputed; when it moved by more than
+    `max_dom_changes` or the page navigated, the whole tree is returned.
+    """
+    frame = page.main_frame
+    await install_accessibility_script(page.context)
+    # The counter only covers the main document, so pages with frames are always recomputed.
+    since = previous if previous is not None and not frame.child_frames else None
+    result = await _capture_document(frame, since)
+    if "tree" not in result:
+        assert previous is not None
+        return {"snapshot": previous, "full": False, "changed": [], "removed": []}
+
+    await _capture_frames(frame, result["tree"])
+    snapshot: AXTreeSnapshot = result  # type: ignore
+    nodes = _flatten_nodes(snapshot["tree"], [], {})
+    if (
+        previous is None
+        or previous["document"] != snapshot["document"]
+        or snapshot["dom_version"] - previous["dom_version"] > max_dom_changes
+    ):
+        return {
+            "snapshot": snapshot,
+            "full": True,
+            "changed": list(nodes.values()),
+            "removed": [],
+        }
+
+    previous_nodes = _flatten_nodes(previous["tree"], [], {})
+    return {
+        "snapshot": snapshot,
+        "full": False,
+        "changed": [
+            node
+            for key, node in nodes.items()
+            if key not in previous_nodes or _node_changed(previous_nodes[key], node)
+        ],
+        "removed": [
+            node["locator_parts"]
+            for key, node in previous_nodes.items()
+            if key not in nodes
+        ],
+    }
 
 
 async def example():
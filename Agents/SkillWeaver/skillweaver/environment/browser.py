@@ -1,16 +1,20 @@
 import asyncio
+import io
 import os
 import time
 import uuid
-from tempfile import TemporaryDirectory
 
 import PIL.Image
 from aioconsole import aprint
 from playwright.async_api import Browser as PlaywrightBrowser
 from playwright.async_api import BrowserContext, Page, Playwright
 
-from skillweaver.environment.a11y import capture_accessibility_tree
+from skillweaver.environment.a11y import (
+    capture_accessibility_tree,
+    install_accessibility_script,
+)
 from skillweaver.environment.state import State
+from skillweaver.util.perfmon import monitor
 
 USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/109.0.0.0 Safari/537.36"
 
@@ -19,9 +23,6 @@ def unique_id():
     return uuid.uuid4().hex
 
 
-scount = 0
-
-
 class Browser:
     def __init__(
         self,
@@ -37,7 +38,6 @@ class Browser:
         self.playwright_browser = playwright_browser
         self.context = context
         self.active_page = active_page
-        self.temp_dir = TemporaryDirectory()
         self.dialog = None
         self.cdp_sessions = {}
         self.screen_size = screen_size
@@ -58,45 +58,20 @@ class Browser:
         )
         return dom_snapshot
 
-    async def _screenshot(self, page: Page) -> tuple[PIL.Image.Image, PIL.Image.Image]:
-        global scount
+    async def _screenshot(self, page: Page) -> PIL.Image.Image:
         assert (
             self.dialog is None
         ), "Cannot take any action while a dialog is open (action: screenshot)."
 
-        # Returns the full and cropped screenshot paths
-        scount += 1
-        screenshot_path_full = os.path.join(
-            self.temp_dir.name, f"screenshot_full{scount}.png"
-        )
-        screenshot_path = os.path.join(self.temp_dir.name, f"screenshot{scount}.png")
-        await page.screenshot(full_page=True, path=screenshot_path_full, timeout=15000)
-        await page.screenshot(full_page=False, path=screenshot_path, timeout=15000)
-
-        # await page.screenshot(
-        #     full_page=True, 
-        #     path=screenshot_path_full, 
-        #     timeout=15000,
-        #     animations="disabled",  # 禁用 CSS 动画 (Drift 可能引入了旋转动画)
-        #     caret="hide"
-        # )
-        # await page.screenshot(
-        #     full_page=False, 
-        #     path=screenshot_path, 
-        #     timeout=15000,
-        #     animations="disabled",
-        #     caret="hide"
-        # )
-        
-        screenshot = PIL.Image.open(screenshot_path)
-        screenshot_full = PIL.Image.open(screenshot_path_full)
-
-        os.remove(screenshot_path_full)
-        os.remove(screenshot_path)
-
-        return (screenshot, screenshot_full)
-
-    async def _observe(self) -> State:
+        # A single viewport screenshot, decoded in memory.
+        png = await page.screenshot(full_page=False, timeout=15000)
+        screenshot = PIL.Image.open(io.BytesIO(png))
+        screenshot.load()
+        return screenshot
+
+    async def _observe(
+        self, screenshot=True, dom=True, accessibility_tree=True
+    ) -> State:
         # await self.active_page.wait_for_load_state("load")
         # ================= 修改开始 =================
         try:
@@ -109,22 +84,52 @@ class Browser:
             print("⚠️ Warning: wait_for_load_state timed out, proceeding anyway...")
             pass
         # ================= 修改结束 =================
+        page = self.active_page
+
+        async def timed(name: str, coro):
+            start_time = time.time()
+            try:
+                return await coro
+            finally:
+                monitor.log_timing_event("observe/" + name, start_time, time.time())
+
+        # The artifacts are captured concurrently; the ones a caller opts out of stay None.
+        artifacts = {"title": page.title()}
+        if screenshot:
+            artifacts["screenshot"] = self._screenshot(page)
+        if dom:
+            artifacts["dom"] = self._get_dom(page)
+        if accessibility_tree:
+            artifacts["accessibility_tree"] = capture_accessibility_tree(page)
+        start_time = time.time()
+        results = dict(
+            zip(
+                artifacts,
+                await asyncio.gather(
+                    *[timed(name, coro) for name, coro in artifacts.items()]
+                ),
+            )
+        )
+        monitor.log_timing_event("observe", start_time, time.time())
+
         return State(
             id=unique_id(),
-            url=self.active_page.url,
-            title=await self.active_page.title(),
+            url=page.url,
+            title=results["title"],
             timestamp=time.time(),
-            screenshot=(await self._screenshot(self.active_page))[0],  # BUG
-            dom=await self._get_dom(self.active_page),
+            screenshot=results.get("screenshot"),
+            dom=results.get("dom"),
             dialog=self.dialog,
-            accessibility_tree=await capture_accessibility_tree(self.active_page),
+            accessibility_tree=results.get("accessibility_tree"),
         )
 
-    async def observe(self) -> State:
+    async def observe(
+        self, screenshot=True, dom=True, accessibility_tree=True
+    ) -> State:
         exc = None
         for attempt in range(3):
             try:
-                return await self._observe()
+                return await self._observe(screenshot, dom, accessibility_tree)
             except Exception as e:
                 if (
                     "Execution context was destroyed, most likely because of a navigation"
@@ -184,6 +189,7 @@ async def make_browser(
     )
     context.set_default_timeout(timeout)
     context.set_default_navigation_timeout(navigation_timeout)
+    await install_accessibility_script(context)
     # BUG in Playwright:
     page = await context.new_page()
     await page.goto(start_url)  # state_url
@@ -230,6 +236,7 @@ async def make_browsers(
         )
         context.set_default_timeout(timeout)
         context.set_default_navigation_timeout(navigation_timeout)
+        await install_accessibility_script(context)
         page = await context.new_page()
         await aprint("made new_page")
         await page.goto(start_url)
@@ -182,10 +182,10 @@ class RecoveryResult(TypedDict):
 
 def create_locator_error_wrapper(
     knowledge_base: KnowledgeBase,
-    source_mapping: dict[int, int],
+    kb_filename: str | None,
     recovery_results: list[RecoveryResult],
     recovery_lm: LM,
-    module_code: str,
+    act_filename: str,
     code: str,
     disabled_function_names: list[str],
     allow_act_function_recovery=True,
@@ -222,13 +222,13 @@ def create_locator_error_wrapper(
         error_function_start_line = -1
         error_function_end_line = -1
         error_function_offset_line = -1
-        if lineno not in source_mapping and allow_act_function_recovery:
+        if filename == act_filename and allow_act_function_recovery:
             # occurred in `act` function.
             error_function_name = "act"
 
             # find the line where `act` is defined.
             # make sure we are inside the `act` function.
-            parsed = ast.parse(module_code)
+            parsed = ast.parse(code)
             for node in parsed.body:
                 if isinstance(node, ast.AsyncFunctionDef) and node.name == "act":
                     act_start_line = node.lineno
@@ -244,9 +244,10 @@ def create_locator_error_wrapper(
 
                     error_function_offset_line = lineno - act_start_line
                     break
-        else:
+        elif filename == kb_filename:
+            # The knowledge base is compiled from its own code, so the line numbers match its tree.
             # Highlight the line in the function where the error occurred.
-            parsed = ast.parse(knowledge_base.code)
+            parsed = knowledge_base.function_index.tree
             for node in parsed.body:
                 if isinstance(node, ast.AsyncFunctionDef):
                     start_line = node.lineno
@@ -255,14 +256,12 @@ def create_locator_error_wrapper(
                         end_line is not None
                     ), "AsyncFunctionDef must have an end_lineno"
 
-                    if start_line <= source_mapping[lineno] <= end_line:
+                    if start_line <= lineno <= end_line:
                         # We found the function where the error occurred.
                         error_function_name = node.name
                         error_function_start_line = start_line
                         error_function_end_line = end_line
-                        error_function_offset_line = (
-                            source_mapping[lineno] - error_function_start_line
-                        )
+                        error_function_offset_line = lineno - error_function_start_line
                         break
 
         if error_function_name is None:
@@ -371,7 +370,7 @@ on the page that represents the intended element, you can write `None`.
         for attempt_ in range(5):
             if len(past_attempts) > 0:
                 print(past_attempts[-1])
-                (choice, locator_code, error) = past_attempts[-1]
+                choice, locator_code, error = past_attempts[-1]
                 prompt_messages.append(
                     {
                         "role": "assistant",
@@ -396,6 +395,7 @@ Locator: {locator_code}
                     choice=J.string(),
                     locator_code=J.string(),
                 ),
+                key="locator_recovery",
             )
 
             # Backtest the intended locator.
@@ -29,10 +29,11 @@ class State:
     url: str
     title: str
     timestamp: float
-    screenshot: PIL.Image.Image
-    dom: dict
+    # None when the observation did not capture them, see `Browser.observe`.
+    screenshot: Optional[PIL.Image.Image]
+    dom: Optional[dict]
     dialog: Optional[DialogState]
-    accessibility_tree: AXTree
+    accessibility_tree: Optional[AXTree]
 
     @property
     def relative_url(self):
@@ -57,13 +58,16 @@ class State:
         return string
 
     def save(self, out_dir: str, prefix: str):
-        self.screenshot.save(f"{out_dir}/{prefix}_screenshot.png")
+        if self.screenshot is not None:
+            self.screenshot.save(f"{out_dir}/{prefix}_screenshot.png")
 
-        with open(f"{out_dir}/{prefix}_dom.json", "w") as f:
-            json.dump(self.dom, f)
+        if self.dom is not None:
+            with open(f"{out_dir}/{prefix}_dom.json", "w") as f:
+                json.dump(self.dom, f)
 
-        with open(f"{out_dir}/{prefix}_ax_v2.json", "w") as f:
-            json.dump(self.accessibility_tree, f)
+        if self.accessibility_tree is not None:
+            with open(f"{out_dir}/{prefix}_ax_v2.json", "w") as f:
+                json.dump(self.accessibility_tree, f)
 
         with open(f"{out_dir}/{prefix}_misc.json", "w") as f:
             misc_data = {
@@ -152,7 +152,7 @@ def llm_fuzzy_match(pred: str, reference: str, question: str) -> float:
         {"role": "user", "content": message},
     ]
     lm = LM("gpt-4o")
-    response: str = asyncio.run(lm(messages))  # type: ignore
+    response: str = asyncio.run(lm(messages, key="evaluation"))  # type: ignore
     response = response.lower()
     if "partially correct" in response or "incorrect" in response:
         return 0.0
@@ -182,7 +182,7 @@ def llm_ua_match(pred: str, reference: str, question: str) -> float:
     ]
 
     lm = LM("gpt-4o")
-    response: str = asyncio.run(lm(messages))  # type: ignore
+    response: str = asyncio.run(lm(messages, key="evaluation"))  # type: ignore
     response = response.lower()
     if "different" in response:
         return 0.0
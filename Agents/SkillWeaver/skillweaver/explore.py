@@ -34,6 +34,10 @@ from skillweaver.templates import generate_practice_args, propose_skill_templ
 from skillweaver.util import J
 from skillweaver.util.perfmon import monitor
 
+# The per-iteration checkpoints skip the full black pass of the knowledge base (it runs under the
+# lock shared by the workers); it runs every this many iterations instead, and at the end.
+KB_FORMAT_EVERY_N_ITERATIONS = 10
+
 
 async def _generate_test_case_arguments(lm: LM, state: State, function: Function):
     args = function["args"].copy()
@@ -70,6 +74,7 @@ async def _generate_test_case_arguments(lm: LM, state: State, function: Function
                 }
             },
         ),
+        key="test_case_arguments",
     )
 
 
@@ -125,6 +130,7 @@ async def _choose_explore_task(
             },
         ],
         json_schema=J.cot_schema("proposed_skill"),
+        key="propose_task",
     )
 
     await aprint("Task proposal:\n\n" + response["step_by_step_reasoning"])
@@ -190,7 +196,8 @@ async def _run_explore_iteration(
     iter_dir = f"{store_dir}/iter_{iteration}"
     os.makedirs(iter_dir)
 
-    state = await browser.observe()
+    # Only the accessibility tree is used to choose the task.
+    state = await browser.observe(screenshot=False, dom=False)
 
     ### CHOOSE A TASK ###
     async with knowledge_base.lock:
@@ -266,7 +273,13 @@ async def _run_explore_iteration(
                     with open(f"{iter_dir}/kb_update_diagnostics.json", "w") as f:
                         json.dump(update_diagnostics, f, indent=2)
 
-            knowledge_base.save(f"{iter_dir}/kb_post")
+            # Written under the lock, so the full formatting pass is left to the periodic checkpoints.
+            knowledge_base.save(f"{iter_dir}/kb_post", format=False)
+
+        if (iteration + 1) % KB_FORMAT_EVERY_N_ITERATIONS == 0:
+            await knowledge_base.format_code_unlocked()
+            async with knowledge_base.lock:
+                knowledge_base.save(f"{iter_dir}/kb_post", format=False)
 
         # Store the performance monitoring.
         with open(iter_dir + "/perfmon.json", "w") as f:
@@ -386,6 +399,11 @@ async def explore(
             await asyncio.gather(
                 *[_find_worker_and_run_iteration() for _ in range(iterations)]
             )
+            # The final knowledge base, fully formatted, in the checkpoint of the last iteration.
+            if iterations > 0:
+                await knowledge_base.format_code_unlocked()
+                async with knowledge_base.lock:
+                    knowledge_base.save(f"{store_dir}/iter_{iterations - 1}/kb_post")
 
         finally:
             # Close all browsers.
@@ -21,4 +21,5 @@ async def check_success_simple(
             }
         ],
         json_schema=J.struct(step_by_step_reasoning=J.string(), success=J.boolean()),
+        key="check_success",
     )
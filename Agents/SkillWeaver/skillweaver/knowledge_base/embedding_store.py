@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Protocol
+
+import numpy as np
+import openai
+
+from skillweaver.util.perfmon import monitor
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+# "openai" (default), "openai:<model>", "sentence-transformers:<model>" or "hashing" (offline, no model needed).
+EMBEDDING_BACKEND_ENV = "SKILLWEAVER_EMBEDDING_BACKEND"
+# Path of the SQLite store; "" keeps the embeddings in memory only.
+EMBEDDING_CACHE_ENV = "SKILLWEAVER_EMBEDDING_CACHE"
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "skillweaver" / "embeddings.sqlite"
+# The OpenAI embeddings endpoint accepts up to 2048 inputs per request.
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_MEMORY_ENTRIES = 4096
+# SQLite limits the number of host parameters of a single statement.
+_SQL_CHUNK_SIZE = 500
+
+
+class EmbeddingBackend(Protocol):
+    # Part of the cache key: embeddings of different models never mix.
+    model: str
+
+    async def embed_batch(self, texts: list[str]) -> list[np.ndarray]: ...
+
+
+class OpenAIEmbeddingBackend:
+    def __init__(self, model: str = DEFAULT_EMBEDDING_MODEL):
+        self.model = model
+        self._client: openai.AsyncOpenAI | None = None
+
+    async def embed_batch(self, texts: list[str]) -> list[np.ndarray]:
+        if self._client is None:
+            self._client = openai.AsyncOpenAI()
+        start_time = time.time()
+        result = await self._client.embeddings.create(input=texts, model=self.model)
+        monitor.log_timing_event("embed/" + self.model, start_time, time.time())
+        if result.usage is not None:
+            monitor.log_token_usage(
+                "embed", "openai:" + self.model, result.usage.prompt_tokens, 0
+            )
+        data = sorted(result.data, key=lambda d: d.index)
+        return [np.array(d.embedding, dtype=np.float32) for d in data]
+
+
+class SentenceTransformerBackend:
+    """Runs a sentence-transformers model locally, for offline runs."""
+
+    def __init__(self, model: str = "all-MiniLM-L6-v2"):
+        self.model = "sentence-transformers:" + model
+        self._model_name = model
+        self._encoder = None
+
+    async def embed_batch(self, texts: list[str]) -> list[np.ndarray]:
+        if self._encoder is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise ImportError(
+                    "The sentence-transformers embedding backend requires `pip install sentence-transformers`."
+                ) from e
+            self._encoder = SentenceTransformer(self._model_name)
+        vectors = await asyncio.to_thread(
+            self._encoder.encode, texts, normalize_embeddings=True
+        )
+        return [np.asarray(v, dtype=np.float32) for v in vectors]
+
+
+class HashingEmbeddingBackend:
+    """
+    Normalized bag of hashed word unigrams and bigrams. Needs neither a network nor a model,
+    so it suits offline runs and tests; the rankings are lexical rather than semantic.
+    """
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.model = f"hashing-{dim}"
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = re.findall(r"[a-z0-9]+", text.lower())
+        for feature in words + [a + " " + b for a, b in zip(words, words[1:])]:
+            digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+            h = int.from_bytes(digest, "little")
+            vector[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    async def embed_batch(self, texts: list[str]) -> list[np.ndarray]:
+        return [self._embed(text) for text in texts]
+
+
+def backend_from_spec(spec: str) -> EmbeddingBackend:
+    name, _, arg = spec.partition(":")
+    if name == "openai":
+        return OpenAIEmbeddingBackend(arg or DEFAULT_EMBEDDING_MODEL)
+    if name == "sentence-transformers":
+        return SentenceTransformerBackend(*([arg] if arg else []))
+    if name == "hashing":
+        return HashingEmbeddingBackend(*([int(arg)] if arg else []))
+    raise ValueError(f"Unknown embedding backend: {spec!r}")
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """
+    Embeddings keyed by model + text hash: an LRU-bounded in-memory layer over a SQLite file shared
+    across processes. Missing texts are embedded in batches of `batch_size`, and texts that are
+    already being embedded by a concurrent call are awaited rather than requested twice.
+    """
+
+    def __init__(
+        self,
+        backend: EmbeddingBackend,
+        path: str | Path | None = DEFAULT_CACHE_PATH,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_memory_entries: int = DEFAULT_MEMORY_ENTRIES,
+    ):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_memory_entries = max_memory_entries
+        self.requests = 0
+        self._memory: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._pending: dict[str, asyncio.Future] = {}
+        self._db_lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        if path:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash))"
+            )
+            self._db.commit()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _load(self, keys: list[str]) -> dict[str, np.ndarray]:
+        if self._db is None or not keys:
+            return {}
+        found = {}
+        with self._db_lock:
+            for i in range(0, len(keys), _SQL_CHUNK_SIZE):
+                chunk = keys[i : i + _SQL_CHUNK_SIZE]
+                rows = self._db.execute(
+                    "SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ("
+                    + ",".join("?" * len(chunk))
+                    + ")",
+                    [self.backend.model, *chunk],
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def _save(self, vectors: dict[str, np.ndarray]):
+        if self._db is None or not vectors:
+            return
+        with self._db_lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [
+                    (self.backend.model, key, np.asarray(v, dtype=np.float32).tobytes())
+                    for key, v in vectors.items()
+                ],
+            )
+            self._db.commit()
+
+    async def _embed_batch(self, batch: dict[str, str]) -> dict[str, np.ndarray]:
+        keys = list(batch)
+        try:
+            self.requests += 1
+            vectors = await self.backend.embed_batch([batch[key] for key in keys])
+            if len(vectors) != len(keys):
+                raise RuntimeError(
+                    f"Embedding backend {self.backend.model} returned {len(vectors)} vectors for {len(keys)} texts."
+                )
+            results = dict(zip(keys, vectors))
+            self._save(results)
+        except BaseException as e:
+            for key in keys:
+                future = self._pending.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+                    # Retrieved here, so that unawaited failures are not reported as never retrieved.
+                    future.exception()
+            raise
+        for key, vector in results.items():
+            self._remember(key, vector)
+            self._pending.pop(key).set_result(vector)
+        return results
+
+    async def embed_many(self, texts: list[str]) -> list[np.ndarray]:
+        keys = [_text_hash(text) for text in texts]
+        resolved: dict[str, np.ndarray] = {}
+        missing: dict[str, str] = {}
+        waiting: dict[str, asyncio.Future] = {}
+        for key, text in zip(keys, texts):
+            if key in resolved or key in missing or key in waiting:
+                continue
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                resolved[key] = self._memory[key]
+            elif key in self._pending:
+                waiting[key] = self._pending[key]
+            else:
+                missing[key] = text
+
+        for key, vector in self._load(list(missing)).items():
+            self._remember(key, vector)
+            resolved[key] = vector
+            del missing[key]
+
+        if missing:
+            loop = asyncio.get_running_loop()
+            for key in missing:
+                self._pending[key] = loop.create_future()
+            items = list(missing.items())
+            for results in await asyncio.gather(
+                *[
+                    self._embed_batch(dict(items[i : i + self.batch_size]))
+                    for i in range(0, len(items), self.batch_size)
+                ]
+            ):
+                resolved.update(results)
+        for key, future in waiting.items():
+            resolved[key] = await future
+        return [resolved[key] for key in keys]
+
+    async def embed(self, text: str) -> np.ndarray:
+        return (await self.embed_many([text]))[0]
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+
+_default_store: EmbeddingStore | None = None
+
+
+def get_embedding_store() -> EmbeddingStore:
+    global _default_store
+    if _default_store is None:
+        backend = backend_from_spec(os.getenv(EMBEDDING_BACKEND_ENV, "openai"))
+        path = os.getenv(EMBEDDING_CACHE_ENV, str(DEFAULT_CACHE_PATH))
+        _default_store = EmbeddingStore(backend, path or None)
+    return _default_store
+
+
+def set_embedding_store(store: EmbeddingStore):
+    global _default_store
+    _default_store = store
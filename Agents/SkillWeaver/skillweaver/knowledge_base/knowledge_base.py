@@ -1,20 +1,25 @@
 import ast
 import asyncio
+import hashlib
 import json
+import linecache
 import re
+import weakref
+from types import CodeType
 from typing import Literal
 
 import astor
 import black
 import numpy as np
-import openai
 from aioconsole import aprint
 from openai.types.chat import ChatCompletionToolParam
 from openai.types.responses import FunctionToolParam
 from typing_extensions import OrderedDict, TypedDict
 
 from skillweaver.knowledge_base.code_verification import check_code
+from skillweaver.knowledge_base.embedding_store import get_embedding_store
 from skillweaver.knowledge_base.generate_schema import generate_schema
+from skillweaver.knowledge_base.vector_index import ExactIndex, build_vector_index
 from skillweaver.lm import LM
 from skillweaver.templates import (
     kb_procedural_update_single_templ,
@@ -97,6 +102,12 @@ def _get_unindented_docstring(fn: Function):
     return docstring_unindented
 
 
+def _get_function_embedding_text(fn: Function):
+    return (
+        "A Python function with the name " + fn["name"] + "\n\n" + fn["docstring"]
+    ).strip()
+
+
 def format_function_as_pretty_string(fn: Function):
     return f"# Skill: {_get_function_signature_string(fn)}\n{_get_unindented_docstring(fn)}\n\n"
 
@@ -108,18 +119,8 @@ def truncate_string_if_too_long(s: str, max_length=1000):
     return s
 
 
-_embed_cache = {}
-
-
 async def embed(string: str):
-    if string in _embed_cache:
-        return _embed_cache[string]
-
-    oai = openai.AsyncOpenAI()
-    result = await oai.embeddings.create(input=string, model="text-embedding-3-small")
-    embed = np.array(result.data[0].embedding)
-    _embed_cache[string] = embed
-    return embed
+    return await get_embedding_store().embed(string)
 
 
 def get_openai_responses_tool_param(function: Function) -> FunctionToolParam:
@@ -146,6 +147,118 @@ def get_openai_chat_tool_param(function: Function) -> ChatCompletionToolParam:
     }
 
 
+class FunctionIndex:
+    """
+    Parsed view of one version of the knowledge base code. The OpenAI tool schemas and the rendered
+    strings of each function are computed on first use and kept for the lifetime of the index.
+    """
+
+    def __init__(self, code: str):
+        self.code = code
+        self.tree = ast.parse(code)
+        lines = code.split("\n")
+        self.function_list: list[Function] = []
+        self.functions: dict[str, Function] = {}
+        self.nodes: dict[str, ast.FunctionDef | ast.AsyncFunctionDef] = {}
+        self.spans: dict[str, tuple[int, int]] = {}
+        self.hashes: dict[str, str] = {}
+        self.signatures: dict[str, str] = {}
+        for node in self.tree.body:
+            if not isinstance(node, (ast.AsyncFunctionDef, ast.FunctionDef)):
+                continue
+            assert node.end_lineno is not None
+            source = "\n".join(lines[node.lineno - 1 : node.end_lineno])
+            function: Function = {
+                "name": node.name,
+                "args": generate_schema(node),
+                "docstring": ast.get_docstring(node) or "",
+                "source": source,
+                "is_synchronous": isinstance(node, ast.FunctionDef),
+            }
+            self.function_list.append(function)
+            self.functions[node.name] = function
+            self.nodes[node.name] = node
+            # 1-based, inclusive, decorators included.
+            self.spans[node.name] = (
+                min([node.lineno] + [d.lineno for d in node.decorator_list]),
+                node.end_lineno,
+            )
+            self.hashes[node.name] = hashlib.sha1(source.encode()).hexdigest()
+            self.signatures[node.name] = _get_function_signature_string(function)
+
+        self._chat_tool_params: dict[str, ChatCompletionToolParam] = {}
+        self._responses_tool_params: dict[str, FunctionToolParam] = {}
+        self._pretty_strings: dict[str, str] = {}
+        self._joined_strings: dict[tuple, str] = {}
+        self._vector_indexes: dict[str, ExactIndex] = {}
+        self._compiled: tuple[str, CodeType] | None = None
+
+    def chat_tool_param(self, name: str) -> ChatCompletionToolParam:
+        if name not in self._chat_tool_params:
+            self._chat_tool_params[name] = get_openai_chat_tool_param(
+                self.functions[name]
+            )
+        return self._chat_tool_params[name]
+
+    def responses_tool_param(self, name: str) -> FunctionToolParam:
+        if name not in self._responses_tool_params:
+            self._responses_tool_params[name] = get_openai_responses_tool_param(
+                self.functions[name]
+            )
+        return self._responses_tool_params[name]
+
+    def pretty_string(self, name: str) -> str:
+        if name not in self._pretty_strings:
+            self._pretty_strings[name] = format_function_as_pretty_string(
+                self.functions[name]
+            )
+        return self._pretty_strings[name]
+
+    def functions_string(
+        self, fns: list[Function], format: Literal["code", "pretty"]
+    ) -> str:
+        key = (format, *(f["name"] for f in fns))
+        if key not in self._joined_strings:
+            self._joined_strings[key] = "\n\n".join(
+                [
+                    f["source"] if format == "code" else self.pretty_string(f["name"])
+                    for f in fns
+                ]
+            )
+        return self._joined_strings[key]
+
+    def compiled(self) -> tuple[str, CodeType]:
+        """
+        The code compiled once, with the pseudo filename it was compiled under. The source is
+        registered with linecache under that filename for as long as the index lives, so
+        tracebacks through knowledge base functions show their lines.
+        """
+        if self._compiled is None:
+            # Unique per index: the entry is dropped when this index is collected.
+            digest = hashlib.sha1(self.code.encode()).hexdigest()[:12]
+            filename = f"<knowledge_base {digest} {id(self):x}>"
+            linecache.cache[filename] = (
+                len(self.code),
+                None,
+                self.code.splitlines(keepends=True),
+                filename,
+            )
+            weakref.finalize(self, linecache.cache.pop, filename, None)
+            self._compiled = (filename, compile(self.code, filename, "exec"))
+        return self._compiled
+
+    async def vector_index(self) -> ExactIndex:
+        # Keyed by embedding model, in case the default embedding store is swapped.
+        store = get_embedding_store()
+        model = store.backend.model
+        if model not in self._vector_indexes:
+            embeddings = await store.embed_many(
+                [_get_function_embedding_text(f) for f in self.function_list]
+            )
+            self._vector_indexes[model] = build_vector_index(np.array(embeddings))
+        return self._vector_indexes[model]
+
+
 class KnowledgeBase:
     def __init__(
         self,
@@ -158,6 +271,8 @@ class KnowledgeBase:
         self.semantic_knowledge = semantic_knowledge
         self.lock = asyncio.Lock()
         self.hide_unverified = False
+        # Set by `_apply`, which only formats the functions it changed; see `format_code`.
+        self.full_format_pending = False
 
     def mark_all_as_tested(self):
         for f in self.metadata["functions"]:
@@ -176,24 +291,44 @@ class KnowledgeBase:
             semantic_knowledge=self.semantic_knowledge,
         )
         kb.hide_unverified = self.hide_unverified
+        kb.full_format_pending = self.full_format_pending
+        kb._index = self._index
         return kb
 
-    def _apply(self, code_update: str, reference: str):
-        existing_tree = ast.parse(self.code)
+    @property
+    def code(self) -> str:
+        return self._code
+
+    @code.setter
+    def code(self, code: str):
+        self._code = code
+        self._index: FunctionIndex | None = None
+
+    @property
+    def function_index(self) -> FunctionIndex:
+        """Rebuilt only when the code changed."""
+        if self._index is None:
+            self._index = FunctionIndex(self._code)
+        return self._index
+
+    def _apply(self, code_update: str, reference: str, full_format: bool = False):
+        """
+        Merge the functions of `code_update` into the code. Only the source ranges of the replaced
+        functions change, new functions are appended, and only those functions are formatted.
+        A full formatting pass is left to `format_code` (run by `save`), unless `full_format`.
+        """
         new_tree = ast.parse(code_update)
-        is_function_def = lambda node: isinstance(node, ast.FunctionDef) or isinstance(
-            node, ast.AsyncFunctionDef
-        )
-        existing_functions: dict[str, ast.FunctionDef | ast.AsyncFunctionDef] = {
-            node.name: node for node in existing_tree.body if is_function_def(node)  # type: ignore
-        }
-        updated_functions = existing_functions.copy()
+        update_lines = code_update.split("\n")
+        updated_sources: dict[str, str] = {}
 
         for node in new_tree.body:
-            if is_function_def(node):
-                assert isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
                 # Update the source.
-                updated_functions[node.name] = node
+                start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+                updated_sources[node.name] = black.format_str(
+                    "\n".join(update_lines[start - 1 : node.end_lineno]),
+                    mode=black.FileMode(),
+                ).strip("\n")
                 if node.name not in self.metadata["functions"]:
                     # Update the version number and success counts.
                     self.metadata["functions"][node.name] = {
@@ -212,11 +347,55 @@ class KnowledgeBase:
                         {"type": "update", "reference": reference}
                     )
 
-        merged_tree = ast.Module(body=list(updated_functions.values()), type_ignores=[])
-        merged_code = astor.to_source(merged_tree)
-        merged_code = black.format_str(merged_code, mode=black.FileMode())
-
+        if not updated_sources:
+            return
+
+        spans = self.function_index.spans
+        lines = self.code.rstrip("\n").split("\n") if self.code.strip() else []
+        # Replace from the bottom up, so that the spans above stay valid.
+        for name in sorted(
+            (name for name in updated_sources if name in spans),
+            key=lambda name: spans[name][0],
+            reverse=True,
+        ):
+            start, end = spans[name]
+            lines[start - 1 : end] = updated_sources[name].split("\n")
+        for name, source in updated_sources.items():
+            if name not in spans:
+                lines.extend(["", ""] if lines else [])
+                lines.extend(source.split("\n"))
+
+        merged_code = "\n".join(lines) + "\n"
+        if full_format:
+            merged_code = black.format_str(merged_code, mode=black.FileMode())
         self.code = merged_code
+        self.full_format_pending = not full_format
+
+    def format_code(self):
+        """The deferred full formatting pass of the code, e.g. at checkpoints."""
+        if self.full_format_pending:
+            formatted = black.format_str(self.code, mode=black.FileMode())
+            if formatted != self.code:
+                self.code = formatted
+            self.full_format_pending = False
+
+    async def format_code_unlocked(self):
+        """
+        `format_code` for a knowledge base shared by concurrent workers: black runs in a thread without
+        holding `self.lock`, and its result is only applied if the code did not change meanwhile.
+        """
+        async with self.lock:
+            if not self.full_format_pending:
+                return
+            code = self.code
+        formatted = await asyncio.to_thread(
+            black.format_str, code, mode=black.FileMode()
+        )
+        async with self.lock:
+            if self.code == code:
+                if formatted != code:
+                    self.code = formatted
+                self.full_format_pending = False
 
     def increment_test_count(self, function_name: str, reference: str):
         self.metadata["global_version"] += 1
@@ -233,27 +412,16 @@ class KnowledgeBase:
         if len(fns) < 5:
             return fns
 
-        function_embeddings = np.array(
-            await asyncio.gather(
-                *[
-                    embed(
-                        (
-                            "A Python function with the name "
-                            + f["name"]
-                            + "\n\n"
-                            + f["docstring"]
-                        ).strip()
-                    )
-                    for f in fns
-                ]
-            )
-        )
+        # The index covers all the functions: search deep enough that the hidden ones cannot crowd out
+        # the 5 best visible ones.
+        function_list = self.function_index.function_list
+        visible = {id(f) for f in fns}
+        index = await self.function_index.vector_index()
         task_embedding = await embed(task_string)
-        scores = np.dot(function_embeddings, task_embedding)
-        # choose top 5 scores
-        top5 = np.argsort(scores)[-5:]
-        best_matches = [fns[i] for i in top5]
-        return best_matches
+        hits = index.search(task_embedding, 5 + len(function_list) - len(fns))
+        matches = [function_list[i] for i in hits if id(function_list[i]) in visible]
+        # choose top 5 scores, in increasing order of similarity
+        return matches[:5][::-1]
 
     def rate_practice_utility(self, fn: Function):
         return (
@@ -367,7 +535,10 @@ class KnowledgeBase:
             "semantics": semantic_update_diagnostics,
         }
 
-    def save(self, prefix_path: str):
+    def save(self, prefix_path: str, format: bool = True):
+        # `format=False` writes a checkpoint without the full formatting pass, see `format_code`.
+        if format:
+            self.format_code()
         with open(prefix_path + "_code.py", "w") as f:
             f.write(self.code)
 
@@ -383,38 +554,22 @@ class KnowledgeBase:
         )
 
     def get_functions(self, force_return_all=False) -> list[Function]:
-        tree = ast.parse(self.code)
-        functions = [
-            f
-            for f in tree.body
-            if isinstance(f, (ast.AsyncFunctionDef, ast.FunctionDef))
-            and (force_return_all or not self.hide_unverified or self.is_tested(f.name))
-        ]
-        lines = self.code.split("\n")
-        return [
-            {
-                "name": f.name,
-                "args": generate_schema(f),
-                "docstring": ast.get_docstring(f) or "",
-                "source": "\n".join(lines[f.lineno - 1 : f.end_lineno]),
-                "is_synchronous": isinstance(f, ast.FunctionDef),
-            }
-            for f in functions
-        ]
+        # The returned functions are shared by all the callers until the code changes, do not modify them.
+        functions = self.function_index.function_list
+        if force_return_all or not self.hide_unverified:
+            return list(functions)
+        return [f for f in functions if self.is_tested(f["name"])]
 
     def get_untested_functions(self) -> list[Function]:
         return [f for f in self.get_functions() if not self.is_tested(f["name"])]
 
     def get_tools_for_openai(self) -> list[ChatCompletionToolParam]:
-        return [
-            get_openai_chat_tool_param(function) for function in self.get_functions()
-        ]
+        index = self.function_index
+        return [index.chat_tool_param(f["name"]) for f in self.get_functions()]
 
     def get_tools_for_openai_responses(self) -> list[FunctionToolParam]:
-        return [
-            get_openai_responses_tool_param(function)
-            for function in self.get_functions()
-        ]
+        index = self.function_index
+        return [index.responses_tool_param(f["name"]) for f in self.get_functions()]
 
     def get_functions_string(
         self,
@@ -428,12 +583,7 @@ class KnowledgeBase:
             if f["name"] in extra_functions
             or (not only_verified or self.is_tested(f["name"]))
         ]
-        return fns, "\n\n".join(
-            [
-                f["source"] if format == "code" else format_function_as_pretty_string(f)
-                for f in fns
-            ]
-        )
+        return fns, self.function_index.functions_string(fns, format)
 
     async def retrieve(self, task: str, lm: LM) -> tuple[list[Function], str, str]:
         skills = self.get_functions()
@@ -454,16 +604,18 @@ class KnowledgeBase:
                 step_by_step_reasoning=J.string(),
                 relevant_function_names=J.list_of(J.struct(name=J.string())),
             ),
+            key="retrieve_functions",
         )
         fns_string = ""
         valid_functions = []
+        skills_by_name = {f["name"]: f for f in skills}
         for function_name_struct in response["relevant_function_names"]:
             function_name = function_name_struct["name"]
             if "(" in function_name:
                 function_name = function_name[: function_name.index("(")]
-            function = next((f for f in skills if f["name"] == function_name), None)
+            function = skills_by_name.get(function_name)
             if function is not None:
-                fns_string += format_function_as_pretty_string(function)
+                fns_string += self.function_index.pretty_string(function_name)
                 valid_functions.append(function)
             else:
                 await aprint(
@@ -545,7 +697,7 @@ for function_name in {function_names}:
         for function_name, function in parsed_functions.items():
             if function_name not in function_names:
                 continue
-            
+
             function_ast = ast.parse(function["source"]).body[0]
             assert isinstance(function_ast, (ast.FunctionDef, ast.AsyncFunctionDef))
 
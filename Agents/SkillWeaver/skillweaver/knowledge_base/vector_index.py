@@ -0,0 +1,85 @@
+import numpy as np
+
+# Below this many vectors, one exact matrix-vector product is faster than any approximate search.
+APPROXIMATE_MIN_SIZE = 4096
+KMEANS_ITERATIONS = 8
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` highest scores, best first, without sorting all of them."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class ExactIndex:
+    """Cosine similarity against every row of a normalized matrix."""
+
+    def __init__(self, matrix: np.ndarray):
+        self.matrix = normalize_rows(matrix)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        return top_k(self.matrix @ normalize_rows(query)[0], k)
+
+
+class ApproximateIndex(ExactIndex):
+    """
+    Inverted-file index: the rows are clustered by spherical k-means, and a query only scores
+    the rows of the `n_probe` clusters whose centroids are closest to it.
+    """
+
+    def __init__(
+        self,
+        matrix: np.ndarray,
+        n_lists: int | None = None,
+        n_probe: int | None = None,
+        seed: int = 0,
+    ):
+        super().__init__(matrix)
+        n = len(self.matrix)
+        self.n_lists = max(1, min(n, n_lists or int(np.sqrt(n))))
+        self.n_probe = min(self.n_lists, n_probe or max(1, self.n_lists // 4))
+
+        rng = np.random.default_rng(seed)
+        centroids = self.matrix[rng.choice(n, self.n_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(self.matrix @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, self.matrix)
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+        self.centroids = centroids
+        assignment = np.argmax(self.matrix @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(self.n_lists + 1))
+        self.lists = [order[bounds[i] : bounds[i + 1]] for i in range(self.n_lists)]
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        query = normalize_rows(query)[0]
+        probed = top_k(self.centroids @ query, self.n_probe)
+        candidates = np.concatenate([self.lists[i] for i in probed])
+        if len(candidates) < k:
+            # Too few rows in the probed clusters: fall back to the exact search.
+            return super().search(query, k)
+        return candidates[top_k(self.matrix[candidates] @ query, k)]
+
+
+def build_vector_index(
+    matrix: np.ndarray, approximate: bool | None = None
+) -> ExactIndex:
+    """An exact index, or an approximate one for large matrices (`approximate=None`)."""
+    if approximate is None:
+        approximate = len(matrix) >= APPROXIMATE_MIN_SIZE
+    return ApproximateIndex(matrix) if approximate else ExactIndex(matrix)
@@ -16,8 +16,22 @@ from openai.types.chat import (
     ChatCompletionToolParam,
 )
 
+from skillweaver.util.completion_cache import (
+    CompletionCache,
+    completion_cache_key,
+    get_completion_cache,
+)
 from skillweaver.util.image_to_base64 import image_to_base64, image_to_data_url
 from skillweaver.util.perfmon import monitor
+from skillweaver.util.rate_limit import AdaptiveLimiter, classify_outcome, get_limiter
+from skillweaver.util.structured_output import (
+    JsonStreamParser,
+    embed_schema,
+    is_json_schema_rejection,
+    mark_json_schema_unsupported,
+    missing_required_keys,
+    supports_json_schema,
+)
 
 dotenv.load_dotenv()
 
@@ -26,6 +40,36 @@ NoArgs = object()
 
 ResponseFormatT = TypeVar("ResponseFormatT")
 
+# Admission priority of LM calls by key, lower first: the calls an agent step waits on
+# preempt background knowledge base work when the endpoint is saturated.
+PRIORITY_BY_KEY = {
+    "codegen": 0,
+    "locator_recovery": 0,
+    "evaluation": 0,
+    "check_success": 1,
+    "retrieve_functions": 1,
+    "propose_task": 1,
+    "test_case_arguments": 1,
+    "update_knowledge_base": 2,
+}
+DEFAULT_PRIORITY = 1
+
+
+def _estimate_prompt_tokens(messages: list[ChatCompletionMessageParam]) -> int:
+    # Rough, for the token budget only: ~4 characters per token, a flat cost per image.
+    tokens = 0
+    for message in messages:
+        content = message.get("content") or ""
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for part in content:
+            if part.get("type") == "text":
+                tokens += len(part.get("text", "")) // 4
+            else:
+                tokens += 1000
+    return tokens
+
 
 async def completion_openai(
     client: openai.AsyncAzureOpenAI | openai.AsyncOpenAI,
@@ -36,58 +80,69 @@ async def completion_openai(
     tools: list[Function] = [],
     args: dict = NoArgs,  # type: ignore
     key="general",
+    cache: CompletionCache | None = None,
+    limiter: AdaptiveLimiter | None = None,
+    priority: int = DEFAULT_PRIORITY,
 ) -> Any:
     if args is NoArgs:
         args = {}
     else:
         args = {**args}
 
+    cache_key = None
+    if cache is not None:
+        # Keyed on the request as given, before the schema is embedded for models without json_schema.
+        cache_key = completion_cache_key(
+            model,
+            {
+                "messages": messages,
+                "json_mode": json_mode,
+                "json_schema": json_schema,
+                "tools": tools,
+                "args": args,
+            },
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            result, prompt_tokens, cmpl_tokens = cached
+            monitor.log_token_usage(
+                key, "openai:" + model, prompt_tokens, cmpl_tokens, cached=True
+            )
+            return result
+
     tries = 5
     backoff = 4
+    content = None
     for i in range(tries):
         try:
             start_time = time.time()
 
+            request_messages = messages
+            schema_in_prompt = False
             if json_mode:
                 response_format = {"type": "json_object"}
             elif json_schema:
-                # 检查是否是 deepseek 系列模型
-                if "deepseek" in model.lower():
-                    # DeepSeek 不支持 'json_schema' 参数，必须降级为 'json_object'
-                    response_format = {"type": "json_object"}
-                    
-                    # 关键步骤：将 Schema 显式添加到 System Prompt 中
-                    # DeepSeek 只有看到 Prompt 里的 Schema 才知道要输出什么字段
-                    import json
-                    schema_str = json.dumps(json_schema, indent=2, ensure_ascii=False)
-                    
-                    # 找到 system message 并追加 schema 要求
-                    found_system = False
-                    for msg in messages:
-                        if msg["role"] == "system":
-                            msg["content"] += f"\n\nIMPORTANT: You must output a JSON object that strictly adheres to the following schema:\n```json\n{schema_str}\n```"
-                            found_system = True
-                            break
-                    
-                    # 如果没有 system message，就插在开头
-                    if not found_system:
-                         messages.insert(0, {
-                            "role": "system", 
-                            "content": f"You must output a JSON object that strictly adheres to the following schema:\n```json\n{schema_str}\n```"
-                        })
-                else:
+                if supports_json_schema(model):
                     # 对于 GPT-4o 等支持 Structured Outputs 的模型，保持原样
                     response_format = {
                         "type": "json_schema",
                         "json_schema": json_schema,
                     }
+                else:
+                    # DeepSeek 等模型不支持 'json_schema' 参数，降级为 'json_object'，
+                    # 并将 Schema 写入 System Prompt (副本，不修改调用方的 messages)
+                    response_format = {"type": "json_object"}
+                    request_messages = embed_schema(messages, json_schema)
+                    schema_in_prompt = True
             else:
                 response_format = {"type": "text"}
 
-            response: ChatCompletion = await client.chat.completions.create(
-                model=model,
-                messages=messages,  # type: ignore
-                response_format=response_format,  # type: ignore
+            # Prompt-embedded schemas are streamed: the call ends as soon as the object closes.
+            stream_json = schema_in_prompt and len(tools) == 0 and "stream" not in args
+            create_kwargs = {
+                "model": model,
+                "messages": request_messages,
+                "response_format": response_format,
                 **(
                     {
                         "tools": tools,
@@ -98,18 +153,67 @@ async def completion_openai(
                     else {}
                 ),
                 **args,
-            )
+            }
+
+            if limiter is not None:
+                reserved_tokens = _estimate_prompt_tokens(request_messages)
+                queue_wait = await limiter.acquire(priority, reserved_tokens)
+                monitor.log_queue_wait(key, limiter.name, priority, queue_wait)
+                start_time = time.time()
+
+            msg = None
+            usage = None
+            call_exception = None
+            try:
+                if stream_json:
+                    parser, usage = await _stream_json_object(client, create_kwargs)
+                    content = parser.text
+                else:
+                    response: ChatCompletion = await client.chat.completions.create(
+                        **create_kwargs  # type: ignore
+                    )
+                    msg = response.choices[0].message
+                    content = msg.content
+                    usage = response.usage
+                    assert usage
+            except BaseException as e:
+                call_exception = e
+                raise
+            finally:
+                if limiter is not None:
+                    if usage is not None:
+                        output_tokens = usage.completion_tokens
+                        tokens_used = usage.total_tokens
+                    elif call_exception is None:
+                        # The stream ended without a usage chunk: charge the estimates, so the call
+                        # still counts against the token budget and its latency per token.
+                        output_tokens = len(content or "") // 4
+                        tokens_used = reserved_tokens + output_tokens
+                    else:
+                        output_tokens = tokens_used = 0
+                    limiter.release(
+                        classify_outcome(call_exception),
+                        time.time() - start_time,
+                        output_tokens=output_tokens,
+                        tokens_used=tokens_used,
+                        tokens_reserved=reserved_tokens,
+                    )
 
             end_time = time.time()
             monitor.log_timing_event("lm/" + key, start_time, end_time)
-            assert response.usage
-            msg = response.choices[0].message
-            cmpl_tokens = response.usage.completion_tokens  # type: ignore
-            prompt_tokens = response.usage.prompt_tokens  # type: ignore
+            if usage is not None:
+                cmpl_tokens = usage.completion_tokens  # type: ignore
+                prompt_tokens = usage.prompt_tokens  # type: ignore
+            else:
+                # The stream ended without a usage chunk.
+                cmpl_tokens = len(content or "") // 4
+                prompt_tokens = _estimate_prompt_tokens(request_messages)
 
             monitor.log_token_usage(key, "openai:" + model, prompt_tokens, cmpl_tokens)
 
-            if len(tools) > 0:
+            if stream_json:
+                result = parser.result()
+            elif len(tools) > 0:
                 # Allow retries in case of errors.
                 fn_names = [t["name"] for t in tools]
                 # Assert that a tool call was made.
@@ -129,26 +233,49 @@ async def completion_openai(
 
                     raise
 
-                return {
+                result = {
                     "name": msg.tool_calls[0].function.name,
                     "arguments": arguments,
                 }
+            else:
+                if msg.content is None:
+                    await aioconsole.aprint("msg.content was None. msg:", msg)
 
-            if msg.content is None:
-                await aioconsole.aprint("msg.content was None. msg:", msg)
+                assert msg.content is not None
 
-            assert msg.content is not None
+                if json_mode or json_schema is not None:
+                    result = json.loads(msg.content)
+                else:
+                    result = msg.content
 
-            if json_mode or json_schema is not None:
-                return json.loads(msg.content)
-            else:
-                return msg.content
+            if schema_in_prompt:
+                # Nothing enforces the schema on the provider side.
+                missing = missing_required_keys(result, json_schema)
+                assert not missing, f"Missing keys in the JSON output: {missing}"
+
+            if cache is not None:
+                cache.put(cache_key, model, result, prompt_tokens, cmpl_tokens)
+            return result
         except Exception as e:
             if "JSON" in str(type(e)).upper():
                 await aioconsole.aprint("JSON error:")
-                await aioconsole.aprint("Content:", msg.content)
+                await aioconsole.aprint("Content:", content)
                 await aioconsole.aprint(e)
 
+            if (
+                json_schema is not None
+                and not json_mode
+                and supports_json_schema(model)
+                and is_json_schema_rejection(e)
+                and i < tries - 1
+            ):
+                # Remembered across runs: later calls go straight to prompt-embedded schemas.
+                await aioconsole.aprint(
+                    f"{model} rejected the json_schema response format. Switching to prompt-embedded schemas."
+                )
+                mark_json_schema_unsupported(model)
+                continue
+
             if i < tries - 1:
                 await aioconsole.aprint(f"Error: {e}. Retrying...")
                 await asyncio.sleep(backoff)
@@ -158,6 +285,37 @@ async def completion_openai(
                 raise
 
 
+# Chunks read after the streamed JSON object is complete while waiting for the usage chunk.
+STREAM_USAGE_MAX_TRAILING_CHUNKS = 32
+
+
+async def _stream_json_object(
+    client: openai.AsyncAzureOpenAI | openai.AsyncOpenAI, create_kwargs: dict
+) -> tuple[JsonStreamParser, Any]:
+    parser = JsonStreamParser()
+    usage = None
+    stream = await client.chat.completions.create(
+        **create_kwargs, stream=True, stream_options={"include_usage": True}
+    )
+    trailing_chunks = 0
+    try:
+        async for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+                break
+            if parser.done:
+                # The usage chunk comes after the last content chunk: keep draining for it, but
+                # only through a short tail of text after the object.
+                trailing_chunks += 1
+                if trailing_chunks > STREAM_USAGE_MAX_TRAILING_CHUNKS:
+                    break
+            elif chunk.choices and chunk.choices[0].delta.content:
+                parser.feed(chunk.choices[0].delta.content)
+    finally:
+        await stream.close()
+    return parser, usage
+
+
 def create_tool_description(tool: ChatCompletionToolParam):
     name = tool["function"]["name"]
     args_str = ", ".join(
@@ -226,11 +384,17 @@ class LM:
         model: str,
         max_concurrency=10,
         default_kwargs=None,
+        cache: CompletionCache | None = None,
     ):
         self.model = model
+        # Defaults to the cache configured by SKILLWEAVER_LM_CACHE (off unless set).
+        self.cache = cache if cache is not None else get_completion_cache()
+        if self.cache is not None:
+            monitor.track_completion_cache(self.cache)
         self.max_concurrency = max_concurrency
-        self.semaphore = asyncio.Semaphore(max_concurrency)
         self.client = _get_openai_client(model)
+        # Shared by all the LMs of the endpoint; `max_concurrency` is only its initial limit.
+        self.limiter = get_limiter(str(self.client.base_url), max_concurrency)
         self.default_kwargs = default_kwargs or {}
 
     def is_openai(self) -> bool:
@@ -266,21 +430,28 @@ class LM:
         json_schema=None,
         tools: list[Function] = [],
         key="general",
+        priority: int | None = None,
         **kwargs,
     ) -> Any:
-        async with self.semaphore:
-            if self.is_openai():
-                client_oai: openai.AsyncOpenAI | openai.AsyncAzureOpenAI = self.client  # type: ignore
-                return await completion_openai(
-                    client_oai,
-                    self.model,
-                    messages,
-                    json_mode,
-                    json_schema,
-                    tools,
-                    args={**self.default_kwargs, **kwargs},
-                    key=key,
-                )
+        if self.is_openai():
+            client_oai: openai.AsyncOpenAI | openai.AsyncAzureOpenAI = self.client  # type: ignore
+            return await completion_openai(
+                client_oai,
+                self.model,
+                messages,
+                json_mode,
+                json_schema,
+                tools,
+                args={**self.default_kwargs, **kwargs},
+                key=key,
+                cache=self.cache,
+                limiter=self.limiter,
+                priority=(
+                    priority
+                    if priority is not None
+                    else PRIORITY_BY_KEY.get(key, DEFAULT_PRIORITY)
+                ),
+            )
 
     async def json(
         self,
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Literal
+
+CacheMode = Literal["off", "read-through", "write-only", "replay"]
+CACHE_MODES = ("off", "read-through", "write-only", "replay")
+
+# "off" (default), "read-through", "write-only" (record a run) or "replay" (offline, misses raise).
+LM_CACHE_ENV = "SKILLWEAVER_LM_CACHE"
+LM_CACHE_PATH_ENV = "SKILLWEAVER_LM_CACHE_PATH"
+DEFAULT_CACHE_PATH = Path.home() / ".cache" / "skillweaver" / "completions.sqlite"
+
+
+class CompletionCacheMiss(KeyError):
+    pass
+
+
+def completion_cache_key(model: str, request: dict) -> str:
+    """
+    Content hash of a completion request: the model, messages, response format, tools and sampling
+    arguments (temperature, seed, ...). It must be computed before the request is adapted to the model.
+    """
+    payload = json.dumps(
+        {"model": model, **request}, sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    Parsed LM results keyed by `completion_cache_key`, in a SQLite file. Only results that passed
+    the checks of the completion (tool call made, valid JSON) are stored, so a replay returns
+    exactly what the recorded run saw.
+    """
+
+    def __init__(
+        self, path: str | Path = DEFAULT_CACHE_PATH, mode: CacheMode = "read-through"
+    ):
+        if mode not in CACHE_MODES:
+            raise ValueError(
+                f"Unknown LM cache mode {mode!r}, expected one of {CACHE_MODES}"
+            )
+        self.mode = mode
+        self.path = Path(path)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, result TEXT NOT NULL, "
+            "input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    @property
+    def reads(self) -> bool:
+        return self.mode in ("read-through", "replay")
+
+    @property
+    def writable(self) -> bool:
+        return self.mode in ("read-through", "write-only")
+
+    def get(self, key: str) -> tuple[Any, int, int] | None:
+        """The cached result with its recorded input and output token counts, or None."""
+        if not self.reads:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result, input_tokens, output_tokens FROM completions WHERE key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            if self.mode == "replay":
+                raise CompletionCacheMiss(
+                    f"No recorded completion for request {key[:12]} in {self.path} (replay mode)."
+                )
+            return None
+        self.hits += 1
+        return json.loads(row[0]), row[1], row[2]
+
+    def put(
+        self, key: str, model: str, result: Any, input_tokens: int, output_tokens: int
+    ):
+        if not self.writable:
+            return
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    model,
+                    json.dumps(result, ensure_ascii=False),
+                    input_tokens,
+                    output_tokens,
+                    time.time(),
+                ),
+            )
+            self._db.commit()
+        self.writes += 1
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+        }
+
+
+_default_cache: CompletionCache | None = None
+
+
+def get_completion_cache() -> CompletionCache | None:
+    """The cache configured by the environment, or None when caching is off."""
+    global _default_cache
+    mode = os.getenv(LM_CACHE_ENV, "off")
+    if mode == "off":
+        return None
+    if _default_cache is None or _default_cache.mode != mode:
+        path = os.getenv(LM_CACHE_PATH_ENV, str(DEFAULT_CACHE_PATH))
+        _default_cache = CompletionCache(path, mode)  # type: ignore
+    return _default_cache
@@ -23,6 +23,16 @@ class PerformanceMonitoring:
     def __init__(self):
         self.timing_events = []
         self.token_usages = []
+        self.queue_waits = []
+        # Completion caches of the LMs, with their (hits, misses, writes) at the last reset.
+        self.completion_caches = []
+        self._cache_baselines = []
+
+    def track_completion_cache(self, cache):
+        if any(tracked is cache for tracked in self.completion_caches):
+            return
+        self.completion_caches.append(cache)
+        self._cache_baselines.append((0, 0, 0))
 
     def log_timing_event(self, key: str, start_time: float, end_time: float):
         self.timing_events.append(
@@ -35,32 +45,73 @@ class PerformanceMonitoring:
         )
 
     def log_token_usage(
-        self, key: str, model: str, input_tokens: int, output_tokens: int
+        self,
+        key: str,
+        model: str,
+        input_tokens: int,
+        output_tokens: int,
+        cached: bool = False,
     ):
+        # Cached completions are logged with the token counts of the recorded call, at no price.
+        price = (
+            __COSTS__[model]["input"] * input_tokens
+            + __COSTS__[model]["output"] * output_tokens
+            if model in __COSTS__
+            else None
+        )
         self.token_usages.append(
             {
                 "key": key,
                 "model": model,
                 "input_tokens": input_tokens,
                 "output_tokens": output_tokens,
-                "price": (
-                    __COSTS__[model]["input"] * input_tokens
-                    + __COSTS__[model]["output"] * output_tokens
-                    if model in __COSTS__
-                    else None
-                ),
+                "price": 0.0 if cached and price is not None else price,
+                "cached": cached,
             }
         )
 
+    def log_queue_wait(self, key: str, endpoint: str, priority: int, wait: float):
+        # Time an LM call waited for a concurrency slot (and token budget) of its endpoint.
+        self.queue_waits.append(
+            {"key": key, "endpoint": endpoint, "priority": priority, "wait": wait}
+        )
+
+    def cache_stats(self):
+        # None when no LM uses a completion cache (SKILLWEAVER_LM_CACHE=off).
+        if not self.completion_caches:
+            return None
+        modes = {cache.mode for cache in self.completion_caches}
+        counters = [
+            (cache.hits - hits, cache.misses - misses, cache.writes - writes)
+            for cache, (hits, misses, writes) in zip(
+                self.completion_caches, self._cache_baselines
+            )
+        ]
+        cached = [usage for usage in self.token_usages if usage["cached"]]
+        return {
+            "mode": modes.pop() if len(modes) == 1 else "mixed",
+            "hits": sum(c[0] for c in counters),
+            "misses": sum(c[1] for c in counters),
+            "writes": sum(c[2] for c in counters),
+            "input_tokens_saved": sum(usage["input_tokens"] for usage in cached),
+            "output_tokens_saved": sum(usage["output_tokens"] for usage in cached),
+        }
+
     def as_dict(self):
         return {
             "timing_events": self.timing_events,
             "token_usages": self.token_usages,
+            "cache": self.cache_stats(),
+            "queue_waits": self.queue_waits,
         }
 
     def reset(self):
         self.timing_events = []
         self.token_usages = []
+        self.queue_waits = []
+        self._cache_baselines = [
+            (cache.hits, cache.misses, cache.writes) for cache in self.completion_caches
+        ]
 
 
 def get_call_trace():
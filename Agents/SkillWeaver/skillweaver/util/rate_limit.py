@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+
+# Tokens per minute allowed on every endpoint; unset means no token budget.
+LM_TPM_ENV = "SKILLWEAVER_LM_TPM"
+MIN_LIMIT = 1
+MAX_LIMIT = 64
+# Multiplicative decrease on a 429/5xx, and on sustained latency above LATENCY_FACTOR x the baseline.
+OVERLOAD_DECREASE = 0.5
+LATENCY_DECREASE = 0.9
+LATENCY_FACTOR = 2.0
+LATENCY_WARMUP_CALLS = 5
+
+
+def classify_outcome(exception: BaseException | None) -> str:
+    if exception is None:
+        return "ok"
+    status_code = getattr(exception, "status_code", None)
+    if status_code == 429:
+        return "rate_limited"
+    if (status_code is not None and status_code >= 500) or isinstance(
+        exception, (asyncio.TimeoutError, TimeoutError)
+    ):
+        return "server_error"
+    if type(exception).__name__ in ("APITimeoutError", "APIConnectionError"):
+        return "server_error"
+    return "error"
+
+
+class TokenBucket:
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.level = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def reserve(self, tokens: int):
+        tokens = min(tokens, self.capacity)
+        while True:
+            self._refill()
+            if self.level >= tokens:
+                self.level -= tokens
+                return
+            await asyncio.sleep((tokens - self.level) / self.rate)
+
+    def adjust(self, tokens: int):
+        """Charge the difference between the tokens used and the tokens reserved."""
+        self._refill()
+        self.level -= tokens
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit of one endpoint. The limit grows by one per window of successful calls,
+    halves on rate limits and server errors, and shrinks when the latency of successful calls climbs
+    well above its baseline. Waiting calls are admitted by priority (lower first), then in order.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int = 10,
+        min_limit: int = MIN_LIMIT,
+        max_limit: int = MAX_LIMIT,
+        tokens_per_minute: int | None = None,
+    ):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.outcomes = {"ok": 0, "rate_limited": 0, "server_error": 0, "error": 0}
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._order = itertools.count()
+        self._last_decrease = 0.0
+        self._calls = 0
+        self._latency_baseline: float | None = None
+        self._latency_recent: float | None = None
+
+    @property
+    def capacity(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def _wake(self):
+        while self._waiters and self.in_flight < self.capacity:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():  # Cancelled while waiting.
+                continue
+            self.in_flight += 1
+            future.set_result(None)
+
+    async def acquire(self, priority: int = 1, tokens: int = 0) -> float:
+        """Wait for a slot (and for `tokens` of the token budget). Returns the time waited."""
+        start = time.monotonic()
+        if not self._waiters and self.in_flight < self.capacity:
+            self.in_flight += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._order), future))
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # The slot was granted just as the waiting call got cancelled.
+                    self.in_flight -= 1
+                    self._wake()
+                raise
+        if self.tokens is not None and tokens > 0:
+            try:
+                await self.tokens.reserve(tokens)
+            except asyncio.CancelledError:
+                self.in_flight -= 1
+                self._wake()
+                raise
+        return time.monotonic() - start
+
+    def _decrease(self, factor: float, started: float):
+        # At most one decrease per window: the calls that were already in flight when the limit
+        # was last decreased do not decrease it again.
+        if started >= self._last_decrease:
+            self.limit = max(self.min_limit, self.limit * factor)
+            self._last_decrease = time.monotonic()
+
+    def release(
+        self,
+        outcome: str,
+        latency: float,
+        output_tokens: int = 0,
+        tokens_used: int = 0,
+        tokens_reserved: int = 0,
+    ):
+        saturated = self.in_flight >= self.capacity
+        self.in_flight -= 1
+        self.outcomes[outcome] += 1
+        started = time.monotonic() - latency
+        if self.tokens is not None and (tokens_used or tokens_reserved):
+            self.tokens.adjust(tokens_used - tokens_reserved)
+
+        if outcome in ("rate_limited", "server_error"):
+            self._decrease(OVERLOAD_DECREASE, started)
+        elif outcome == "ok":
+            # Seconds per output token, so that long generations do not look like an overloaded endpoint.
+            sample = latency / max(1, output_tokens)
+            self._calls += 1
+            if self._latency_baseline is None:
+                self._latency_baseline = self._latency_recent = sample
+            else:
+                self._latency_baseline += 0.05 * (sample - self._latency_baseline)
+                self._latency_recent += 0.3 * (sample - self._latency_recent)
+            if (
+                self._calls > LATENCY_WARMUP_CALLS
+                and self._latency_recent > LATENCY_FACTOR * self._latency_baseline
+            ):
+                self._decrease(LATENCY_DECREASE, started)
+            elif saturated:
+                # Only a limit that is actually reached is evidence that more concurrency is needed.
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": sum(not future.done() for _, _, future in self._waiters),
+            **self.outcomes,
+        }
+
+
+_limiters: dict[str, AdaptiveLimiter] = {}
+
+
+def get_limiter(endpoint: str, initial_limit: int = 10) -> AdaptiveLimiter:
+    """The limiter shared by all the LMs of an endpoint; the first LM sets its initial limit."""
+    if endpoint not in _limiters:
+        tpm = os.getenv(LM_TPM_ENV)
+        _limiters[endpoint] = AdaptiveLimiter(
+            endpoint,
+            initial_limit,
+            max_limit=max(MAX_LIMIT, initial_limit),
+            tokens_per_minute=int(tpm) if tpm else None,
+        )
+    return _limiters[endpoint]
@@ -0,0 +1,156 @@
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any
+
+# Models whose structured outputs are requested as `json_object` with the schema embedded in the
+# prompt, because the provider rejects `response_format={"type": "json_schema"}`.
+STRUCTURED_OUTPUT_CACHE_ENV = "SKILLWEAVER_STRUCTURED_OUTPUT_CACHE"
+DEFAULT_CACHE_PATH = (
+    Path.home() / ".cache" / "skillweaver" / "structured_output_capabilities.json"
+)
+# Known without a failed request.
+PROMPT_SCHEMA_MODEL_PATTERNS = ("deepseek",)
+
+_lock = threading.Lock()
+_capabilities: dict[str, str] | None = None
+
+
+def _cache_path() -> Path:
+    return Path(os.getenv(STRUCTURED_OUTPUT_CACHE_ENV, str(DEFAULT_CACHE_PATH)))
+
+
+def _load() -> dict[str, str]:
+    global _capabilities
+    if _capabilities is None:
+        try:
+            with open(_cache_path()) as f:
+                _capabilities = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _capabilities = {}
+    return _capabilities
+
+
+def supports_json_schema(model: str) -> bool:
+    if any(pattern in model.lower() for pattern in PROMPT_SCHEMA_MODEL_PATTERNS):
+        return False
+    return _load().get(model, "json_schema") == "json_schema"
+
+
+def mark_json_schema_unsupported(model: str):
+    """Switch the model to prompt-embedded schemas, for this process and the next runs."""
+    with _lock:
+        capabilities = _load()
+        if capabilities.get(model) == "prompt_schema":
+            return
+        capabilities[model] = "prompt_schema"
+        path = _cache_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(capabilities, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def is_json_schema_rejection(exception: BaseException) -> bool:
+    """A 400 error of the provider about the `json_schema` response format."""
+    if getattr(exception, "status_code", None) != 400:
+        return False
+    message = str(exception).lower()
+    return "response_format" in message or "json_schema" in message
+
+
+def embed_schema(messages: list, json_schema: dict) -> list:
+    """
+    A copy of the messages asking for a JSON object that follows the schema in the system prompt
+    (the messages of the caller are left untouched, also across retries).
+    """
+    schema_str = json.dumps(json_schema, indent=2, ensure_ascii=False)
+    instruction = f"You must output a JSON object that strictly adheres to the following schema:\n```json\n{schema_str}\n```"
+    messages = list(messages)
+    for i, message in enumerate(messages):
+        if message["role"] == "system":
+            content = message["content"]
+            if isinstance(content, str):
+                content = content + "\n\nIMPORTANT: " + instruction
+            else:
+                content = [
+                    *content,
+                    {"type": "text", "text": "IMPORTANT: " + instruction},
+                ]
+            messages[i] = {**message, "content": content}
+            return messages
+    return [{"role": "system", "content": instruction}, *messages]
+
+
+def missing_required_keys(value: Any, json_schema: dict) -> list[str]:
+    """Top-level keys required by the schema (`{"name", "schema"}` or a bare schema) but absent."""
+    schema = json_schema.get("schema", json_schema)
+    if not isinstance(value, dict):
+        return list(schema.get("required", []))
+    return [key for key in schema.get("required", []) if key not in value]
+
+
+class JsonStreamParser:
+    """
+    Incremental parser of a JSON object in streamed model output. Text before the object (such as a
+    markdown fence) is skipped, and the object is complete as soon as its closing brace arrives, so
+    the stream can be closed without waiting for trailing text.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._start = -1
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._scanned = 0
+        self.end = -1
+
+    @property
+    def done(self) -> bool:
+        return self.end >= 0
+
+    def feed(self, chunk: str) -> bool:
+        """Returns whether the top-level object is complete."""
+        if self.done:
+            return True
+        self.text += chunk
+        text = self.text
+        for i in range(self._scanned, len(text)):
+            c = text[i]
+            if self._start < 0:
+                if c == "{":
+                    self._start = i
+                    self._depth = 1
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == "\\":
+                    self._escaped = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c in "{[":
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self.end = i + 1
+                    self._scanned = i + 1
+                    return True
+        self._scanned = len(text)
+        return False
+
+    def result(self) -> Any:
+        """
+        The parsed object. An incomplete stream falls back to parsing the whole text, so that
+        the usual JSONDecodeError is raised (and retried) for output that is not JSON.
+        """
+        if self.done:
+            return json.loads(self.text[self._start : self.end])
+        return json.loads(self.text)